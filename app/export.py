@@ -0,0 +1,226 @@
+"""
+无界面导出：不启动网页服务，直接运行弹幕采集，把消息流式写到标准输出、文件或命名管道，供其他程序消费。
+
+用法：
+    python app/export.py 21452505 22637261                      # NDJSON 写到标准输出
+    python app/export.py 21452505 -o danmaku.bin -f binary       # 紧凑二进制记录（格式见 services/danmaku_codec.py）
+    mkfifo /tmp/dm && python app/export.py 21452505 -o /tmp/dm --overflow block
+
+--overflow 决定下游读得慢时怎么办：
+    block        不丢消息，各房间连接暂停读取，背压一路传回弹幕服务器（长时间阻塞可能被服务器断开后重连）
+    drop         丢弃新消息
+    drop-oldest  丢弃队列里最旧的消息（网页端的默认行为）
+
+退出时（Ctrl+C、--duration 到期或下游关闭管道）在标准错误输出吞吐量统计。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, List, Optional
+
+# 将 vendored 的依赖加入 sys.path
+root_dir = Path(__file__).resolve().parents[1]
+for p in ((root_dir / "vendor").as_posix(), (root_dir / "blivedm").as_posix()):
+    if Path(p).exists() and p not in sys.path:
+        sys.path.insert(0, p)
+
+from services.danmaku_codec import encode_item  # noqa: E402
+from services.items import DanmakuItem, EventItem  # noqa: E402
+
+logger = logging.getLogger('multiplelive')
+
+_BATCH = 512  # 每次最多从队列取多少条一起编码、写出
+
+
+class _Stats:
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.items = 0
+        self.bytes = 0
+        self.skipped = 0  # 二进制格式容纳不了的事件消息
+        self.max_depth = 0
+        self.per_room: Counter = Counter()
+
+    def report(self, dropped: int) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        lines = [
+            f"exported {self.items} items, {self.bytes / 1024 / 1024:.2f} MiB in {elapsed:.1f}s "
+            f"({self.items / elapsed:.1f} items/s, {self.bytes / elapsed / 1024:.1f} KiB/s)",
+            f"dropped {dropped}, skipped {self.skipped}, max queue depth {self.max_depth}",
+        ]
+        if self.per_room:
+            top = ", ".join(f"{rid}={n}" for rid, n in self.per_room.most_common(10))
+            lines.append(f"per room: {top}")
+        return "\n".join(lines)
+
+
+def _encode_ndjson(item: DanmakuItem) -> bytes:
+    return (json.dumps(item.__dict__, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _open_output(path: str) -> BinaryIO:
+    """'-' 为标准输出；命名管道在有读者打开之前会阻塞，所以放在线程池里调用"""
+    if path == "-":
+        return sys.stdout.buffer
+    return open(path, "ab", buffering=1024 * 1024)
+
+
+class _Writer:
+    """
+    从采集队列取消息，分配序号、编码后写出。写在单独的线程里进行，下游读得慢时写会阻塞，
+    这期间不再取队列，队列满后由采集端按 --overflow 处理。
+    """
+
+    def __init__(self, queue: "asyncio.Queue[DanmakuItem]", out: BinaryIO, binary: bool, stats: _Stats) -> None:
+        self.queue = queue
+        self.out = out
+        self.binary = binary
+        self.stats = stats
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export-writer")
+        self._seq = 0
+
+    async def run(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            self.stats.max_depth = max(self.stats.max_depth, self.queue.qsize() + 1)
+            await self._write(self._take(batch))
+
+    async def drain(self) -> None:
+        """采集停止后把队列里剩下的写完"""
+        while not self.queue.empty():
+            await self._write(self._take([]))
+
+    def _take(self, batch: List[DanmakuItem]) -> List[DanmakuItem]:
+        while len(batch) < _BATCH and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _write(self, batch: List[DanmakuItem]) -> None:
+        chunks: List[bytes] = []
+        rooms: List[int] = []
+        for item in batch:
+            self._seq += 1
+            item.seq = self._seq
+            if self.binary:
+                if isinstance(item, EventItem):
+                    self.stats.skipped += 1
+                    continue
+                chunks.append(encode_item(item))
+            else:
+                chunks.append(_encode_ndjson(item))
+            rooms.append(item.room_id)
+        if not chunks:
+            return
+        data = b"".join(chunks)
+        write = asyncio.get_running_loop().run_in_executor(self.executor, _write_all, self.out, data)
+        try:
+            await asyncio.shield(write)
+        except asyncio.CancelledError:
+            # 写线程仍会把这一批写完，计入统计后再退出
+            await write
+            raise
+        finally:
+            if write.done() and not write.cancelled() and write.exception() is None:
+                self.stats.items += len(chunks)
+                self.stats.bytes += len(data)
+                self.stats.per_room.update(rooms)
+
+
+def _write_all(out: BinaryIO, data: bytes) -> None:
+    out.write(data)
+    out.flush()
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="无界面导出直播弹幕")
+    parser.add_argument("rooms", nargs="+", help="房间号或直播间链接")
+    parser.add_argument("-o", "--output", default="-", help="输出文件或命名管道，默认标准输出")
+    parser.add_argument("-f", "--format", choices=("ndjson", "binary"), default="ndjson",
+                        help="ndjson 每行一条 JSON（含礼物等事件）；binary 为紧凑二进制记录（只含普通弹幕）")
+    parser.add_argument("--overflow", choices=("block", "drop", "drop-oldest"), default="block",
+                        help="下游来不及读时的处理方式，默认 block")
+    parser.add_argument("--queue-size", type=int, default=4096, help="采集与写出之间的队列长度")
+    parser.add_argument("--duration", type=float, default=0, help="运行多少秒后退出，0 表示一直运行")
+    parser.add_argument("--sessdata", default=None, help="B 站 SESSDATA，也可用环境变量 BILI_SESSDATA")
+    parser.add_argument("--interact-sample", type=float, default=0.0, help="进房/关注单条事件的抽样比例")
+    parser.add_argument("-v", "--verbose", action="store_true", help="在标准错误输出运行日志")
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace) -> int:
+    from services.danmaku_service import DanmakuCollector
+    from services.stream_resolver import resolve_room_id
+
+    loop = asyncio.get_running_loop()
+    rooms = [await loop.run_in_executor(None, resolve_room_id, r, args.sessdata) for r in args.rooms]
+    collector = DanmakuCollector(rooms, queue_maxsize=args.queue_size, interact_sample=args.interact_sample,
+                                 overflow=args.overflow.replace("-", "_"))
+    out = await loop.run_in_executor(None, _open_output, args.output)
+    stats = _Stats()
+    writer = _Writer(collector.queue, out, args.format == "binary", stats)
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows
+            pass
+
+    collect_task = asyncio.create_task(collector.start())
+    write_task = asyncio.create_task(writer.run())
+    stop_task = asyncio.create_task(stop.wait())
+    waiters = {collect_task, write_task, stop_task}
+    exit_code = 0
+    output_closed = False
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=args.duration or None, return_when=asyncio.FIRST_COMPLETED)
+        if write_task in done and write_task.exception() is not None:
+            exc = write_task.exception()
+            if isinstance(exc, BrokenPipeError):
+                logger.info("Output closed by reader")
+                output_closed = True
+                if out is sys.stdout.buffer:
+                    # 读端已关闭，解释器退出时再刷新标准输出会报错
+                    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            else:
+                logger.error(f"Export writer failed: {exc!r}")
+                exit_code = 1
+    finally:
+        collect_task.cancel()
+        stop_task.cancel()
+        # 先停采集再停写出：block 模式下暂存在采集端的消息要靠写出腾出队列空间才能送进来
+        await collector.stop()
+        write_task.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        dropped = collector.handler.dropped if collector.handler is not None else 0
+        try:
+            if not output_closed and not exit_code:
+                await writer.drain()
+            await loop.run_in_executor(writer.executor, out.flush)
+            if out is not sys.stdout.buffer:
+                out.close()
+        except (BrokenPipeError, ValueError):
+            pass
+        writer.executor.shutdown(wait=False)
+        print(stats.report(dropped), file=sys.stderr)
+    return exit_code
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, stream=sys.stderr,
+                        format="%(asctime)s | %(levelname)s | %(message)s", datefmt="%H:%M:%S")
+    logging.getLogger('blivedm').setLevel(logging.ERROR)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,12 @@
 import logging
 import sys
+import time
 from pathlib import Path
 
-from aiohttp import web
+# 标准库模块在解释器启动时大多已加载，计时从第三方依赖开始
+_import_started = time.perf_counter()
+
+from aiohttp import web  # noqa: E402
 
 # 将 vendored 的依赖加入 sys.path
 root_dir = Path(__file__).resolve().parents[1]
@@ -12,23 +16,68 @@ for p in (vendor_path, legacy_blivedm_path):
     if Path(p).exists() and p not in sys.path:
         sys.path.insert(0, p)
 
-from routes.api import api_resolve, api_start_dm, api_stop  # noqa: E402
-from routes.static import index  # noqa: E402
-from routes.ws import ws_danmaku  # noqa: E402
+from routes.api import (  # noqa: E402
+    api_archive_query, api_archive_search, api_dm_history, api_dm_status, api_hls_status, api_live_status,
+    api_resolve, api_start_dm, api_stop, hls_playlist, hls_segment,
+)
+from routes.static import index, vendor_asset  # noqa: E402
+from routes.ws import ws_danmaku, ws_stats  # noqa: E402
 from state import AppState  # noqa: E402
 
+# 启动时只导入提供页面与 API 所需的模块；blivedm、requests 等在第一次用到时才导入
+_import_seconds = time.perf_counter() - _import_started
+
+
+async def _on_startup(app: web.Application) -> None:
+    state: AppState = app["state"]
+    await state.bootstrap_cache.async_load()
+    state.live_status.start()
+    if state.archive:
+        await state.archive.start()
+        state.search.start()
+
+
+async def _on_cleanup(app: web.Application) -> None:
+    state: AppState = app["state"]
+    state.sessions.close()
+    if state.collector:
+        await state.collector.stop()
+    await state.bootstrap_cache.flush()
+    if state.archive:
+        await state.archive.close()
+        state.search.close()
+    if state.shm_ring:
+        state.shm_ring.close()
+    await state.hls_relay.close()
+    await state.live_status.close()
+    if state.watchdog:
+        await state.watchdog.close()
+        state.watchdog = None
+
 
 def create_app() -> web.Application:
     """创建并配置 aiohttp 应用"""
     app = web.Application()
     app["state"] = AppState()
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
 
     # 路由注册
     app.router.add_get('/', index)
+    app.router.add_get('/vendor/{name}', vendor_asset)
     app.router.add_get('/ws/danmaku', ws_danmaku)
+    app.router.add_get('/ws/stats', ws_stats)
     app.router.add_post('/api/resolve', api_resolve)
     app.router.add_post('/api/danmaku/start', api_start_dm)
+    app.router.add_get('/api/danmaku/status', api_dm_status)
+    app.router.add_get('/api/danmaku/history', api_dm_history)
+    app.router.add_get('/api/archive/query', api_archive_query)
+    app.router.add_get('/api/archive/search', api_archive_search)
     app.router.add_post('/api/stop', api_stop)
+    app.router.add_get('/api/hls/status', api_hls_status)
+    app.router.add_get('/api/live/status', api_live_status)
+    app.router.add_get('/hls/{stream_id}/index.m3u8', hls_playlist)
+    app.router.add_get('/hls/{stream_id}/seg/{name}', hls_segment)
 
     return app
 
@@ -76,8 +125,37 @@ def find_available_port(start_port=8090, max_attempts=10):
             continue
     raise RuntimeError(f"无法找到可用端口，尝试了 {max_attempts} 个端口")
 
+
+def import_report(top: int = 25) -> int:
+    """在子进程里用 -X importtime 导入本模块，按累计耗时列出最慢的模块"""
+    import subprocess
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=Path(__file__).resolve().parent, capture_output=True, text=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+    if proc.returncode != 0 or not rows:
+        print(proc.stderr, file=sys.stderr)
+        return 1
+    total = max(r[0] for r in rows)
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+    print(f"\n{len(rows)} modules, import main: {total / 1000:.1f} ms")
+    return 0
+
+
 if __name__ == '__main__':
+    if '--import-report' in sys.argv:
+        sys.exit(import_report())
     configure_logging()
+    logging.info(f'Imports finished in {_import_seconds * 1000:.0f} ms')
     try:
         port = find_available_port()
         logging.info(f'MultipleLive server starting on http://127.0.0.1:{port}')
@@ -1,36 +1,274 @@
 import asyncio
+import functools
 import json
 import logging
-from typing import Dict, List
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
 
 from aiohttp import web
 
-from services.danmaku_service import DanmakuItem
-from services.stream_resolver import pick_best_hls, resolve_room_id
+from services.items import DanmakuItem, EventItem
+from services.sessions import Session, SessionLimitError, encode_body
+from services.stream_resolver import get_room_id, resolve_hls_candidates, resolve_room_id
+from services.stream_watchdog import watch_key
+from services.viewer import Viewer
 from state import AppState
 
+if TYPE_CHECKING:
+    from services.danmaku_service import DanmakuCollector
+    from services.stream_watchdog import StreamWatch, StreamWatchdog
+
 logger = logging.getLogger('multiplelive')
 
 
+def _relay_url(req: web.Request, upstream: str, audio_only: bool = False, fallbacks: Sequence[str] = ()) -> str:
+    """登记到 HLS 中继，返回播放器使用的本地地址（绝对地址，前端页面可能不是由后端提供的）"""
+    state: AppState = req.app["state"]
+    return str(req.url.origin()) + state.hls_relay.register(upstream, audio_only, fallbacks)
+
+
+def _rewatch(spec: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """看护判定地址失效后重新解析，在线程池中调用"""
+    rid = resolve_room_id(spec["source"], sessdata=spec["sessdata"])
+    candidates, _ = resolve_hls_candidates(rid, sessdata=spec["sessdata"], audio_only=spec["audio_only"],
+                                           probe=True, policy=spec["policy"])
+    return candidates[0]["url"], [c["url"] for c in candidates[1:]]
+
+
+# 开播状态跟踪中采集这一使用者的标识；解析与状态查询不带标识，按租期过期
+_COLLECTOR = "collector"
+
+
+async def _refresh_live(state: AppState, rooms: List[int], max_age: Optional[float] = None,
+                        timeout: float = 1.0, owner: Optional[str] = None) -> None:
+    """
+    开始跟踪这些房间的开播状态，并在限定时间内补查状态未知或过旧的房间。
+    只是用来排序和跳过未开播房间的参考，查不到时按未知处理，不为它拖慢启动。
+    owner 为 None 时只是一次询问，房间在租期内没人再问就不再跟踪
+    """
+    state.live_status.track(rooms, owner=owner)
+    try:
+        await asyncio.wait_for(state.live_status.refresh(rooms, max_age=max_age), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+def _get_watchdog(state: AppState) -> "StreamWatchdog":
+    if state.watchdog is None:
+        from services.stream_watchdog import StreamWatchdog
+
+        def notify(watch: "StreamWatch") -> None:
+            url, fallbacks = watch.url, watch.fallbacks
+            if watch.spec["relay"] and state.hls_relay.is_allowed(url):
+                url = watch.spec["origin"] + state.hls_relay.register(url, watch.spec["audio_only"], fallbacks)
+                fallbacks = []
+            watch.message = json.dumps({"type": "stream", "watch_id": watch.watch_id,
+                                        "generation": watch.generation, "url": url, "fallbacks": fallbacks})
+            _push_all(state.ws_clients, watch.message)
+
+        def on_idle(watchdog: "StreamWatchdog") -> None:
+            # 看护的生命周期跟随地址自身的空闲过期，而不是会话数：会话停了但页面还在播放时仍需看护
+            if state.watchdog is watchdog:
+                state.watchdog = None
+
+        state.watchdog = StreamWatchdog(_rewatch, notify, has_viewers=lambda: bool(state.ws_clients), on_idle=on_idle)
+    return state.watchdog
+
+
 async def api_resolve(req: web.Request) -> web.Response:
-    """解析房间 URL/ID 为 m3u8 直链，同时返回真实 room_id"""
+    """
+    解析房间 URL/ID 为 m3u8 直链，同时返回真实 room_id。
+    同一路流在各 CDN 节点上的地址并发探测（probe 为 false 时跳过），url 为最快的节点，
+    fallbacks 为其余节点按速度排序，播放出错时依次切换；candidates 为各节点的探测结果。
+    policy 为 "low_latency" 时在各封装中选估计延迟最低的一路，selection 给出选择依据。
+    解析房间得到的地址默认由后端看护（watch 为 false 时不看护）：地址失效时自动换节点或重新解析，
+    通过 /ws/danmaku 推送 {"type": "stream", "watch_id", "generation", "url", "fallbacks"}。
+    已知未开播的房间直接返回 409 与 "room offline"，不再逐档尝试解析；force 为 true 时照常解析。
+    payload 中 relay 为 true（或设置了环境变量 MULTIPLELIVE_HLS_RELAY=1）时返回经本地 /hls/ 中继的地址，
+    由中继负责切换节点，upstream 字段为原始直链。只中继 B 站 CDN 域名的地址：直接给出的其他地址要求中继时返回 400，
+    解析得到的地址不在允许的域名内时不经中继直接返回。
+    请求体必须是 Content-Type: application/json，其他网页无法不经预检就跨域发起解析。
+    audio_only 为 true 时按音源解析（最低画质、优先 TS），经中继时分片只保留音频包。
+    """
+    state: AppState = req.app["state"]
+    if req.content_type != 'application/json':
+        return web.json_response({"ok": False, "error": "Content-Type must be application/json"}, status=415)
     payload = await req.json()
     source = str(payload.get('source', '')).strip()
     sessdata = str(payload.get('sessdata', '')).strip() or None
+    relay = bool(payload.get('relay', state.hls_relay_default))
+    audio_only = bool(payload.get('audio_only', False))
+    probe = bool(payload.get('probe', True))
+    policy = str(payload.get('policy', 'default'))
+    if policy not in ('default', 'low_latency'):
+        return web.json_response({"ok": False, "error": f"unknown policy: {policy}"}, status=400)
     if not source:
         return web.json_response({"ok": False, "error": "empty source"}, status=400)
     try:
+        loop = asyncio.get_running_loop()
         if source.startswith('http://') or source.startswith('https://'):
-            return web.json_response({"ok": True, "url": source, "room_id": None})
-        rid = resolve_room_id(source, sessdata=sessdata)
-        url = pick_best_hls(rid, sessdata=sessdata)
-        return web.json_response({"ok": True, "url": url, "room_id": rid})
+            if relay and not state.hls_relay.is_allowed(source):
+                return web.json_response({"ok": False, "error": "host not allowed for relay"}, status=400)
+            rid = None
+            candidates = [{"url": source}]
+            selection: Dict[str, Any] = {"policy": "direct", "reasons": ["直接使用给定的地址"]}
+        else:
+            # 解析含网络请求与 CDN 探测，在线程池中执行
+            rid = await loop.run_in_executor(None, resolve_room_id, source, sessdata)
+            await _refresh_live(state, [rid], max_age=10)
+            if state.live_status.is_live(rid) is False and not payload.get('force'):
+                return web.json_response({"ok": False, "error": "room offline", "room_id": rid, "live": False},
+                                         status=409)
+            candidates, selection = await loop.run_in_executor(
+                None, functools.partial(resolve_hls_candidates, rid, sessdata=sessdata, audio_only=audio_only,
+                                        probe=probe, policy=policy)
+            )
+        url = candidates[0]["url"]
+        fallbacks = [c["url"] for c in candidates[1:]]
+        relay = relay and '.m3u8' in url and state.hls_relay.is_allowed(url)
+        watch_id = None
+        if rid is not None and payload.get('watch', True):
+            watch_id = watch_key(source, audio_only, policy, relay)
+            spec = {"source": source, "sessdata": sessdata, "audio_only": audio_only, "policy": policy,
+                    "relay": relay, "origin": str(req.url.origin())}
+            _get_watchdog(state).watch(watch_id, spec, url, fallbacks)
+        if relay:
+            return web.json_response({"ok": True, "url": _relay_url(req, url, audio_only, fallbacks),
+                                      "upstream": url, "fallbacks": [], "candidates": candidates,
+                                      "selection": selection, "watch_id": watch_id, "room_id": rid},
+                                     dumps=lambda o: json.dumps(o, ensure_ascii=False))
+        return web.json_response({"ok": True, "url": url, "fallbacks": fallbacks, "candidates": candidates,
+                                  "selection": selection, "watch_id": watch_id, "room_id": rid},
+                                 dumps=lambda o: json.dumps(o, ensure_ascii=False))
     except Exception as e:
         return web.json_response({"ok": False, "error": str(e)}, status=500)
 
 
+async def hls_playlist(req: web.Request) -> web.Response:
+    """中继的 m3u8：所有播放器共用同一个上游轮询，分片地址已改写到 /hls/<id>/seg/"""
+    state: AppState = req.app["state"]
+    text = await state.hls_relay.playlist(req.match_info["stream_id"])
+    if text is None:
+        raise web.HTTPNotFound()
+    return web.Response(text=text, content_type="application/vnd.apple.mpegurl", headers={"Cache-Control": "no-cache"})
+
+
+async def hls_segment(req: web.Request) -> web.StreamResponse:
+    """中继的分片：优先读缓存，否则加入（或发起）唯一的一次上游下载"""
+    state: AppState = req.app["state"]
+    return await state.hls_relay.serve_segment(req, req.match_info["stream_id"], req.match_info["name"])
+
+
+async def api_hls_status(req: web.Request) -> web.Response:
+    """HLS 中继统计：上游/下发字节数、缓存占用、共享下载次数；以及播放地址看护状态"""
+    state: AppState = req.app["state"]
+    return web.json_response({"ok": True, **state.hls_relay.stats(),
+                              "watchdog": state.watchdog.stats() if state.watchdog else None})
+
+
+# 每秒统计快照超过这么多房间时在线程池中序列化
+_STATS_INLINE_ROOMS = 50
+
+
+def _ensure_collector(state: AppState) -> "DanmakuCollector":
+    """所有会话共用一个采集器与广播任务，第一次启动采集时创建"""
+    if state.collector is not None:
+        return state.collector
+    # 采集依赖 blivedm 及其协议解析，第一次启动采集时才导入
+    from services.analytics import render_rooms, stats_message
+    from services.danmaku_service import DanmakuCollector
+    collector = state.collector = DanmakuCollector((), bootstrap_cache=state.bootstrap_cache)
+    state.sessions.on_expire = functools.partial(_close_session, state)
+
+    async def broadcast_loop() -> None:
+        first_dm_logged = False
+        while True:
+            item: DanmakuItem = await collector.queue.get()
+            state.history.append(item)
+            # 归档记录格式只容纳普通弹幕
+            if state.archive and not isinstance(item, EventItem):
+                state.archive.append(item)
+            if state.shm_ring and not isinstance(item, EventItem):
+                state.shm_ring.append(item)
+            # 仅首次打印样本
+            if not first_dm_logged:
+                logger.info(f"First DM sample: room={item.room_id} color={item.color} msg={item.msg[:20]}")
+                first_dm_logged = True
+            body = encode_body(item)
+            msg = f'{body}, "color": {json.dumps(item.color)}}}'
+            state.replay.append(item.seq, msg)
+            _push_all(state.all_rooms_viewers, msg)
+            for session in state.sessions.for_room(item.room_id):
+                if session.accepts(item, collector.interact_sample):
+                    session.deliver(item, body)
+
+    async def stats_loop() -> None:
+        # 每秒推送一次各房间统计：只计算有订阅者的房间，每个房间只序列化一次，各订阅者的消息按房间拼接
+        while True:
+            await asyncio.sleep(1)
+            sessions = [s for s in state.sessions if s.stats_viewers]
+            if not state.stats_clients and not sessions:
+                continue
+            now = time.time()
+            wanted = None if state.stats_clients else set().union(*(s.rooms for s in sessions))
+            snapshots = collector.analytics.room_snapshots(now, wanted)
+            if len(snapshots) > _STATS_INLINE_ROOMS:
+                # 房间多时序列化放到线程池，事件循环不被一整段 JSON 编码卡住
+                rendered = await asyncio.get_running_loop().run_in_executor(None, render_rooms, snapshots)
+            else:
+                rendered = render_rooms(snapshots)
+            if state.stats_clients:
+                _push_all(state.stats_clients, stats_message(now, rendered))
+            for session in sessions:
+                _push_all(session.stats_viewers, stats_message(now, rendered, session.rooms))
+
+    state.broadcast_task = asyncio.create_task(broadcast_loop())
+    state.stats_task = asyncio.create_task(stats_loop())
+    asyncio.create_task(collector.start())
+    return collector
+
+
+def _push_all(viewers: List[Viewer], msg: str) -> None:
+    for viewer in list(viewers):
+        if not viewer.push(msg) and viewer in viewers:
+            viewers.remove(viewer)
+
+
+async def _stop_collector(state: AppState) -> None:
+    if state.collector:
+        state.live_status.untrack(state.collector.room_ids, _COLLECTOR)
+        await state.collector.stop()
+        state.collector = None
+    if state.broadcast_task:
+        state.broadcast_task.cancel()
+        state.broadcast_task = None
+    if state.stats_task:
+        state.stats_task.cancel()
+        state.stats_task = None
+
+
+def _apply_interact_sample(state: AppState) -> None:
+    """采集端按各会话中最大的抽样比例抽样单条互动事件，分发时各会话再按自己的比例筛选"""
+    if state.collector:
+        state.collector.set_interact_sample(max((s.interact_sample for s in state.sessions), default=0.0))
+
+
+async def _close_session(state: AppState, session: Session) -> None:
+    """关闭会话并释放它的房间；最后一个会话关闭时停止采集"""
+    if state.sessions.remove(session.token) is None:
+        return
+    if state.collector:
+        state.live_status.untrack(state.collector.release(session.rooms), _COLLECTOR)
+        _apply_interact_sample(state)
+    if not len(state.sessions):
+        await _stop_collector(state)
+
+
 async def api_start_dm(req: web.Request) -> web.Response:
-    """启动多房间弹幕采集并通过 WebSocket 广播"""
+    """
+    启动（或更新）一个会话的弹幕采集：返回会话 token，前端用 /ws/danmaku?session=<token> 接收。
+    带上已有的 session 时替换该会话的房间与颜色。各会话的房间连接共用、按引用计数，同一房间只有一个上游连接
+    """
     state: AppState = req.app["state"]
     payload = await req.json()
     sessdata = None
@@ -51,50 +289,190 @@ async def api_start_dm(req: web.Request) -> web.Response:
             logger.warning(f"Failed to parse color key={k}: {e}")
             continue
 
-    if state.collector:
-        await state.collector.stop()
+    # 可选的房间优先级（例如观众数），连接排队时优先
+    priorities: Dict[int, float] = {}
+    for k, v in (payload.get("priorities", {}) or {}).items():
+        try:
+            priorities[resolve_room_id(str(k), sessdata=sessdata)] = float(v)
+        except Exception as e:
+            logger.warning(f"Failed to parse priority key={k}: {e}")
 
-    from app.services.danmaku_service import DanmakuCollector
-    state.collector = DanmakuCollector(rooms, color_map=color_map)
+    # 按开播状态：未开播的房间排到连接队列最后，skip_offline 为 true 时不连接；开播房间默认按在线人数排序
+    await _refresh_live(state, rooms, owner=_COLLECTOR)
+    offline = [rid for rid in rooms if state.live_status.is_live(rid) is False]
+    for rid in rooms:
+        info = state.live_status.get(rid)
+        if info is None or info["live"] is None:
+            continue
+        if info["live"]:
+            priorities.setdefault(rid, float(info["online"]))
+        else:
+            priorities[rid] = min(priorities.get(rid, 0.0), -1.0)
+    skipped: List[int] = []
+    if payload.get("skip_offline") and offline:
+        skipped = offline
+        rooms = [rid for rid in rooms if rid not in offline]
 
-    async def broadcast_loop() -> None:
-        assert state.collector is not None
-        first_dm_logged = False
-        while True:
-            item: DanmakuItem = await state.collector.queue.get()
-            # 仅首次打印样本
-            if not first_dm_logged:
-                logger.info(f"First DM sample: room={item.room_id} color={item.color} msg={item.msg[:20]}")
-                first_dm_logged = True
-            msg = json.dumps(item.__dict__, ensure_ascii=False)
-            to_remove: List[web.WebSocketResponse] = []
-            for client in state.ws_clients:
-                try:
-                    await client.send_str(msg)
-                except Exception:
-                    to_remove.append(client)
-            for c in to_remove:
-                if c in state.ws_clients:
-                    state.ws_clients.remove(c)
-
-    # 启动 collector 与广播
-    if state.broadcast_task:
-        state.broadcast_task.cancel()
-    state.broadcast_task = asyncio.create_task(broadcast_loop())
-    asyncio.create_task(state.collector.start())
-    logger.info(f"Danmaku started rooms={rooms} colors={color_map}")
-    return web.json_response({"ok": True})
+    # 进房/关注等互动消息默认只推送周期汇总，interact_sample 为本会话单条事件的抽样比例
+    try:
+        interact_sample = min(max(float(payload.get("interact_sample", 0) or 0), 0.0), 1.0)
+    except (TypeError, ValueError):
+        interact_sample = 0.0
+
+    collector = _ensure_collector(state)
+    collector.priorities.update(priorities)
+    session = state.sessions.get(str(payload.get("session") or ""))
+    if session is None:
+        # 没有带会话或会话已过期（例如后端重启过），新建一个
+        try:
+            session = state.sessions.create(rooms, color_map)
+        except SessionLimitError as e:
+            return web.json_response({"ok": False, "error": str(e)}, status=429)
+        added, removed = list(session.rooms), []
+    else:
+        added, removed = state.sessions.update(session, rooms, color_map)
+    session.interact_sample = interact_sample
+    _apply_interact_sample(state)
+    connected = collector.acquire(added)
+    state.live_status.untrack(collector.release(removed), _COLLECTOR)
+    # skip_offline 跳过的房间没有连接，采集不再需要它们的状态
+    state.live_status.untrack((rid for rid in skipped if rid not in collector.room_ids), _COLLECTOR)
+    logger.info(f"Danmaku started session={session.token} rooms={rooms} colors={color_map} "
+                f"offline={offline} skipped={skipped} new_connections={connected}")
+    return web.json_response({
+        "ok": True,
+        "session": session.token,
+        "offline": offline,
+        "skipped": skipped,
+        # 其他会话已连接的房间直接共用，不新建连接
+        "shared": [rid for rid in added if rid not in connected],
+    })
+
+
+async def api_dm_status(req: web.Request) -> web.Response:
+    """弹幕采集状态：连接爬坡进度、建连耗时、弹幕服务器评分、各房间被几个会话共用"""
+    state: AppState = req.app["state"]
+    shm_ring = state.shm_ring.stats() if state.shm_ring else None
+    if not state.collector:
+        return web.json_response({"ok": True, "running": False, "shm_ring": shm_ring})
+    return web.json_response({
+        "ok": True,
+        "running": True,
+        "rooms": state.collector.room_ids,
+        "rampup": state.collector.admission.progress(),
+        "connect": state.collector.connect_stats(),
+        "hosts": state.collector.host_scoreboard.snapshot(),
+        "refs": {str(rid): n for rid, n in state.collector.ref_counts().items()},
+        "sessions": state.sessions.stats(),
+        "shm_ring": shm_ring,
+    })
+
+
+async def api_dm_history(req: web.Request) -> web.Response:
+    """房间最近弹幕：?room=&since=&limit=，since 为上次收到的 seq，不传则返回最新 limit 条"""
+    state: AppState = req.app["state"]
+    try:
+        room_id = get_room_id(req.query.get("room", "").strip())
+        since_raw = req.query.get("since", "").strip()
+        since = int(since_raw) if since_raw else None
+        limit = int(req.query.get("limit", "100"))
+    except ValueError as e:
+        return web.json_response({"ok": False, "error": str(e)}, status=400)
+    room = state.history.room(room_id)
+    if room is None:
+        return web.json_response({"ok": True, "room": room_id, "items": [], "oldest_seq": None, "last_seq": None})
+    items = room.since(since, min(max(limit, 0), room.capacity))
+    return web.json_response({
+        "ok": True,
+        "room": room_id,
+        "items": [item.__dict__ for item in items],
+        "oldest_seq": room.oldest_seq,
+        "last_seq": room.last_seq,
+    }, dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+
+async def api_archive_query(req: web.Request) -> web.Response:
+    """查询归档弹幕：?room=&from=&to=&limit=，from/to 为毫秒时间戳，room 不传则查询所有房间"""
+    state: AppState = req.app["state"]
+    if not state.archive:
+        return web.json_response({"ok": False, "error": "archive disabled"}, status=404)
+    try:
+        room_raw = req.query.get("room", "").strip()
+        room_id = get_room_id(room_raw) if room_raw else None
+        start_ts = int(req.query.get("from", "0"))
+        end_ts = int(req.query.get("to", "0")) or int(time.time() * 1000)
+        limit = min(max(int(req.query.get("limit", "1000")), 0), 10000)
+    except ValueError as e:
+        return web.json_response({"ok": False, "error": str(e)}, status=400)
+    items = await state.archive.async_query(room_id, start_ts, end_ts, limit)
+    return web.json_response({
+        "ok": True,
+        "room": room_id,
+        "items": [item.__dict__ for item in items],
+        "archive": state.archive.stats(),
+    }, dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+
+async def api_archive_search(req: web.Request) -> web.Response:
+    """归档弹幕全文检索：?q=&room=&user=&from=&to=&limit=，user 为用户名精确匹配"""
+    state: AppState = req.app["state"]
+    if not state.search:
+        return web.json_response({"ok": False, "error": "archive disabled"}, status=404)
+    text = req.query.get("q", "").strip()
+    if not text:
+        return web.json_response({"ok": False, "error": "empty query"}, status=400)
+    try:
+        room_raw = req.query.get("room", "").strip()
+        room_id = get_room_id(room_raw) if room_raw else None
+        start_ts = int(req.query.get("from", "0"))
+        end_ts = int(req.query.get("to", "0")) or None
+        limit = min(max(int(req.query.get("limit", "100")), 0), 1000)
+    except ValueError as e:
+        return web.json_response({"ok": False, "error": str(e)}, status=400)
+    uname = req.query.get("user", "").strip() or None
+    items = await state.search.async_search(text, room_id, uname, start_ts, end_ts, limit)
+    return web.json_response({
+        "ok": True,
+        "items": [item.__dict__ for item in items],
+        "took_ms": state.search.last_query_ms,
+        "index": state.search.stats(),
+    }, dumps=lambda o: json.dumps(o, ensure_ascii=False))
+
+
+async def api_live_status(req: web.Request) -> web.Response:
+    """开播状态缓存：?rooms=1,2,3（真实 room_id）时开始跟踪这些房间并返回其状态，不传则返回所有跟踪中的房间"""
+    state: AppState = req.app["state"]
+    try:
+        rooms = [get_room_id(x.strip()) for x in req.query.get("rooms", "").split(",") if x.strip()]
+    except ValueError as e:
+        return web.json_response({"ok": False, "error": str(e)}, status=400)
+    if rooms:
+        await _refresh_live(state, rooms)
+    snapshot = state.live_status.snapshot(rooms or None)
+    return web.json_response({
+        "ok": True,
+        "rooms": {str(rid): info for rid, info in snapshot.items()},
+        "poller": state.live_status.stats(),
+    }, dumps=lambda o: json.dumps(o, ensure_ascii=False))
 
 
 async def api_stop(req: web.Request) -> web.Response:
-    """停止弹幕采集与广播"""
+    """
+    停止一个会话（{"session": token}），只释放它的房间，其他会话共用的连接保留；
+    不带 session 时停止所有会话、采集与广播
+    """
     state: AppState = req.app["state"]
-    if state.collector:
-        await state.collector.stop()
-        state.collector = None
-    if state.broadcast_task:
-        state.broadcast_task.cancel()
-        state.broadcast_task = None
-    logger.info("Stopped all services")
+    payload = await req.json() if req.can_read_body else {}
+    token = str((payload or {}).get("session") or "")
+    if token:
+        session = state.sessions.get(token)
+        if session is None:
+            return web.json_response({"ok": False, "error": "unknown session"}, status=404)
+        await _close_session(state, session)
+        logger.info(f"Stopped session {token}")
+    else:
+        state.sessions.close()
+        await _stop_collector(state)
+        logger.info("Stopped all services")
     return web.json_response({"ok": True})
 
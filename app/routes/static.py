@@ -1,22 +1,175 @@
+import asyncio
+import gzip
+import hashlib
 import os
+import re
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict, Optional
 
 from aiohttp import web
 
+# 首页每次都要协商；vendor 下的第三方库 URL 带内容哈希，可以长期缓存
+_INDEX_CACHE_CONTROL = "no-cache"
+_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_VENDOR_NAME = re.compile(r"^[\w.\-]+\.(js|css|map)$")
+_VENDOR_REF = re.compile(r"""(["'])vendor/([\w.\-]+)\1""")
+_CONTENT_TYPES = {".html": "text/html", ".js": "application/javascript", ".css": "text/css",
+                  ".map": "application/json"}
 
-def _locate_web_index() -> Path:
-    """动态定位 web/index.html，兼容开发环境与 pyfuze 打包后的解压路径"""
+
+def _web_root() -> Path:
+    """动态定位 web/ 目录，兼容开发环境与 pyfuze 打包后的解压路径"""
     # 优先使用 PYFUZE 环境变量（打包后的 src 目录）
     if "PYFUZE_EXECUTABLE_PATH" in os.environ:
         # 打包后工作目录在 <unzip>/src，web/ 也在 src/web/
-        return Path.cwd() / "web" / "index.html"
+        return Path.cwd() / "web"
     # 开发环境：从项目根查找
-    root = Path(__file__).resolve().parents[2]  # app/routes/static.py -> 根
-    return root / "web" / "index.html"
+    return Path(__file__).resolve().parents[2] / "web"  # app/routes/static.py -> 根
+
+
+def _locate_web_index() -> Path:
+    return _web_root() / "index.html"
+
+
+@dataclass
+class _Asset:
+    """内存中的静态文件：原文与预压缩版本"""
+    stamp: tuple  # 文件为 (mtime_ns, size)，首页为其依赖的版本组合；变化时重新生成
+    body: bytes
+    gzip: bytes
+    br: Optional[bytes]
+    etag: str
+    content_type: str
+
+
+def _build_asset(body: bytes, stamp: tuple, content_type: str) -> _Asset:
+    try:
+        import brotli  # type: ignore
+        br: Optional[bytes] = brotli.compress(body, quality=11)
+    except ImportError:  # 没装 brotli 时只提供 gzip
+        br = None
+    return _Asset(
+        stamp=stamp,
+        body=body,
+        gzip=gzip.compress(body, 9),
+        br=br,
+        etag='"' + hashlib.sha1(body).hexdigest()[:20] + '"',
+        content_type=content_type,
+    )
+
+
+class _AssetCache:
+    """按路径缓存静态文件，每次请求只 stat 一次，文件变化时在线程池里重新读取与压缩"""
+
+    def __init__(self) -> None:
+        self._assets: Dict[Path, _Asset] = {}
+        self._locks: Dict[Path, asyncio.Lock] = {}
+
+    async def get(self, path: Path) -> Optional[_Asset]:
+        try:
+            st = path.stat()
+        except OSError:
+            self._assets.pop(path, None)
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        asset = self._assets.get(path)
+        if asset is not None and asset.stamp == stamp:
+            return asset
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            asset = self._assets.get(path)
+            if asset is not None and asset.stamp == stamp:
+                return asset
+            content_type = _CONTENT_TYPES.get(path.suffix, "application/octet-stream")
+            body = await asyncio.get_running_loop().run_in_executor(None, path.read_bytes)
+            asset = await asyncio.get_running_loop().run_in_executor(
+                None, _build_asset, body, stamp, content_type
+            )
+            self._assets[path] = asset
+            return asset
+
+    async def get_index(self) -> Optional[_Asset]:
+        """
+        首页：把对 vendor/ 下文件的引用改写为带内容哈希的 URL，引用的文件变化时首页的 ETag 也跟着变
+        """
+        raw = await self.get(_locate_web_index())
+        if raw is None:
+            return None
+        html = raw.body.decode("utf-8")
+        vendor_dir = _web_root() / "vendor"
+        versions = []
+        for name in sorted(set(m.group(2) for m in _VENDOR_REF.finditer(html))):
+            vendor = await self.get(vendor_dir / name)
+            versions.append((name, _asset_version(vendor) if vendor is not None else None))
+        key = (raw.stamp, tuple(versions))
+        rendered = self._assets.get(_RENDERED_INDEX)
+        if rendered is not None and rendered.stamp == key:
+            return rendered
+
+        version_map = dict(versions)
+
+        def rewrite(m: "re.Match[str]") -> str:
+            quote, name = m.group(1), m.group(2)
+            version = version_map.get(name)
+            return f"{quote}vendor/{name}?v={version}{quote}" if version else m.group(0)
+
+        body = _VENDOR_REF.sub(rewrite, html).encode("utf-8")
+        rendered = await asyncio.get_running_loop().run_in_executor(
+            None, _build_asset, body, key, "text/html"
+        )
+        self._assets[_RENDERED_INDEX] = rendered
+        return rendered
+
+
+_RENDERED_INDEX = Path("<rendered index>")
+_cache = _AssetCache()
+
+
+def _asset_version(asset: _Asset) -> str:
+    """首页引用 vendor 文件时附加的 ?v= 版本号：内容哈希的前 10 位"""
+    return asset.etag.strip('"')[:10]
+
+
+def _respond(req: web.Request, asset: _Asset, cache_control: str) -> web.Response:
+    # 各编码的响应体不同，ETag 也要区分（加编码后缀），否则缓存可能把 gzip 的协商结果用到原文上
+    accept = req.headers.get("Accept-Encoding", "")
+    body = asset.body
+    encoding = None
+    if asset.br is not None and "br" in accept:
+        body, encoding = asset.br, "br"
+    elif "gzip" in accept:
+        body, encoding = asset.gzip, "gzip"
+    etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag in req.headers.get("If-None-Match", ""):
+        return web.Response(status=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    resp = web.Response(body=body, headers=headers, content_type=asset.content_type)
+    if asset.content_type.startswith("text/") or asset.content_type == "application/javascript":
+        resp.charset = "utf-8"
+    return resp
+
 
+async def index(req: web.Request) -> web.Response:
+    """提供前端首页（内存缓存，支持 ETag 协商与 gzip/br）"""
+    asset = await _cache.get_index()
+    if asset is None:
+        raise web.HTTPNotFound()
+    return _respond(req, asset, _INDEX_CACHE_CONTROL)
 
-async def index(_req: web.Request) -> web.Response:
-    """提供前端首页"""
-    html = _locate_web_index().read_text(encoding="utf-8")
-    return web.Response(text=html, content_type="text/html")
 
+async def vendor_asset(req: web.Request) -> web.Response:
+    """本地化的前端第三方库（web/vendor/），不存在时前端回退到 CDN"""
+    name = req.match_info["name"]
+    if not _VENDOR_NAME.match(name):
+        raise web.HTTPNotFound()
+    asset = await _cache.get(_web_root() / "vendor" / name)
+    if asset is None:
+        raise web.HTTPNotFound()
+    # 版本号与当前内容一致时 URL 对应的内容不会变，可以永久缓存；过期或随意的 ?v= 只能协商缓存，
+    # 否则旧页面请求到新文件后会被当成旧版本永久缓存
+    cache_control = (_IMMUTABLE_CACHE_CONTROL if req.query.get("v") == _asset_version(asset)
+                     else _INDEX_CACHE_CONTROL)
+    return _respond(req, asset, cache_control)
@@ -1,19 +1,90 @@
 from aiohttp import web
 
+from services.viewer import Viewer
 from state import AppState
 
 
 async def ws_danmaku(req: web.Request) -> web.WebSocketResponse:
-    """WebSocket 弹幕推送端点"""
+    """
+    WebSocket 弹幕推送端点，?session=<token> 接收该会话房间的弹幕；
+    ?resume=<sseq> 时先补发该会话 sseq（会话内序号）之后的消息再转入实时推送。
+    完全不带 session 参数时兼容旧的用法：接收所有会话的全部房间（颜色为采集端的默认颜色），?resume=<seq> 按全局序号补发。
+    session 参数为空（页面还没有启动会话）时只收播放地址替换等全局消息
+    """
     state: AppState = req.app["state"]
     ws = web.WebSocketResponse()
     await ws.prepare(req)
-    state.ws_clients.append(ws)
+    viewer = Viewer(ws)
+    session = state.sessions.get(req.query.get("session", "").strip())
+    if req.query.get("session") and session is None:
+        # 会话已过期或后端重启过，前端应重新启动采集
+        viewer.push_json({"type": "session", "status": "unknown"})
+
+    all_rooms = "session" not in req.query
+    replay = session.replay if session is not None else state.replay if all_rooms else None
+    resume_raw = req.query.get("resume", "").strip()
+    if replay is not None and resume_raw.isdigit():
+        resume = int(resume_raw)
+        ok, missed = replay.since(resume)
+        viewer.push_json({
+            "type": "resume",
+            "status": "ok" if ok else "gap",
+            "from": resume,
+            "oldest": replay.oldest_seq,
+            "last": replay.last_seq,
+            "replayed": len(missed),
+        })
+        for msg in missed:
+            viewer.push(msg)
+
+    # 看护替换过的播放地址，断线期间错过推送的前端据 generation 判断是否切换
+    if state.watchdog:
+        for watch in state.watchdog.watches():
+            if watch.message:
+                viewer.push(watch.message)
+
+    # 补发的消息入队与加入广播列表之间没有 await，不会漏也不会乱序
+    state.ws_clients.append(viewer)
+    if session is not None:
+        state.sessions.attach(session, viewer)
+    elif all_rooms:
+        state.all_rooms_viewers.append(viewer)
+    viewer.start()
     try:
         async for _ in ws:
             pass
     finally:
-        if ws in state.ws_clients:
-            state.ws_clients.remove(ws)
+        viewer.close()
+        if viewer in state.ws_clients:
+            state.ws_clients.remove(viewer)
+        if session is not None:
+            state.sessions.detach(session, viewer)
+        elif viewer in state.all_rooms_viewers:
+            state.all_rooms_viewers.remove(viewer)
     return ws
 
+
+async def ws_stats(req: web.Request) -> web.WebSocketResponse:
+    """
+    实时弹幕统计推送端点，采集运行时每秒一条 {"type": "stats", "rooms": {...}}；
+    ?session=<token> 时只含该会话的房间
+    """
+    state: AppState = req.app["state"]
+    ws = web.WebSocketResponse()
+    await ws.prepare(req)
+    # 统计是整体快照，积压没有意义，队列给得很小
+    viewer = Viewer(ws, max_pending=8)
+    session = state.sessions.get(req.query.get("session", "").strip())
+    viewers = session.stats_viewers if session is not None else state.stats_clients
+    if state.collector:
+        viewer.push_json(state.collector.analytics.snapshot(room_ids=session.rooms if session is not None else None))
+    viewers.append(viewer)
+    viewer.start()
+    try:
+        async for _ in ws:
+            pass
+    finally:
+        viewer.close()
+        if viewer in viewers:
+            viewers.remove(viewer)
+    return ws
@@ -0,0 +1,149 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+try:
+    from blivedm.clients import ws_base  # type: ignore
+except Exception:  # 兼容 vendor 结构
+    from vendor.blivedm.blivedm.clients import ws_base  # type: ignore
+
+logger = logging.getLogger('multiplelive')
+
+
+def client_room_key(client: Any) -> int:
+    """准入控制里标识房间用的 ID：init_room 之前只有构造时的房间号"""
+    return getattr(client, "tmp_room_id", None) or client.room_id
+
+
+class AdmissionController(ws_base.ConnectGateInterface):
+    """
+    连接准入控制：限制同时进行 init_room + 建连的客户端数量，相邻两次放行之间留出带抖动的间隔，
+    排队时优先放行优先级高（有观众）的房间。首次启动与批量掉线重连都经过这里，避免请求突发触发风控。
+
+    :param max_concurrent: 同时处于连接流程中的客户端上限
+    :param min_interval: 相邻两次放行的最小间隔（秒）
+    :param jitter: 在最小间隔上追加的随机抖动上限（秒）
+    :param priority: 客户端 -> 优先级，越大越先放行
+    """
+
+    def __init__(self, max_concurrent: int = 4, min_interval: float = 0.15, jitter: float = 0.25,
+                 priority: Optional[Callable[[Any], float]] = None) -> None:
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._priority = priority or (lambda _client: 0.0)
+
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._holders: Set[Any] = set()
+        self._active = 0  # 已放行、尚未 release 的数量
+        self._pump_task: Optional[asyncio.Task] = None
+        self._slot_freed: Optional[asyncio.Event] = None
+        self._next_admit_at = 0.0
+
+        # 爬坡进度
+        self.expected_rooms: Set[int] = set()
+        self.connected_rooms: Set[int] = set()
+        self.failed_attempts = 0
+        self.started_at = time.monotonic()
+        self.ramp_done_at: Optional[float] = None
+
+    def expect(self, room_ids) -> None:
+        """登记本轮要连接的房间，用于计算爬坡进度"""
+        self.expected_rooms.update(room_ids)
+        self.started_at = time.monotonic()
+        self.ramp_done_at = None
+
+    def forget(self, room_ids) -> None:
+        """房间已断开且不再需要，不再计入爬坡进度"""
+        self.expected_rooms.difference_update(room_ids)
+        self.connected_rooms.difference_update(room_ids)
+
+    async def acquire(self, client: Any, retry_count: int) -> None:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        heapq.heappush(self._waiters, (-self._priority(client), next(self._seq), fut))
+        if self._pump_task is None:
+            self._slot_freed = asyncio.Event()
+            self._pump_task = asyncio.create_task(self._pump())
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # 名额已经给出但调用方被取消了，归还名额
+            if fut.done() and not fut.cancelled():
+                self._free_slot()
+            raise
+        self._holders.add(client)
+
+    def release(self, client: Any, success: bool) -> None:
+        if client not in self._holders:
+            return
+        self._holders.discard(client)
+        self._free_slot()
+
+        room_id = client_room_key(client)
+        if not success:
+            self.failed_attempts += 1
+            return
+        if room_id in self.connected_rooms:
+            return
+        self.connected_rooms.add(room_id)
+        self.connected_rooms.add(client.room_id)
+        self._report_progress()
+
+    def _free_slot(self) -> None:
+        self._active -= 1
+        if self._slot_freed is not None:
+            self._slot_freed.set()
+
+    async def _pump(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while self._waiters:
+                if self._active >= self.max_concurrent:
+                    self._slot_freed.clear()
+                    await self._slot_freed.wait()
+                    continue
+                delay = self._next_admit_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                # 等待期间可能有更高优先级的请求进来，这时才出队
+                _, _, fut = heapq.heappop(self._waiters)
+                if fut.done():
+                    continue
+                self._active += 1
+                fut.set_result(None)
+                self._next_admit_at = loop.time() + self.min_interval + random.uniform(0, self.jitter)
+        finally:
+            self._pump_task = None
+
+    def _report_progress(self) -> None:
+        total = len(self.expected_rooms)
+        done = len(self.expected_rooms & self.connected_rooms)
+        if total == 0 or self.ramp_done_at is not None:
+            return
+        if done >= total:
+            self.ramp_done_at = time.monotonic()
+            logger.info(f"Ramp-up finished: {done}/{total} rooms connected "
+                        f"in {self.ramp_done_at - self.started_at:.1f}s")
+        elif done % max(1, total // 10) == 0:
+            logger.info(f"Ramp-up progress: {done}/{total} rooms connected")
+
+    def progress(self) -> Dict[str, Any]:
+        """爬坡进度快照，供状态接口返回"""
+        total = len(self.expected_rooms)
+        done = len(self.expected_rooms & self.connected_rooms)
+        end = self.ramp_done_at if self.ramp_done_at is not None else time.monotonic()
+        return {
+            "total": total,
+            "connected": done,
+            "connecting": self._active,
+            "waiting": sum(1 for _, _, fut in self._waiters if not fut.done()),
+            "failed_attempts": self.failed_attempts,
+            "elapsed_s": round(end - self.started_at, 2),
+            "done": total > 0 and done >= total,
+        }
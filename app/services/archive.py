@@ -0,0 +1,345 @@
+import asyncio
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from services.danmaku_codec import decode_header, decode_item, encode_item
+from services.items import DanmakuItem
+
+logger = logging.getLogger('multiplelive')
+
+# 索引项：(截至该记录的最大 ts_ms, 记录偏移)
+INDEX_ENTRY = struct.Struct("<qQ")
+# 弹幕时间戳来自各房间客户端，跨房间会轻微乱序，范围查询时在结束时间后多扫这么久
+MAX_TS_SKEW_MS = 30_000
+
+
+class Segment:
+    """一个归档分段：.dat 记录文件 + .idx 时间索引 + 封存后的 .meta"""
+
+    def __init__(self, directory: Path, seg_id: int) -> None:
+        self.seg_id = seg_id
+        self.data_path = directory / f"seg-{seg_id:012d}.dat"
+        self.index_path = directory / f"seg-{seg_id:012d}.idx"
+        self.meta_path = directory / f"seg-{seg_id:012d}.meta"
+        self.index_ts: List[int] = []
+        self.index_offsets: List[int] = []
+        self.min_ts: Optional[int] = None
+        self.max_ts: Optional[int] = None
+        self.records = 0
+        self.size = 0
+        self.created_at = time.time()
+        self.sealed = False
+        self._mmap: Optional[mmap.mmap] = None
+        self._mmap_size = 0
+        # 被新映射替换、但还有查询持有其 memoryview 的旧映射，之后再关闭
+        self._retired: List[mmap.mmap] = []
+        self._map_lock = threading.Lock()
+
+    def meta(self) -> Dict[str, object]:
+        return {"min_ts": self.min_ts, "max_ts": self.max_ts, "records": self.records, "size": self.size,
+                "created_at": self.created_at}
+
+    def load(self) -> None:
+        """从磁盘恢复元数据；没有 .meta（进程异常退出）时扫描整个文件重建"""
+        self.size = self.data_path.stat().st_size
+        self.sealed = True
+        if self.meta_path.exists() and self.index_path.exists():
+            meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+            self.min_ts, self.max_ts = meta["min_ts"], meta["max_ts"]
+            self.records, self.created_at = meta["records"], meta["created_at"]
+            self.size = min(self.size, meta["size"])
+            raw = self.index_path.read_bytes()
+            for ts, off in INDEX_ENTRY.iter_unpack(raw[: len(raw) - len(raw) % INDEX_ENTRY.size]):
+                self.index_ts.append(ts)
+                self.index_offsets.append(off)
+            return
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        data = self.data_path.read_bytes()
+        offset = 0
+        entries = bytearray()
+        while offset + 4 <= len(data):
+            try:
+                length, _, ts_ms, *_ = decode_header(data, offset)
+            except struct.error:
+                break
+            if length <= 0 or offset + length > len(data):
+                break  # 尾部不完整的记录
+            entries += self._note_record(ts_ms, offset, length)
+            offset += length
+        self.size = offset
+        self.index_path.write_bytes(bytes(entries))
+        self.meta_path.write_text(json.dumps(self.meta()), encoding="utf-8")
+
+    def _note_record(self, ts_ms: int, offset: int, length: int, index_every: int = 64) -> bytes:
+        """更新元数据，需要新增索引项时返回其编码"""
+        self.min_ts = ts_ms if self.min_ts is None else min(self.min_ts, ts_ms)
+        self.max_ts = ts_ms if self.max_ts is None else max(self.max_ts, ts_ms)
+        self.records += 1
+        self.size = offset + length
+        if (self.records - 1) % index_every == 0:
+            self.index_ts.append(self.max_ts)
+            self.index_offsets.append(offset)
+            return INDEX_ENTRY.pack(self.max_ts, offset)
+        return b""
+
+    def view(self) -> Optional[memoryview]:
+        """只读内存映射，各查询复用同一个映射；活动分段增长后重新映射，旧映射等没有查询使用时关闭"""
+        size = self.size
+        if size == 0:
+            return None
+        with self._map_lock:
+            if self._mmap is None or self._mmap_size < size:
+                with open(self.data_path, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                self._retire()
+                self._mmap, self._mmap_size = mm, size
+            return memoryview(self._mmap)[:size]
+
+    def _retire(self) -> None:
+        """调用方持有 _map_lock"""
+        if self._mmap is not None:
+            self._retired.append(self._mmap)
+            self._mmap, self._mmap_size = None, 0
+        in_use = []
+        for mm in self._retired:
+            try:
+                mm.close()
+            except BufferError:
+                in_use.append(mm)
+        self._retired = in_use
+
+    def start_offset(self, start_ts: int) -> int:
+        """从这个偏移开始扫描，之前的记录时间戳都早于 start_ts"""
+        i = bisect.bisect_left(self.index_ts, start_ts) - 1
+        return self.index_offsets[i] if i >= 0 else 0
+
+    def close(self) -> bool:
+        """关闭映射；还有查询持有 memoryview 时返回 False，这些映射留到下次 close 再关"""
+        with self._map_lock:
+            self._retire()
+            return not self._retired
+
+
+class DanmakuArchive:
+    """
+    追加写的弹幕归档：按大小/时长切分段，写入攒批后在单独的写线程执行，不占用事件循环；
+    每段带稀疏的 时间 -> 偏移 索引，范围查询用内存映射读取。
+    """
+
+    def __init__(self, directory: Path, segment_max_bytes: int = 64 * 1024 * 1024,
+                 segment_max_age: float = 3600, flush_interval: float = 0.5,
+                 max_pending: int = 200_000, retention_days: float = 30) -> None:
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_max_age = segment_max_age
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retention_days = retention_days
+
+        self._segments: List[Segment] = []
+        self._active: Optional[Segment] = None
+        self._data_file = None
+        self._index_file = None
+        self._pending: List[bytes] = []
+        self._lock = threading.Lock()  # 保护分段列表与活动分段的元数据
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive-writer")
+        self._flush_task: Optional[asyncio.Task] = None
+        self._closing: List[Segment] = []  # 已删除、但映射仍被查询占用的分段
+        self.on_seal: List[Callable[[Segment], None]] = []
+        """分段封存后在写线程调用的回调"""
+        self.on_prune: List[Callable[[Segment], None]] = []
+        """分段因过期删除前调用的回调"""
+
+        self.written = 0
+        self.dropped = 0
+
+    # ---- 生命周期 ----
+
+    def open(self) -> None:
+        """加载已有分段（同步，放在线程池调用）"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in sorted(self.directory.glob("seg-*.dat")):
+            seg = Segment(self.directory, int(path.stem.split("-")[1]))
+            try:
+                seg.load()
+            except Exception as e:
+                logger.warning(f"Archive segment {path.name} skipped: {e}")
+                continue
+            self._segments.append(seg)
+
+    async def start(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._writer, self.open)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush()
+        await asyncio.get_running_loop().run_in_executor(self._writer, self._seal_active)
+        for seg in self._segments + self._closing:
+            seg.close()
+        self._writer.shutdown(wait=False)
+
+    # ---- 写入 ----
+
+    def append(self, item: DanmakuItem) -> None:
+        """在事件循环里调用，只编码入队，不做 IO；积压超过上限时丢弃并计数"""
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(encode_item(item))
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._flush()
+            except Exception:
+                logger.exception("Archive flush failed")
+
+    async def _flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        await asyncio.get_running_loop().run_in_executor(self._writer, self._write_batch, batch)
+
+    def _write_batch(self, batch: List[bytes]) -> None:
+        seg = self._ensure_segment()
+        data = b"".join(batch)
+        self._data_file.write(data)
+        self._data_file.flush()
+        index_entries = bytearray()
+        offset = seg.size
+        with self._lock:
+            for record in batch:
+                _, _, ts_ms, *_ = decode_header(record)
+                index_entries += seg._note_record(ts_ms, offset, len(record))
+                offset += len(record)
+        if index_entries:
+            self._index_file.write(bytes(index_entries))
+            self._index_file.flush()
+        self.written += len(batch)
+        if seg.size >= self.segment_max_bytes or time.time() - seg.created_at >= self.segment_max_age:
+            self._seal_active()
+
+    def _ensure_segment(self) -> Segment:
+        if self._active is not None:
+            return self._active
+        seg_id = self._segments[-1].seg_id + 1 if self._segments else 1
+        seg = Segment(self.directory, seg_id)
+        self._data_file = open(seg.data_path, "ab")
+        self._index_file = open(seg.index_path, "ab")
+        with self._lock:
+            self._segments.append(seg)
+            self._active = seg
+        return seg
+
+    def _seal_active(self) -> None:
+        seg = self._active
+        if seg is None:
+            return
+        self._data_file.close()
+        self._index_file.close()
+        self._data_file = self._index_file = None
+        seg.meta_path.write_text(json.dumps(seg.meta()), encoding="utf-8")
+        with self._lock:
+            seg.sealed = True
+            self._active = None
+        for cb in self.on_seal:
+            try:
+                cb(seg)
+            except Exception:
+                logger.exception("Archive on_seal callback failed")
+        self._prune()
+
+    def _prune(self) -> None:
+        if not self.retention_days:
+            return
+        deadline = time.time() - self.retention_days * 86400
+        self._closing = [s for s in self._closing if not s.close()]
+        with self._lock:
+            expired = [s for s in self._segments if s.sealed and s.created_at < deadline]
+            self._segments = [s for s in self._segments if s not in expired]
+        for seg in expired:
+            for cb in self.on_prune:
+                try:
+                    cb(seg)
+                except Exception:
+                    logger.exception("Archive on_prune callback failed")
+            if not seg.close():
+                # 查询还在读这个分段，不能关闭映射；文件照常删除（已映射的内容仍可读），之后再关
+                self._closing.append(seg)
+            # 连同其他模块为该分段生成的附属文件一起删除
+            for p in self.directory.glob(seg.data_path.stem + ".*"):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    # ---- 查询 ----
+
+    def segments(self) -> List[Segment]:
+        with self._lock:
+            return list(self._segments)
+
+    def query(self, room_id: Optional[int], start_ts: int, end_ts: int, limit: int = 1000) -> List[DanmakuItem]:
+        """同步范围查询（在线程池调用）：房间 + [start_ts, end_ts] 毫秒时间窗口"""
+        out: List[DanmakuItem] = []
+        for seg in self.segments():
+            if seg.max_ts is None or seg.max_ts < start_ts or seg.min_ts > end_ts:
+                continue
+            out.extend(self.scan(seg, start_ts, end_ts, room_id, limit - len(out)))
+            if len(out) >= limit:
+                break
+        return out
+
+    def scan(self, seg: Segment, start_ts: int, end_ts: int, room_id: Optional[int],
+             limit: int) -> List[DanmakuItem]:
+        out: List[DanmakuItem] = []
+        with self._lock:
+            offset = seg.start_offset(start_ts)
+        buf = seg.view()
+        if buf is None:
+            return out
+        try:
+            size = len(buf)
+            while offset < size and len(out) < limit:
+                length, _, ts_ms, rid, *_ = decode_header(buf, offset)
+                if ts_ms > end_ts + MAX_TS_SKEW_MS:
+                    break
+                if start_ts <= ts_ms <= end_ts and (room_id is None or rid == room_id):
+                    item, _ = decode_item(buf, offset)
+                    out.append(item)
+                offset += length
+        finally:
+            buf.release()
+        return out
+
+    async def async_query(self, room_id: Optional[int], start_ts: int, end_ts: int,
+                          limit: int = 1000) -> List[DanmakuItem]:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.query, room_id, start_ts, end_ts, limit
+        )
+
+    def stats(self) -> Dict[str, object]:
+        segs = self.segments()
+        return {
+            "segments": len(segs),
+            "bytes": sum(s.size for s in segs),
+            "records": sum(s.records for s in segs),
+            "written": self.written,
+            "pending": len(self._pending),
+            "dropped": self.dropped,
+        }
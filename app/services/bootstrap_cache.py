@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger('multiplelive')
+
+# 各类缓存的有效期（秒）
+DEFAULT_TTLS: Dict[str, float] = {
+    # wbi 口令自带刷新时间，按 blivedm 的有效期判断，这里只是兜底
+    "wbi_key": 12 * 3600,
+    "buvid3": 7 * 24 * 3600,
+    # 短号 -> 真实房间号、主播 uid，基本不会变
+    "room_init": 7 * 24 * 3600,
+    # 弹幕服务器列表与 token；token 失效时认证失败会重新 init_room 并绕过缓存
+    "danmu_info": 2 * 3600,
+}
+
+
+class BootstrapCache:
+    """
+    blivedm 初始化结果的磁盘缓存（wbi 口令、buvid3、房间号映射、弹幕服务器列表），实现 blivedm.BootstrapCacheInterface。
+    不继承该接口，免得启动时就导入 blivedm。
+    启动时加载，写入后延迟合并落盘，落盘在线程池执行，不阻塞事件循环。
+    """
+
+    def __init__(self, path: Path, ttls: Optional[Dict[str, float]] = None, flush_delay: float = 5.0) -> None:
+        self.path = path
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.flush_delay = flush_delay
+        # kind -> key -> [保存时间, 值]
+        self._data: Dict[str, Dict[str, list]] = {}
+        self._dirty = False
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        """同步读取缓存文件，文件不存在或损坏时视为空缓存"""
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Bootstrap cache ignored, failed to read {self.path}: {e}")
+            return
+        if not isinstance(raw, dict):
+            logger.warning(f"Bootstrap cache ignored, unexpected content in {self.path}")
+            return
+        now = time.time()
+        skipped = 0
+        for kind, entries in raw.items():
+            ttl = self.ttls.get(kind)
+            if ttl is None or not isinstance(entries, dict):
+                continue
+            kept: Dict[str, list] = {}
+            for k, v in entries.items():
+                # 每项应为 [保存时间, 值]，格式不对的单独跳过
+                if not (isinstance(v, list) and len(v) == 2 and isinstance(v[0], (int, float))):
+                    skipped += 1
+                    continue
+                if now - v[0] < ttl:
+                    kept[k] = v
+            self._data[kind] = kept
+        if skipped:
+            logger.warning(f"Bootstrap cache skipped {skipped} malformed entries in {self.path}")
+
+    async def async_load(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.load)
+
+    def get(self, kind: str, key) -> Optional[Any]:
+        entry = self._data.get(kind, {}).get(str(key))
+        if entry is None or time.time() - entry[0] >= self.ttls.get(kind, 0):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def set(self, kind: str, key, value) -> None:
+        entries = self._data.setdefault(kind, {})
+        if value is None:
+            entries.pop(str(key), None)
+        else:
+            entries[str(key)] = [time.time(), value]
+        self._dirty = True
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_handle = loop.call_later(self.flush_delay, lambda: asyncio.create_task(self.flush()))
+
+    async def flush(self) -> None:
+        """把修改写回磁盘"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        payload = json.dumps(self._data, ensure_ascii=False)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, payload)
+        except Exception as e:
+            logger.warning(f"Failed to write bootstrap cache {self.path}: {e}")
+
+    def _write(self, payload: str) -> None:
+        # 先写临时文件再替换，避免进程退出时留下半个文件
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(payload, encoding="utf-8")
+        os.replace(tmp, self.path)
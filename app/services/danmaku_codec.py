@@ -0,0 +1,70 @@
+"""
+弹幕的紧凑二进制记录格式，归档、流式导出等共用。
+
+一条记录（小端）：
+
+    偏移  类型   字段
+    0     u32    记录总长度（含头部）
+    4     u64    seq
+    12    i64    ts_ms
+    20    u32    room_id
+    24    u32    color（0xRRGGBB）
+    28    u16    uname 的 UTF-8 字节数
+    30    u16    msg 的 UTF-8 字节数
+    32    bytes  uname
+    ...   bytes  msg
+"""
+import struct
+from typing import Tuple, Union
+
+from services.items import DanmakuItem
+
+RECORD_HEADER = struct.Struct("<IQqIIHH")
+
+_Buffer = Union[bytes, bytearray, memoryview]
+
+
+def _color_to_int(color: str) -> int:
+    value = color.lstrip("#")
+    if len(value) == 3:
+        value = "".join(c * 2 for c in value)
+    try:
+        return int(value[:6], 16)
+    except ValueError:
+        return 0xFFFFFF
+
+
+def encode_item(item: DanmakuItem) -> bytes:
+    uname = item.uname.encode("utf-8")[:0xFFFF]
+    msg = item.msg.encode("utf-8")[:0xFFFF]
+    return RECORD_HEADER.pack(
+        RECORD_HEADER.size + len(uname) + len(msg),
+        item.seq,
+        item.ts_ms,
+        item.room_id & 0xFFFFFFFF,
+        _color_to_int(item.color),
+        len(uname),
+        len(msg),
+    ) + uname + msg
+
+
+def decode_header(buf: _Buffer, offset: int = 0) -> Tuple[int, int, int, int, int, int, int]:
+    """只解析头部：(总长度, seq, ts_ms, room_id, color, uname 长度, msg 长度)"""
+    return RECORD_HEADER.unpack_from(buf, offset)
+
+
+def decode_item(buf: _Buffer, offset: int = 0) -> Tuple[DanmakuItem, int]:
+    """解析一条记录，返回 (弹幕, 下一条记录的偏移)"""
+    length, seq, ts_ms, room_id, color, uname_len, msg_len = RECORD_HEADER.unpack_from(buf, offset)
+    pos = offset + RECORD_HEADER.size
+    uname = bytes(buf[pos: pos + uname_len]).decode("utf-8", "replace")
+    pos += uname_len
+    msg = bytes(buf[pos: pos + msg_len]).decode("utf-8", "replace")
+    return DanmakuItem(
+        room_id=room_id,
+        uname=uname,
+        msg=msg,
+        ts_ms=ts_ms,
+        color=f"#{color:06x}",
+        seq=seq,
+    ), offset + length
@@ -1,7 +1,16 @@
 import asyncio
-from dataclasses import dataclass
+import collections
 import logging
-from typing import Dict, Iterable, List, Optional
+import time
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Set, Tuple
+
+import aiohttp
+
+from services.admission import AdmissionController, client_room_key
+from services.analytics import ChatAnalytics
+from services.gift_combo import GiftCombiner, GiftCombo
+from services.interact_stats import InteractAggregator
+from services.items import DanmakuItem, EventItem
 
 try:
     import blivedm  # type: ignore
@@ -11,21 +20,137 @@ except Exception:  # 兼容 vendor 结构
     import vendor.blivedm.blivedm.models.web as web_models  # type: ignore
 
 
-@dataclass
-class DanmakuItem:
-    room_id: int
-    uname: str
-    msg: str
-    ts_ms: int
-    color: str
+# 弹幕服务器评分跨多次启动保留
+_host_scoreboard = blivedm.HostScoreboard()
+
+
+_GUARD_NAMES = {1: "总督", 2: "提督", 3: "舰长"}
+# GUARD_BUY 与 USER_TOAST_MSG_V2 会对同一次上舰各推一条，这个时间内同一用户同一等级只推一次
+_GUARD_DEDUP_S = 30.0
+
+# 输出队列满时的处理方式：丢最旧的（实时展示，默认）、丢新来的、或阻塞（让各房间连接暂停读取，背压传回服务器）
+OVERFLOW_POLICIES = ("drop_oldest", "drop", "block")
+
+
+# 互动汇总里各 msg_type 的显示名，顺序即显示顺序；键与 InteractAggregator 的计数名一致
+_INTERACT_LABELS = {
+    "enter": "进入", "follow": "关注", "share": "分享", "special_follow": "特别关注",
+    "mutual_follow": "互相关注", "like": "点赞", "other": "其他互动",
+}
 
 
 class _Handler(blivedm.BaseHandler):
-    def __init__(self, out_queue: "asyncio.Queue[DanmakuItem]", color_map: Dict[int, str]):
+    def __init__(self, out_queue: "asyncio.Queue[DanmakuItem]", color_map: Dict[int, str],
+                 popularity: Optional[Dict[int, int]] = None, analytics: Optional[ChatAnalytics] = None,
+                 interact_sample: float = 0.0, overflow: str = "drop_oldest"):
         super().__init__()
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {overflow}")
         self._out = out_queue
+        self._overflow_policy = overflow
+        # block 模式下队列满时暂存的消息（一条 WebSocket 消息可能带多条），由 _drain 按顺序送入队列
+        self._pending: "collections.deque[DanmakuItem]" = collections.deque()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._drain_task: Optional[asyncio.Task] = None
+        self.dropped = 0
         self._color_map = color_map
+        self._popularity = popularity if popularity is not None else {}
+        self._analytics = analytics
         self._connected_logged: set[int] = set()
+        # 礼物连击合并后再推送，避免连击时每秒几十条
+        self.gift_combiner = GiftCombiner(self._on_gift_combo)
+        self._recent_guards: Dict[Tuple[int, int, int], float] = {}
+        # 进房/关注/分享只计数，周期性推送汇总，可选抽样推送单条
+        self.interact_aggregator = InteractAggregator(self._on_interact_summary, sample_rate=interact_sample)
+
+    def __interact_word_v2_callback(self, client: blivedm.BLiveClient, command: dict):
+        # 大房间里这是量最大的消息，只取 msg_type 计数，被抽中时才完整解析
+        data = command['data']
+        if self.interact_aggregator.add(client.room_id, web_models.InteractWordV2Message.peek_msg_type(data)):
+            self._on_interact_word_v2(client, web_models.InteractWordV2Message.from_command(data))
+
+    _CMD_CALLBACK_DICT = {
+        **blivedm.BaseHandler._CMD_CALLBACK_DICT,
+        'INTERACT_WORD_V2': __interact_word_v2_callback,
+    }
+
+    def _put(self, item: DanmakuItem) -> None:
+        if self._pending:
+            self._pending.append(item)
+            return
+        try:
+            self._out.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self._overflow_policy == "block":
+            self._pending.append(item)
+            self._drained.clear()
+            if self._drain_task is None or self._drain_task.done():
+                self._drain_task = asyncio.get_running_loop().create_task(self._drain())
+            return
+        self.dropped += 1
+        if self._overflow_policy == "drop":
+            return
+        # 队列满时丢弃最旧的
+        try:
+            self._out.get_nowait()
+        except Exception:
+            pass
+        try:
+            self._out.put_nowait(item)
+        except Exception:
+            pass
+
+    async def _drain(self) -> None:
+        try:
+            while self._pending:
+                await self._out.put(self._pending[0])
+                self._pending.popleft()
+        finally:
+            self._drained.set()
+
+    def wait_ready(self, client: blivedm.BLiveClient) -> Optional[Awaitable]:
+        # 只有 block 模式且有积压时才让连接等待
+        return None if self._drained.is_set() else self._drained.wait()
+
+    async def close(self, timeout: float = 2.0) -> None:
+        """
+        推出合并中的礼物与互动汇总；block 模式下暂存的消息最多再等 timeout 秒送入队列，
+        消费端停了送不进去的计入 dropped
+        """
+        self.gift_combiner.close()
+        self.interact_aggregator.close()
+        if self._pending:
+            try:
+                await asyncio.wait_for(self._drained.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        if self._drain_task is not None:
+            self._drain_task.cancel()
+            self._drain_task = None
+        if self._pending:
+            logging.getLogger('multiplelive').warning(f"Dropped {len(self._pending)} pending items on close")
+            self.dropped += len(self._pending)
+            self._pending.clear()
+            self._drained.set()
+
+    def _event(self, client: blivedm.BLiveClient, type_: str, uname: str, msg: str, ts: float,
+               data: Dict[str, Any]) -> EventItem:
+        return EventItem(
+            room_id=client.room_id,
+            uname=uname,
+            msg=msg,
+            ts_ms=int(ts * 1000) if ts else int(time.time() * 1000),
+            color=self._color_map.get(client.room_id, "#ffffff"),
+            type=type_,
+            data=data,
+        )
+
+    def _on_heartbeat(self, client: blivedm.BLiveClient, message: web_models.HeartbeatMessage):
+        # 记录人气值，重连排队时优先恢复有观众的房间；与准入排队、引用计数一样用构造时的房间号作键
+        self._popularity[client_room_key(client)] = message.popularity
 
     def _on_danmaku(self, client: blivedm.BLiveClient, message: web_models.DanmakuMessage):
         color = self._color_map.get(client.room_id, "#ffffff")
@@ -36,41 +161,233 @@ class _Handler(blivedm.BaseHandler):
             ts_ms=int(message.timestamp * 1000) if getattr(message, "timestamp", None) else 0,
             color=color,
         )
+        if self._analytics is not None:
+            self._analytics.record(client.room_id, message.uid, message.uname, message.msg,
+                                   message.medal_level, message.medal_room_id)
         # 首次收到该房间弹幕时，输出一次“获取成功”的状态日志
         if client.room_id not in self._connected_logged:
             logging.getLogger('multiplelive').info(f"Danmaku connected room={client.room_id}")
             self._connected_logged.add(client.room_id)
-        try:
-            self._out.put_nowait(item)
-        except asyncio.QueueFull:
-            try:
-                self._out.get_nowait()
-            except Exception:
-                pass
-            try:
-                self._out.put_nowait(item)
-            except Exception:
-                pass
+        self._put(item)
+
+    def _on_gift(self, client: blivedm.BLiveClient, message: web_models.GiftMessage):
+        self.gift_combiner.add(client.room_id, message.uid, message.uname, message.gift_id, message.gift_name,
+                               message.num, message.total_coin, message.coin_type, timestamp=message.timestamp)
+
+    def _on_gift_combo(self, combo: GiftCombo) -> None:
+        ts = combo.extra.get("timestamp") or 0
+        self._put(EventItem(
+            room_id=combo.room_id,
+            uname=combo.uname,
+            msg=f"{combo.uname} 赠送 {combo.gift_name} x{combo.num}",
+            ts_ms=int(ts * 1000) if ts else int(time.time() * 1000),
+            color=self._color_map.get(combo.room_id, "#ffffff"),
+            type="gift",
+            data={
+                "uid": combo.uid,
+                "gift_id": combo.gift_id,
+                "gift_name": combo.gift_name,
+                "num": combo.num,
+                "total_coin": combo.total_coin,
+                "coin_type": combo.coin_type,
+                "combo_events": combo.events,
+            },
+        ))
+
+    def _on_interact_word_v2(self, client: blivedm.BLiveClient, message: web_models.InteractWordV2Message):
+        action = {1: "进入了直播间", 2: "关注了主播", 3: "分享了直播间"}.get(message.msg_type, "互动")
+        self._put(self._event(client, "interact", message.username, f"{message.username} {action}",
+                              message.timestamp, {"uid": message.uid, "msg_type": message.msg_type}))
+
+    def _on_interact_summary(self, room_id: int, counts: Dict[str, int], interval: float) -> None:
+        text = " · ".join(f"{label} {counts[k]}" for k, label in _INTERACT_LABELS.items() if counts.get(k))
+        if not text:
+            return
+        self._put(EventItem(
+            room_id=room_id,
+            uname="",
+            msg=text,
+            ts_ms=int(time.time() * 1000),
+            color=self._color_map.get(room_id, "#ffffff"),
+            type="interact_summary",
+            data={"counts": counts, "interval_s": interval},
+        ))
+
+    def _on_super_chat(self, client: blivedm.BLiveClient, message: web_models.SuperChatMessage):
+        self._put(self._event(client, "super_chat", message.uname,
+                              f"[SC ¥{message.price}] {message.uname}: {message.message}", message.start_time, {
+                                  "id": message.id,
+                                  "uid": message.uid,
+                                  "price": message.price,
+                                  "message": message.message,
+                                  "duration": message.end_time - message.start_time,
+                                  "background_color": message.background_color,
+                              }))
+
+    def _on_super_chat_delete(self, client: blivedm.BLiveClient, message: web_models.SuperChatDeleteMessage):
+        self._put(self._event(client, "super_chat_delete", "", "", 0, {"ids": message.ids}))
+
+    def _on_user_toast_v2(self, client: blivedm.BLiveClient, message: web_models.UserToastV2Message):
+        self._on_guard(client, message.uid, message.username, message.guard_level, message.num, message.price,
+                       message.unit, message.start_time)
+
+    def _on_buy_guard(self, client: blivedm.BLiveClient, message: web_models.GuardBuyMessage):
+        self._on_guard(client, message.uid, message.username, message.guard_level, message.num, message.price,
+                       "月", message.start_time)
+
+    def _on_guard(self, client: blivedm.BLiveClient, uid: int, uname: str, guard_level: int, num: int,
+                  price: int, unit: str, start_time: int) -> None:
+        now = time.monotonic()
+        key = (client.room_id, uid, guard_level)
+        last = self._recent_guards.get(key)
+        if last is not None and now - last < _GUARD_DEDUP_S:
+            return
+        self._recent_guards[key] = now
+        if len(self._recent_guards) > 256:
+            self._recent_guards = {k: t for k, t in self._recent_guards.items() if now - t < _GUARD_DEDUP_S}
+        guard_name = _GUARD_NAMES.get(guard_level, "舰长")
+        self._put(self._event(client, "guard", uname, f"{uname} 开通了 {guard_name} x{num}{unit}", start_time, {
+            "uid": uid,
+            "guard_level": guard_level,
+            "num": num,
+            "unit": unit,
+            "price": price,
+        }))
 
 
 class DanmakuCollector:
     def __init__(self, room_ids: Iterable[int], color_map: Optional[Dict[int, str]] = None,
-                 queue_maxsize: int = 1024) -> None:
-        self.room_ids = list(room_ids)
+                 queue_maxsize: int = 1024,
+                 bootstrap_cache: Optional["blivedm.BootstrapCacheInterface"] = None,
+                 priorities: Optional[Dict[int, float]] = None, interact_sample: float = 0.0,
+                 overflow: str = "drop_oldest") -> None:
+        self._initial_rooms = list(room_ids)
         self.color_map = color_map or {}
         self.queue: "asyncio.Queue[DanmakuItem]" = asyncio.Queue(maxsize=queue_maxsize)
         self.clients: List[blivedm.BLiveClient] = []
+        # 所有房间共用一个心跳时间轮，避免每个连接各自一个定时器
+        self.heartbeat_scheduler = blivedm.HeartbeatScheduler()
+        self.bootstrap_cache = bootstrap_cache
+        # 所有房间共用一个 session：cookie（buvid3）、wbi 口令与连接池只需初始化一次
+        self.session: Optional[aiohttp.ClientSession] = None
+        # 调用方给出的房间优先级与运行中从心跳得到的人气值，决定连接排队顺序
+        self.priorities: Dict[int, float] = dict(priorities or {})
+        self.popularity: Dict[int, int] = {}
+        self.admission = AdmissionController(priority=self._room_priority)
+        self.host_scoreboard = _host_scoreboard
+        # 各房间实时统计（弹幕速率、去重人数、活跃用户与热词、粉丝牌占比）
+        self.analytics = ChatAnalytics()
+        self.handler: Optional[_Handler] = None
+        self.interact_sample = interact_sample
+        self.overflow = overflow
+        # 各房间的引用计数，多个会话共用一个连接；计数归零时断开
+        self._refs: Dict[int, int] = {}
+        self._clients_by_room: Dict[int, blivedm.BLiveClient] = {}
+        self._closing: Set[asyncio.Task] = set()  # 正在断开的连接
+        self._stopped = asyncio.Event()
 
-    async def start(self) -> None:
-        handler = _Handler(self.queue, self.color_map)
-        for rid in self.room_ids:
-            client = blivedm.BLiveClient(rid)
+    def _room_priority(self, client: blivedm.BLiveClient) -> float:
+        rid = client_room_key(client)
+        return max(self.priorities.get(rid, 0), self.popularity.get(rid, 0))
+
+    @property
+    def room_ids(self) -> List[int]:
+        """当前连接中的房间"""
+        return list(self._refs)
+
+    def ref_counts(self) -> Dict[int, int]:
+        return dict(self._refs)
+
+    def set_interact_sample(self, rate: float) -> None:
+        """修改单条进房/关注事件的抽样比例，运行中立即生效"""
+        self.interact_sample = rate
+        if self.handler is not None:
+            self.handler.interact_aggregator.sample_rate = rate
+
+    def _open(self) -> _Handler:
+        if self.handler is None:
+            self.handler = _Handler(self.queue, self.color_map, self.popularity, self.analytics,
+                                    self.interact_sample, self.overflow)
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        return self.handler
+
+    def acquire(self, room_ids: Iterable[int]) -> List[int]:
+        """房间引用计数加一，从 0 变为 1 的房间建立连接；返回新连接的房间"""
+        handler = self._open()
+        added = []
+        for rid in room_ids:
+            count = self._refs.get(rid, 0)
+            self._refs[rid] = count + 1
+            if count == 0:
+                added.append(rid)
+        self.admission.expect(added)
+        for rid in added:
+            client = blivedm.BLiveClient(rid, session=self.session, heartbeat_scheduler=self.heartbeat_scheduler,
+                                         bootstrap_cache=self.bootstrap_cache, host_scoreboard=self.host_scoreboard)
             client.set_handler(handler)
+            client.set_connect_gate(self.admission)
             client.start()
             self.clients.append(client)
-        await asyncio.gather(*(c.join() for c in self.clients))
+            self._clients_by_room[rid] = client
+        return added
+
+    def release(self, room_ids: Iterable[int]) -> List[int]:
+        """房间引用计数减一，归零的房间断开连接；返回断开的房间"""
+        removed = []
+        for rid in room_ids:
+            count = self._refs.get(rid, 0)
+            if count <= 0:
+                continue
+            if count > 1:
+                self._refs[rid] = count - 1
+                continue
+            del self._refs[rid]
+            removed.append(rid)
+            client = self._clients_by_room.pop(rid, None)
+            if client is not None:
+                self.clients.remove(client)
+                task = asyncio.create_task(client.stop_and_close())
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+        self.admission.forget(removed)
+        for rid in removed:
+            self.popularity.pop(rid, None)
+            self.analytics.rooms.pop(rid, None)
+        return removed
+
+    async def start(self) -> None:
+        """连接构造时给出的房间，直到 stop"""
+        self.acquire(self._initial_rooms)
+        await self._stopped.wait()
+
+    def connect_stats(self) -> Dict[str, Dict[str, float]]:
+        """各房间 init_room 耗时与建连总耗时（到认证成功）的汇总，单位秒"""
+        def summarize(values: List[float]) -> Dict[str, float]:
+            if not values:
+                return {}
+            values = sorted(values)
+            return {
+                "count": len(values),
+                "avg": round(sum(values) / len(values), 3),
+                "p50": round(values[len(values) // 2], 3),
+                "max": round(values[-1], 3),
+            }
+
+        return {
+            "init_room_s": summarize([c.init_room_duration for c in self.clients if c.init_room_duration is not None]),
+            "time_to_connect_s": summarize([c.time_to_connect for c in self.clients if c.time_to_connect is not None]),
+        }
 
     async def stop(self) -> None:
-        await asyncio.gather(*(c.stop_and_close() for c in self.clients), return_exceptions=True)
+        self._stopped.set()
+        self._refs.clear()
+        self._clients_by_room.clear()
+        await asyncio.gather(*(c.stop_and_close() for c in self.clients), *self._closing, return_exceptions=True)
+        self.clients.clear()
+        if self.handler is not None:
+            await self.handler.close()
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
 
 
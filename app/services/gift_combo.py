@@ -0,0 +1,88 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+
+@dataclass
+class GiftCombo:
+    """同一用户在同一房间连续送出的同一种礼物，合并后一次推送"""
+    room_id: int
+    uid: int
+    uname: str
+    gift_id: int
+    gift_name: str
+    coin_type: str
+    num: int = 0
+    total_coin: int = 0
+    events: int = 0  # 合并了多少条 SEND_GIFT
+    first_ts: float = 0.0
+    last_ts: float = 0.0
+    extra: Dict[str, object] = field(default_factory=dict)
+
+
+ComboKey = Tuple[int, int, int]
+
+
+class GiftCombiner:
+    """
+    礼物连击合并：按 (房间, 用户, 礼物) 累加数量与金额，距上一条超过 window 秒、
+    或从第一条起已超过 max_hold 秒（持续连击时也定期输出）时调用 emit 推送一次。
+
+    :param emit: 合并完成后的回调，在事件循环中调用
+    :param window: 连击间隔超过这个时间视为结束
+    :param max_hold: 一次合并最多攒多久
+    """
+
+    def __init__(self, emit: Callable[[GiftCombo], None], window: float = 2.0, max_hold: float = 10.0,
+                 tick: float = 0.25) -> None:
+        self._emit = emit
+        self.window = window
+        self.max_hold = max_hold
+        self.tick = tick
+        self._pending: Dict[ComboKey, GiftCombo] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, room_id: int, uid: int, uname: str, gift_id: int, gift_name: str, num: int,
+            total_coin: int, coin_type: str, now: Optional[float] = None, **extra) -> None:
+        now = time.monotonic() if now is None else now
+        key = (room_id, uid, gift_id)
+        combo = self._pending.get(key)
+        if combo is None:
+            combo = self._pending[key] = GiftCombo(room_id, uid, uname, gift_id, gift_name, coin_type,
+                                                   first_ts=now, extra=extra)
+        combo.num += num
+        combo.total_coin += total_coin
+        combo.events += 1
+        combo.last_ts = now
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def flush(self, now: Optional[float] = None, force: bool = False) -> int:
+        """输出已经结束的连击，force 时全部输出；返回输出的数量"""
+        now = time.monotonic() if now is None else now
+        done = [
+            key for key, combo in self._pending.items()
+            if force or now - combo.last_ts >= self.window or now - combo.first_ts >= self.max_hold
+        ]
+        for key in done:
+            self._emit(self._pending.pop(key))
+        return len(done)
+
+    async def _run(self) -> None:
+        try:
+            while self._pending:
+                await asyncio.sleep(self.tick)
+                self.flush()
+        finally:
+            self._task = None
+
+    def close(self) -> None:
+        """输出所有未完成的连击并停止定时任务"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.flush(force=True)
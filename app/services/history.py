@@ -0,0 +1,103 @@
+import itertools
+from typing import Dict, List, Optional
+
+from services.items import DanmakuItem
+
+# 每条弹幕的估算固定开销（dataclass 对象、字段引用、int/str 头部），用于按字节限制内存
+_ITEM_OVERHEAD = 200
+
+
+def _item_size(item: DanmakuItem) -> int:
+    return _ITEM_OVERHEAD + len(item.uname) + len(item.msg) + len(item.color)
+
+
+class RoomHistory:
+    """
+    单个房间的最近弹幕环形缓冲：容量固定，超出条数或字节预算时覆盖最旧的。
+    条目按 seq 单调递增排列，按 seq 查询用二分，只复制请求的那一段。
+    """
+
+    def __init__(self, capacity: int = 500, max_bytes: int = 256 * 1024) -> None:
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._buf: List[Optional[DanmakuItem]] = [None] * capacity
+        self._start = 0  # 最旧条目在 _buf 中的位置
+        self._len = 0
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _at(self, i: int) -> DanmakuItem:
+        return self._buf[(self._start + i) % self.capacity]  # type: ignore[return-value]
+
+    def _pop_oldest(self) -> None:
+        old = self._buf[self._start]
+        self._buf[self._start] = None
+        self._start = (self._start + 1) % self.capacity
+        self._len -= 1
+        if old is not None:
+            self._bytes -= _item_size(old)
+
+    def append(self, item: DanmakuItem) -> None:
+        if self._len == self.capacity:
+            self._pop_oldest()
+        size = _item_size(item)
+        while self._len > 0 and self._bytes + size > self.max_bytes:
+            self._pop_oldest()
+        self._buf[(self._start + self._len) % self.capacity] = item
+        self._len += 1
+        self._bytes += size
+
+    @property
+    def oldest_seq(self) -> Optional[int]:
+        return self._at(0).seq if self._len else None
+
+    @property
+    def last_seq(self) -> Optional[int]:
+        return self._at(self._len - 1).seq if self._len else None
+
+    def _first_after(self, seq: int) -> int:
+        """第一个 seq 大于给定值的逻辑位置"""
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._at(mid).seq <= seq:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def since(self, seq: Optional[int], limit: int) -> List[DanmakuItem]:
+        """
+        seq 为 None 时返回最新的 limit 条，否则返回 seq 之后的最多 limit 条（按时间正序）
+        """
+        limit = max(0, min(limit, self._len))
+        if seq is None:
+            begin = self._len - limit
+        else:
+            begin = self._first_after(seq)
+        end = min(self._len, begin + limit)
+        return [self._at(i) for i in range(begin, end)]
+
+
+class HistoryStore:
+    """所有房间的最近弹幕，并分配全局单调递增的序号"""
+
+    def __init__(self, capacity_per_room: int = 500, max_bytes_per_room: int = 256 * 1024) -> None:
+        self.capacity_per_room = capacity_per_room
+        self.max_bytes_per_room = max_bytes_per_room
+        self._rooms: Dict[int, RoomHistory] = {}
+        self._seq = itertools.count(1)
+
+    def append(self, item: DanmakuItem) -> int:
+        """记录一条弹幕，给它分配序号并返回"""
+        item.seq = next(self._seq)
+        room = self._rooms.get(item.room_id)
+        if room is None:
+            room = self._rooms[item.room_id] = RoomHistory(self.capacity_per_room, self.max_bytes_per_room)
+        room.append(item)
+        return item.seq
+
+    def room(self, room_id: int) -> Optional[RoomHistory]:
+        return self._rooms.get(room_id)
@@ -0,0 +1,406 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urljoin, urlsplit
+
+import aiohttp
+from aiohttp import web
+
+from services.ts_audio import TsAudioFilter
+
+logger = logging.getLogger('multiplelive')
+
+_UPSTREAM_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Referer": "https://live.bilibili.com/",
+    "Origin": "https://live.bilibili.com",
+}
+_URI_ATTR = re.compile(r'URI="([^"]+)"')
+_TARGET_DURATION = re.compile(r"#EXT-X-TARGETDURATION:(\d+(?:\.\d+)?)")
+# 只中继 B 站直播 CDN 的地址，避免 /api/resolve 被当作任意地址的代理；
+# 环境变量 MULTIPLELIVE_HLS_RELAY_HOSTS 可追加域名后缀（逗号分隔）
+DEFAULT_ALLOWED_HOSTS = ("bilivideo.com", "bilivideo.cn", "szbdyd.com", "hdslb.com")
+_AUDIO_PREFIX = "audio-"  # 音频分片的缓存键前缀，去掉后为同一分片完整版本的键
+
+
+def _path_key(url: str) -> str:
+    """按路径（不含主机与鉴权参数）生成键：同一路流换了 CDN 节点或 token 仍然对应同一个键"""
+    return hashlib.sha1(urlsplit(url).path.encode("utf-8")).hexdigest()[:16]
+
+
+def _extension(url: str) -> str:
+    path = urlsplit(url).path
+    dot = path.rfind(".")
+    return path[dot:] if dot > path.rfind("/") else ""
+
+
+class _Fetch:
+    """一次进行中的上游分片下载，所有等待者共享同一份数据，边下边读"""
+
+    def __init__(self) -> None:
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.content_type = "application/octet-stream"
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.headers_ready = asyncio.Event()
+        self._changed = asyncio.Condition()
+
+    async def append(self, chunk: bytes) -> None:
+        async with self._changed:
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+            self._changed.notify_all()
+
+    async def finish(self, error: Optional[BaseException] = None) -> None:
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self.headers_ready.set()
+            self._changed.notify_all()
+
+    async def iter_chunks(self):
+        i = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: i < len(self.chunks) or self.done)
+                pending = self.chunks[i:]
+                done, error = self.done, self.error
+            for chunk in pending:
+                yield chunk
+            i += len(pending)
+            if done and i >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SegmentCache:
+    """按字节数限制的 LRU 分片缓存"""
+
+    def __init__(self, max_bytes: int = 128 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    def put(self, key: str, body: bytes, content_type: str) -> None:
+        if len(body) > self.max_bytes // 4 or key in self._items:
+            return
+        self._items[key] = (body, content_type)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            _, (old, _) = self._items.popitem(last=False)
+            self.bytes -= len(old)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class _Stream:
+    """一路上游播放列表：只有一个轮询任务，所有播放器读取同一份改写后的列表"""
+
+    def __init__(self, stream_id: str, upstream: str, audio_only: bool = False) -> None:
+        self.stream_id = stream_id
+        self.upstream = upstream
+        self.audio_only = audio_only  # 分片过滤为只含音频的 TS
+        self.fallbacks: List[str] = []  # 其他 CDN 节点或之后重新解析得到的地址，当前地址失效时依次换用
+        self.playlist: Optional[str] = None
+        self.fetched_at = 0.0
+        self.accessed_at = time.monotonic()
+        self.interval = 1.0
+        self.updated = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.segments: "OrderedDict[str, str]" = OrderedDict()  # 分片键 -> 上游绝对地址
+        self.failures = 0
+        self.expiry: Optional[asyncio.TimerHandle] = None  # 不轮询时的删除定时器
+
+
+class HlsRelay:
+    """
+    HLS 中继：每路流只轮询一次上游播放列表，分片地址改写到本地 /hls/，
+    分片同一时刻只向上游请求一次，边下载边推给所有等待的播放器，并放入按字节限制的 LRU。
+    观众增加时上游流量基本不变。
+    音频模式（audio_only）的流把 TS 分片过滤为只含音频的包，同一分片的完整版本在缓存或下载中时直接复用。
+
+    :param max_cache_bytes: 分片缓存上限
+    :param idle_timeout: 多久没有播放器请求播放列表后停止轮询
+    :param stream_ttl: 停止轮询（或登记后一直没人播放）多久后删除这路流
+    :param allowed_hosts: 允许中继的上游域名（含其子域名），None 为 DEFAULT_ALLOWED_HOSTS 加环境变量追加的
+    """
+
+    def __init__(self, max_cache_bytes: int = 128 * 1024 * 1024, idle_timeout: float = 30.0,
+                 max_segments_per_stream: int = 256, stream_ttl: float = 600.0,
+                 allowed_hosts: Optional[Sequence[str]] = None) -> None:
+        self.idle_timeout = idle_timeout
+        self.stream_ttl = stream_ttl
+        if allowed_hosts is None:
+            extra = os.environ.get("MULTIPLELIVE_HLS_RELAY_HOSTS", "")
+            allowed_hosts = [*DEFAULT_ALLOWED_HOSTS, *(h.strip() for h in extra.split(",") if h.strip())]
+        self.allowed_hosts = tuple(h.lower().lstrip(".") for h in allowed_hosts)
+        self.max_segments_per_stream = max_segments_per_stream
+        self.cache = SegmentCache(max_cache_bytes)
+        self._streams: Dict[str, _Stream] = {}
+        self._inflight: Dict[str, _Fetch] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        self.upstream_bytes = 0
+        self.served_bytes = 0
+        self.playlist_fetches = 0
+        self.segment_fetches = 0
+        self.cache_hits = 0
+        self.shared_waits = 0  # 加入了进行中下载的请求数
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=_UPSTREAM_HEADERS, timeout=aiohttp.ClientTimeout(total=20, sock_read=10)
+            )
+        return self._session
+
+    def is_allowed(self, url: str) -> bool:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        return parts.scheme in ("http", "https") and any(
+            host == h or host.endswith("." + h) for h in self.allowed_hosts)
+
+    async def close(self) -> None:
+        for stream in self._streams.values():
+            if stream.task is not None:
+                stream.task.cancel()
+            if stream.expiry is not None:
+                stream.expiry.cancel()
+        self._streams.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # ---- 播放列表 ----
+
+    def register(self, upstream: str, audio_only: bool = False, fallbacks: Sequence[str] = ()) -> str:
+        """
+        登记一个上游 m3u8（及同一路流在其他 CDN 节点上的备用地址），返回本地播放列表路径。
+        上游不在允许的域名内时抛出 ValueError，不在允许域名内的备用地址直接忽略
+        """
+        if not self.is_allowed(upstream):
+            raise ValueError(f"host not allowed for relay: {urlsplit(upstream).hostname}")
+        fallbacks = [url for url in fallbacks if self.is_allowed(url)]
+        stream_id = _path_key(upstream) + ("-audio" if audio_only else "")
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            stream = self._streams[stream_id] = _Stream(stream_id, upstream, audio_only)
+            stream.fallbacks = fallbacks
+        elif stream.upstream != upstream:
+            # 正在用的地址继续用，新解析的地址 token 更新，排在备用列表最前
+            stream.fallbacks = [upstream, *fallbacks]
+        stream.accessed_at = time.monotonic()
+        if stream.task is None:
+            self._schedule_expiry(stream)
+        return f"/hls/{stream_id}/index.m3u8"
+
+    def _schedule_expiry(self, stream: _Stream) -> None:
+        if stream.expiry is not None:
+            stream.expiry.cancel()
+        stream.expiry = asyncio.get_running_loop().call_later(self.stream_ttl, self._expire, stream)
+
+    def _expire(self, stream: _Stream) -> None:
+        stream.expiry = None
+        if stream.task is not None or self._streams.get(stream.stream_id) is not stream:
+            return
+        idle = time.monotonic() - stream.accessed_at
+        if idle < self.stream_ttl:
+            stream.expiry = asyncio.get_running_loop().call_later(self.stream_ttl - idle, self._expire, stream)
+            return
+        del self._streams[stream.stream_id]
+        logger.info(f"HLS relay stream={stream.stream_id} expired")
+
+    async def playlist(self, stream_id: str) -> Optional[str]:
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            return None
+        stream.accessed_at = time.monotonic()
+        if stream.task is None:
+            if stream.expiry is not None:
+                stream.expiry.cancel()
+                stream.expiry = None
+            stream.task = asyncio.create_task(self._poll(stream))
+        # 轮询停滞或还没有第一份列表时等待下一次更新
+        if stream.playlist is None or time.monotonic() - stream.fetched_at > stream.interval * 3:
+            stream.updated.clear()
+            try:
+                await asyncio.wait_for(stream.updated.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                pass
+        return stream.playlist
+
+    async def _poll(self, stream: _Stream) -> None:
+        try:
+            while time.monotonic() - stream.accessed_at < self.idle_timeout:
+                try:
+                    await self._refresh(stream)
+                    stream.failures = 0
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    stream.failures += 1
+                    logger.warning(f"HLS relay playlist fetch failed stream={stream.stream_id}: {e}")
+                    if stream.fallbacks:
+                        stream.upstream = stream.fallbacks.pop(0)
+                        logger.info(f"HLS relay stream={stream.stream_id} switched to {urlsplit(stream.upstream).netloc}")
+                await asyncio.sleep(stream.interval if not stream.failures else min(5.0, stream.failures))
+        finally:
+            stream.task = None
+            if self._streams.get(stream.stream_id) is stream:
+                self._schedule_expiry(stream)
+
+    async def _refresh(self, stream: _Stream) -> None:
+        async with self._get_session().get(stream.upstream) as resp:
+            resp.raise_for_status()
+            text = await resp.text()
+            final_url = str(resp.url)
+        if not self.is_allowed(final_url):
+            raise ValueError(f"playlist redirected to a host not allowed for relay: {urlsplit(final_url).hostname}")
+        self.playlist_fetches += 1
+        self.upstream_bytes += len(text)
+        m = _TARGET_DURATION.search(text)
+        if m:
+            stream.interval = max(0.5, min(float(m.group(1)) / 2, 3.0))
+        stream.playlist = self._rewrite(stream, text, final_url)
+        stream.fetched_at = time.monotonic()
+        stream.updated.set()
+
+    def _local_uri(self, stream: _Stream, uri: str, base: str) -> str:
+        absolute = urljoin(base, uri)
+        if not self.is_allowed(absolute):
+            # 不经中继，播放器直接请求（或失败），中继不替任意地址取数据
+            return absolute
+        if _extension(absolute) == ".m3u8":
+            # 多码率主列表里的子列表，登记成独立的流
+            return self.register(absolute, stream.audio_only)
+        key = (_AUDIO_PREFIX if stream.audio_only else "") + _path_key(absolute) + _extension(absolute)
+        stream.segments[key] = absolute
+        stream.segments.move_to_end(key)
+        while len(stream.segments) > self.max_segments_per_stream:
+            stream.segments.popitem(last=False)
+        return f"/hls/{stream.stream_id}/seg/{key}"
+
+    def _rewrite(self, stream: _Stream, text: str, base: str) -> str:
+        out = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                if 'URI="' in line:
+                    line = _URI_ATTR.sub(lambda m: f'URI="{self._local_uri(stream, m.group(1), base)}"', line)
+                out.append(line)
+            else:
+                out.append(self._local_uri(stream, line, base))
+        return "\n".join(out) + "\n"
+
+    # ---- 分片 ----
+
+    async def serve_segment(self, req: web.Request, stream_id: str, key: str) -> web.StreamResponse:
+        stream = self._streams.get(stream_id)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache_hits += 1
+            body, content_type = cached
+            self.served_bytes += len(body)
+            return web.Response(body=body, content_type=content_type)
+        if stream is None or key not in stream.segments:
+            raise web.HTTPNotFound()
+
+        fetch = self._inflight.get(key)
+        if fetch is None:
+            fetch = self._inflight[key] = _Fetch()
+            asyncio.create_task(self._download(key, stream.segments[key], fetch))
+        else:
+            self.shared_waits += 1
+
+        await fetch.headers_ready.wait()
+        if fetch.done and fetch.error is not None:
+            raise web.HTTPBadGateway(text=str(fetch.error))
+        resp = web.StreamResponse(headers={"Content-Type": fetch.content_type})
+        await resp.prepare(req)
+        try:
+            async for chunk in fetch.iter_chunks():
+                await resp.write(chunk)
+                self.served_bytes += len(chunk)
+        except Exception as e:
+            # 响应头已经发出，只能中断连接让播放器重试
+            logger.warning(f"HLS relay segment {key} aborted: {e}")
+            raise
+        await resp.write_eof()
+        return resp
+
+    async def _source_chunks(self, key: str, url: str, fetch: _Fetch):
+        """分片的原始数据：音频分片优先复用同一分片完整版本的缓存或进行中的下载"""
+        if key.startswith(_AUDIO_PREFIX):
+            full_key = key[len(_AUDIO_PREFIX):]
+            cached = self.cache.get(full_key)
+            if cached is not None:
+                self.cache_hits += 1
+                fetch.content_type = cached[1]
+                yield cached[0]
+                return
+            shared = self._inflight.get(full_key)
+            if shared is not None:
+                self.shared_waits += 1
+                await shared.headers_ready.wait()
+                fetch.content_type = shared.content_type
+                async for chunk in shared.iter_chunks():
+                    yield chunk
+                return
+        async with self._get_session().get(url) as resp:
+            resp.raise_for_status()
+            fetch.content_type = resp.headers.get("Content-Type", fetch.content_type)
+            self.segment_fetches += 1
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                self.upstream_bytes += len(chunk)
+                yield chunk
+
+    async def _download(self, key: str, url: str, fetch: _Fetch) -> None:
+        error: Optional[BaseException] = None
+        audio = TsAudioFilter() if key.startswith(_AUDIO_PREFIX) else None
+        try:
+            async for chunk in self._source_chunks(key, url, fetch):
+                fetch.headers_ready.set()
+                if audio is not None:
+                    chunk = audio.feed(chunk)
+                if chunk:
+                    await fetch.append(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            self._inflight.pop(key, None)
+            await fetch.finish(error)
+        if error is None:
+            self.cache.put(key, b"".join(fetch.chunks), fetch.content_type)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "streams": {
+                sid: {"polling": s.task is not None, "interval_s": s.interval, "failures": s.failures,
+                      "host": urlsplit(s.upstream).netloc, "fallbacks": len(s.fallbacks)}
+                for sid, s in self._streams.items()
+            },
+            "upstream_bytes": self.upstream_bytes,
+            "served_bytes": self.served_bytes,
+            "playlist_fetches": self.playlist_fetches,
+            "segment_fetches": self.segment_fetches,
+            "cache_hits": self.cache_hits,
+            "shared_waits": self.shared_waits,
+            "cache_bytes": self.cache.bytes,
+            "cache_items": len(self.cache),
+        }
@@ -0,0 +1,57 @@
+import asyncio
+import random
+from typing import Callable, Dict, Optional
+
+# INTERACT_WORD_V2 的 msg_type
+_MSG_TYPE_NAMES = {1: "enter", 2: "follow", 3: "share", 4: "special_follow", 5: "mutual_follow", 6: "like"}
+
+
+class InteractAggregator:
+    """
+    进房/关注/分享等互动消息的聚合：平时只按 msg_type 计数，每 interval 秒对每个有变化的房间
+    调用一次 emit(room_id, counts, interval)；sample_rate > 0 时按比例抽样，抽中的单条由调用方完整解析。
+
+    :param emit: 输出汇总的回调
+    :param interval: 汇总周期（秒）
+    :param sample_rate: 单条事件的抽样比例，0 表示只输出汇总
+    """
+
+    def __init__(self, emit: Callable[[int, Dict[str, int], float], None], interval: float = 5.0,
+                 sample_rate: float = 0.0) -> None:
+        self._emit = emit
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self._counts: Dict[int, Dict[str, int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.total = 0
+
+    def add(self, room_id: int, msg_type: int) -> bool:
+        """计数一条消息，返回这条是否被抽中"""
+        counts = self._counts.get(room_id)
+        if counts is None:
+            counts = self._counts[room_id] = {}
+        name = _MSG_TYPE_NAMES.get(msg_type, "other")
+        counts[name] = counts.get(name, 0) + 1
+        self.total += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def flush(self) -> None:
+        counts, self._counts = self._counts, {}
+        for room_id, room_counts in counts.items():
+            self._emit(room_id, room_counts, self.interval)
+
+    async def _run(self) -> None:
+        try:
+            while self._counts:
+                await asyncio.sleep(self.interval)
+                self.flush()
+        finally:
+            self._task = None
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.flush()
@@ -0,0 +1,19 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+
+@dataclass
+class DanmakuItem:
+    room_id: int
+    uname: str
+    msg: str
+    ts_ms: int
+    color: str
+    seq: int = 0  # 全局递增序号，广播前分配
+
+
+@dataclass
+class EventItem(DanmakuItem):
+    """礼物、醒目留言、上舰等事件，msg 为可直接展示的摘要，明细在 data 里"""
+    type: str = "gift"  # gift / super_chat / super_chat_delete / guard / interact / interact_summary
+    data: Dict[str, Any] = field(default_factory=dict)
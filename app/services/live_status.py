@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import aiohttp
+
+logger = logging.getLogger('multiplelive')
+
+# 一次请求可带多个 room_ids；测试时可用环境变量 MULTIPLELIVE_LIVE_STATUS_URL 指向模拟服务
+DEFAULT_STATUS_URL = "https://api.live.bilibili.com/xlive/web-room/v1/index/getRoomBaseInfo"
+_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Referer": "https://live.bilibili.com/",
+}
+
+
+class LiveStatusPoller:
+    """
+    批量开播状态轮询：跟踪的房间按 batch_size 一批查询，请求之间至少间隔 min_request_interval 秒，
+    每个房间约每 interval 秒刷新一次。结果缓存在内存，查询不发请求。
+
+    房间由使用者持有：带 owner 跟踪的（如采集）一直跟踪到该使用者 untrack；不带 owner 的是一次性询问
+    （解析、状态查询），lease_ttl 秒内没有再被问到就停止跟踪。所有使用者都放手后才真正停止跟踪并丢弃状态。
+
+    :param url: getRoomBaseInfo 接口地址
+    :param batch_size: 每个请求带的房间数
+    :param interval: 每个房间的刷新周期（秒）
+    :param min_request_interval: 相邻两个请求的最小间隔（秒），限制总请求速率
+    :param lease_ttl: 不带 owner 跟踪的房间保留多久（秒）
+    """
+
+    def __init__(self, url: Optional[str] = None, batch_size: int = 50, interval: float = 60.0,
+                 min_request_interval: float = 0.5, lease_ttl: float = 600.0) -> None:
+        self.url = url or os.environ.get("MULTIPLELIVE_LIVE_STATUS_URL", "").strip() or DEFAULT_STATUS_URL
+        self.batch_size = batch_size
+        self.interval = interval
+        self.min_request_interval = min_request_interval
+        self.lease_ttl = lease_ttl
+        # room_id -> {"live", "title", "online", "checked_at"}；接口没有返回的房间 live 为 None
+        self._rooms: Dict[int, Dict[str, Any]] = {}
+        self._tracked: Dict[int, None] = {}  # 有序集合，保持加入顺序；有 owner 或租期未到的房间
+        self._owners: Dict[int, Set[str]] = {}
+        self._leases: Dict[int, float] = {}  # room_id -> 不带 owner 跟踪的到期时间（monotonic）
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._updated = asyncio.Condition()  # 每查完一批通知一次，refresh 在上面等待
+        self._force: Dict[int, None] = {}  # refresh 要求尽快查询的房间，排在最前
+        self._request_lock = asyncio.Lock()
+        self._last_request = 0.0
+        self._attempted: Dict[int, float] = {}  # 房间最近一次被查询的时间，无论成败
+        self._failing = False  # 最近一次请求失败，接口恢复前 refresh 不等待
+        self.requests = 0
+        self.errors = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers=_HEADERS, timeout=aiohttp.ClientTimeout(total=10))
+        return self._session
+
+    # ---- 生命周期 ----
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def track(self, room_ids: Iterable[int], owner: Optional[str] = None, ttl: Optional[float] = None) -> None:
+        """
+        开始跟踪。owner 为使用者标识，跟踪到同一 owner 调用 untrack 为止；
+        不带 owner 时租用 ttl 秒（默认 lease_ttl），再次跟踪时续期
+        """
+        added = False
+        expires = time.monotonic() + (self.lease_ttl if ttl is None else ttl)
+        for rid in room_ids:
+            if owner is None:
+                self._leases[rid] = max(self._leases.get(rid, 0.0), expires)
+            else:
+                self._owners.setdefault(rid, set()).add(owner)
+            if rid not in self._tracked:
+                self._tracked[rid] = None
+                added = True
+        if added:
+            self._wakeup.set()
+
+    def untrack(self, room_ids: Iterable[int], owner: str) -> None:
+        """owner 放手这些房间；没有其他使用者、租期也已过时停止跟踪并丢弃缓存的状态"""
+        now = time.monotonic()
+        for rid in room_ids:
+            owners = self._owners.get(rid)
+            if owners is not None:
+                owners.discard(owner)
+                if owners:
+                    continue
+                del self._owners[rid]
+            if self._leases.get(rid, 0.0) <= now:
+                self._drop(rid)
+
+    def _expire_leases(self) -> None:
+        now = time.monotonic()
+        for rid, expires in list(self._leases.items()):
+            if expires <= now and rid not in self._owners:
+                self._drop(rid)
+
+    def _drop(self, rid: int) -> None:
+        self._tracked.pop(rid, None)
+        self._owners.pop(rid, None)
+        self._leases.pop(rid, None)
+        self._force.pop(rid, None)
+        self._rooms.pop(rid, None)
+        self._attempted.pop(rid, None)
+
+    # ---- 查询 ----
+
+    def is_live(self, room_id: int) -> Optional[bool]:
+        """None 表示还不知道"""
+        info = self._rooms.get(room_id)
+        return None if info is None else info["live"]
+
+    def get(self, room_id: int) -> Optional[Dict[str, Any]]:
+        return self._rooms.get(room_id)
+
+    def snapshot(self, room_ids: Optional[Iterable[int]] = None) -> Dict[int, Optional[Dict[str, Any]]]:
+        rooms = list(self._tracked) if room_ids is None else list(room_ids)
+        return {rid: self._rooms.get(rid) for rid in rooms}
+
+    def stats(self) -> Dict[str, Any]:
+        self._expire_leases()
+        known = [info for rid, info in self._rooms.items() if rid in self._tracked and info["live"] is not None]
+        return {
+            "tracked": len(self._tracked),
+            "owned": len(self._owners),
+            "known": len(known),
+            "live": sum(1 for info in known if info["live"]),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
+
+    async def refresh(self, room_ids: Iterable[int], max_age: Optional[float] = None) -> None:
+        """
+        让轮询任务优先查询状态未知或超过 max_age 秒的房间，并等到它们都被查询过一次（失败也算），供启动采集前使用。
+        查询仍由轮询任务发出，受同样的速率限制，同时调用也不会重复请求；调用方应自行限定等待时间。
+        最近一次请求失败时只排队不等待，接口不可用时不拖慢调用方。
+        """
+        room_ids = list(room_ids)
+        max_age = self.interval if max_age is None else max_age
+        started = time.time()
+        stale = [rid for rid in room_ids
+                 if rid not in self._rooms or started - self._rooms[rid]["checked_at"] > max_age]
+        if not stale:
+            return
+        # 调用方通常已经跟踪了这些房间；没有跟踪的按一次性询问租用，查询结果才不会被丢弃
+        self.track(rid for rid in room_ids if rid not in self._tracked)
+        for rid in stale:
+            self._force[rid] = None
+        self._wakeup.set()
+        if self._failing:
+            return
+        async with self._updated:
+            await self._updated.wait_for(
+                lambda: self._failing or all(self._attempted.get(rid, 0.0) >= started for rid in stale)
+            )
+
+    # ---- 轮询 ----
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                while True:
+                    batch = self._next_batch()
+                    if not batch:
+                        break
+                    if not await self._query(batch):
+                        # 接口出错时不要按速率上限连续重试
+                        await asyncio.sleep(min(self.interval, 10.0))
+                # 最早过期的房间到期前醒来；有新房间加入时提前醒来
+                next_due = min((info["checked_at"] + self.interval
+                                for rid, info in self._rooms.items() if rid in self._tracked),
+                               default=time.time() + self.interval)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(1.0, next_due - time.time()))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Live status poller error")
+                await asyncio.sleep(self.interval)
+
+    def _next_batch(self) -> List[int]:
+        """refresh 要求的房间优先，其次是从没查过的，最后是过期的"""
+        self._expire_leases()
+        now = time.time()
+        batch = list(self._force)[:self.batch_size]
+        for rid in batch:
+            del self._force[rid]
+        if len(batch) < self.batch_size:
+            chosen = set(batch)
+            unknown = [rid for rid in self._tracked if rid not in self._rooms and rid not in chosen]
+            expired = [rid for rid in self._tracked if rid in self._rooms and rid not in chosen
+                       and now - self._rooms[rid]["checked_at"] >= self.interval]
+            batch += (unknown + expired)[:self.batch_size - len(batch)]
+        return batch
+
+    async def _query(self, batch: List[int]) -> bool:
+        async with self._request_lock:
+            wait = self._last_request + self.min_request_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_request = time.monotonic()
+            params = [("req_biz", "web_room_componet")] + [("room_ids", str(rid)) for rid in batch]
+            self.requests += 1
+            try:
+                async with self._get_session().get(self.url, params=params) as resp:
+                    resp.raise_for_status()
+                    data = await resp.json(content_type=None)
+                if data.get("code") != 0:
+                    raise RuntimeError(f"code={data.get('code')} {data.get('message')}")
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Live status query failed for {len(batch)} rooms: {e}")
+                await self._finish(batch, ok=False)
+                return False
+        by_room = (data.get("data") or {}).get("by_room_ids") or {}
+        now = time.time()
+        for rid in batch:
+            if rid not in self._tracked:
+                continue  # 查询期间被取消跟踪
+            info = by_room.get(str(rid))
+            if info is None:
+                # 接口没返回的房间（不存在、被封禁或临时缺失）状态未知，不当作未开播
+                self._rooms[rid] = {"live": None, "title": None, "online": 0, "checked_at": now}
+                continue
+            self._rooms[rid] = {
+                "live": info.get("live_status") == 1,
+                "title": info.get("title"),
+                "online": int(info.get("online") or 0),
+                "checked_at": now,
+            }
+        await self._finish(batch, ok=True)
+        return True
+
+    async def _finish(self, batch: List[int], ok: bool) -> None:
+        now = time.time()
+        for rid in batch:
+            if rid in self._tracked:
+                self._attempted[rid] = now
+        self._failing = not ok
+        async with self._updated:
+            self._updated.notify_all()
@@ -0,0 +1,10 @@
+import os
+from pathlib import Path
+
+
+def data_dir() -> Path:
+    """本地数据目录（缓存、归档等），可用 MULTIPLELIVE_DATA_DIR 覆盖，默认 ~/.multiplelive"""
+    custom = os.getenv("MULTIPLELIVE_DATA_DIR", "").strip()
+    path = Path(custom) if custom else Path.home() / ".multiplelive"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import mmap
+import struct
+import threading
+import time
+import unicodedata
+from array import array
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from services.archive import DanmakuArchive, Segment
+from services.danmaku_codec import decode_header, decode_item
+from services.items import DanmakuItem
+
+logger = logging.getLogger('multiplelive')
+
+# 倒排索引文件（.fts）：
+#   头部    8s magic + u32 词项数 + u32 保留
+#   目录    每个词项一项 u32 词起始 + u32 词长 + u32 倒排起始 + u32 倒排条数，按词的 UTF-8 字节序排列
+#   数据区  各词（UTF-8）与倒排（u32 记录偏移，升序，4 字节对齐）
+# 查询时只映射文件，在目录上二分查找用到的词，不在启动时解析全部词项
+_MAGIC = b"MLFTS\x00\x00\x02"
+_HEADER = struct.Struct("<8sII")
+_ENTRY = struct.Struct("<IIII")
+_POSTING_ITEM = "I"
+
+
+def normalize(text: str) -> str:
+    """全角转半角、大小写折叠，去掉空白"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return "".join(text.split())
+
+
+def tokenize(text: str) -> Set[str]:
+    """字符 n-gram：单字 + 相邻两字，中文无需分词也能做任意子串匹配"""
+    text = normalize(text)
+    terms = set(text)
+    terms.update(text[i:i + 2] for i in range(len(text) - 1))
+    return terms
+
+
+def query_terms(text: str) -> List[str]:
+    """查询串对应的词项：两字以上只用二元组即可覆盖"""
+    text = normalize(text)
+    if len(text) <= 1:
+        return [text] if text else []
+    return list({text[i:i + 2] for i in range(len(text) - 1)})
+
+
+class SegmentIndex:
+    """一个已封存分段的倒排索引：只读映射 .fts 文件，按需查找词项、解码倒排列表"""
+
+    def __init__(self, path: Path) -> None:
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < _HEADER.size or self._mm[:len(_MAGIC)] != _MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path.name} is not a search index of the current version")
+        _, self.count, _ = _HEADER.unpack_from(self._mm, 0)
+        self.size = len(self._mm)
+
+    def _find(self, term: str) -> Tuple[int, int]:
+        """返回 (倒排起始字节, 条数)，没有该词时条数为 0"""
+        key = term.encode("utf-8")
+        mm = self._mm
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            term_off, term_len, start, n = _ENTRY.unpack_from(mm, _HEADER.size + mid * _ENTRY.size)
+            probe = mm[term_off:term_off + term_len]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return start, n
+        return 0, 0
+
+    def postings(self, term: str) -> array:
+        start, n = self._find(term)
+        out = array(_POSTING_ITEM)
+        if n:
+            out.frombytes(self._mm[start: start + n * 4])
+        return out
+
+    def close(self) -> None:
+        self._mm.close()
+
+    @staticmethod
+    def build(buf: memoryview) -> bytes:
+        index: Dict[str, array] = defaultdict(lambda: array(_POSTING_ITEM))
+        offset, size = 0, len(buf)
+        while offset < size:
+            item, next_offset = decode_item(buf, offset)
+            for term in tokenize(item.msg):
+                index[term].append(offset)
+            offset = next_offset
+        terms = sorted((term.encode("utf-8"), postings) for term, postings in index.items())
+        directory = bytearray()
+        data = bytearray()
+        base = _HEADER.size + len(terms) * _ENTRY.size
+        for encoded, postings in terms:
+            term_off = base + len(data)
+            data += encoded
+            data += b"\0" * (-len(data) % 4)
+            directory += _ENTRY.pack(term_off, len(encoded), base + len(data), len(postings))
+            data += postings.tobytes()
+        return _HEADER.pack(_MAGIC, len(terms), 0) + bytes(directory) + bytes(data)
+
+
+class ArchiveSearch:
+    """
+    归档弹幕的全文检索：分段封存后在后台线程为其建立字符 n-gram 倒排索引（落盘为 .fts），
+    查询时先求倒排交集得到候选记录，再解码候选做子串与房间/时间/用户过滤；
+    还没封存的活动分段直接顺序扫描。
+    """
+
+    def __init__(self, archive: DanmakuArchive) -> None:
+        self.archive = archive
+        self._indexes: Dict[int, SegmentIndex] = {}
+        self._lock = threading.Lock()
+        self._indexer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive-indexer")
+        self.last_query_ms: Optional[float] = None
+        self.total_queries = 0
+
+    @staticmethod
+    def _index_path(seg: Segment) -> Path:
+        return seg.data_path.with_suffix(".fts")
+
+    def start(self) -> None:
+        """注册封存/清理回调，并为已封存但没有索引的分段补建索引"""
+        self.archive.on_seal.append(lambda seg: self._indexer.submit(self._index_segment, seg))
+        self.archive.on_prune.append(self._drop_segment)
+        for seg in self.archive.segments():
+            if seg.sealed:
+                self._indexer.submit(self._index_segment, seg)
+
+    def close(self) -> None:
+        self._indexer.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            indexes, self._indexes = list(self._indexes.values()), {}
+        for index in indexes:
+            index.close()
+
+    def _index_segment(self, seg: Segment) -> None:
+        path = self._index_path(seg)
+        try:
+            try:
+                index = SegmentIndex(path)
+            except (OSError, ValueError):
+                # 没有索引、索引为旧格式或已损坏时重建
+                buf = seg.view()
+                if buf is None:
+                    return
+                begin = time.perf_counter()
+                try:
+                    raw = SegmentIndex.build(buf)
+                finally:
+                    buf.release()
+                tmp = path.with_suffix(".fts.tmp")
+                tmp.write_bytes(raw)
+                tmp.replace(path)
+                logger.info(f"Indexed archive segment {seg.seg_id}: {seg.records} records, "
+                            f"{len(raw) / 1024:.0f} KiB in {time.perf_counter() - begin:.2f}s")
+                index = SegmentIndex(path)
+        except Exception:
+            logger.exception(f"Failed to index archive segment {seg.seg_id}")
+            return
+        with self._lock:
+            self._indexes[seg.seg_id] = index
+
+    def _drop_segment(self, seg: Segment) -> None:
+        # 不主动关闭映射：可能还有查询在读，最后一个引用释放时随对象关闭
+        with self._lock:
+            self._indexes.pop(seg.seg_id, None)
+
+    # ---- 查询 ----
+
+    def search(self, text: str, room_id: Optional[int] = None, uname: Optional[str] = None,
+               start_ts: int = 0, end_ts: Optional[int] = None, limit: int = 100) -> List[DanmakuItem]:
+        """同步查询（在线程池调用），从最新的分段往前找，结果按时间正序"""
+        begin = time.perf_counter()
+        needle = normalize(text)
+        terms = query_terms(text)
+        if end_ts is None:
+            end_ts = int(time.time() * 1000)
+        out: List[DanmakuItem] = []
+        for seg in reversed(self.archive.segments()):
+            if len(out) >= limit:
+                break
+            if seg.max_ts is None or seg.max_ts < start_ts or seg.min_ts > end_ts:
+                continue
+            with self._lock:
+                index = self._indexes.get(seg.seg_id)
+            candidates = self._candidates(index, terms) if index is not None and terms else None
+            found = self._verify(seg, candidates, needle, room_id, uname, start_ts, end_ts)
+            out.extend(found[-(limit - len(out)):])
+        out.sort(key=lambda item: (item.ts_ms, item.seq))
+        self.last_query_ms = (time.perf_counter() - begin) * 1000
+        self.total_queries += 1
+        return out
+
+    @staticmethod
+    def _candidates(index: SegmentIndex, terms: Iterable[str]) -> List[int]:
+        postings = sorted((index.postings(t) for t in terms), key=len)
+        if not postings or not postings[0]:
+            return []
+        result = set(postings[0])
+        for p in postings[1:]:
+            result.intersection_update(p)
+            if not result:
+                break
+        return sorted(result)
+
+    @staticmethod
+    def _verify(seg: Segment, candidates: Optional[List[int]], needle: str, room_id: Optional[int],
+                uname: Optional[str], start_ts: int, end_ts: int) -> List[DanmakuItem]:
+        """候选为 None 表示没有索引，顺序扫描整个分段"""
+        out: List[DanmakuItem] = []
+        if candidates is not None and not candidates:
+            return out
+        buf = seg.view()
+        if buf is None:
+            return out
+        try:
+            offsets: Iterable[int] = candidates if candidates is not None else _walk(buf)
+            for offset in offsets:
+                _, _, ts_ms, rid, *_ = decode_header(buf, offset)
+                if not start_ts <= ts_ms <= end_ts or (room_id is not None and rid != room_id):
+                    continue
+                item, _ = decode_item(buf, offset)
+                if uname is not None and item.uname != uname:
+                    continue
+                if needle in normalize(item.msg):
+                    out.append(item)
+        finally:
+            buf.release()
+        return out
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {
+            "indexed_segments": len(indexes),
+            "segments": len(self.archive.segments()),
+            "index_bytes": sum(i.size for i in indexes),
+            "terms": sum(i.count for i in indexes),
+            "last_query_ms": None if self.last_query_ms is None else round(self.last_query_ms, 2),
+            "queries": self.total_queries,
+        }
+
+    async def async_search(self, text: str, room_id: Optional[int] = None, uname: Optional[str] = None,
+                           start_ts: int = 0, end_ts: Optional[int] = None,
+                           limit: int = 100) -> List[DanmakuItem]:
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.search, text, room_id, uname, start_ts, end_ts, limit
+        )
+
+
+def _walk(buf: memoryview) -> Iterable[int]:
+    offset, size = 0, len(buf)
+    while offset < size:
+        (length,) = struct.unpack_from("<I", buf, offset)
+        yield offset
+        offset += length
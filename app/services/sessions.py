@@ -0,0 +1,207 @@
+import asyncio
+import itertools
+import json
+import logging
+import random
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from services.items import DanmakuItem, EventItem
+from services.viewer import ReplayWindow, Viewer
+
+logger = logging.getLogger('multiplelive')
+
+
+class Session:
+    """
+    一个前端会话（/api/danmaku/start 返回的 token）：自己的房间集合、颜色、WebSocket 连接与补发窗口。
+    推送给会话的消息除全局的 seq（与 /api/danmaku/history 同一序号）外另带会话内连续的 sseq，
+    断线重连按 sseq 只补发本会话的房间。
+    """
+
+    def __init__(self, token: str, rooms: Iterable[int], colors: Dict[int, str]) -> None:
+        self.token = token
+        self.rooms: Set[int] = set(rooms)
+        self.colors: Dict[int, str] = {}
+        self._color_json: Dict[int, str] = {}
+        self.set_colors(colors)
+        self.viewers: List[Viewer] = []
+        self.stats_viewers: List[Viewer] = []
+        self.replay = ReplayWindow(capacity=2000, max_bytes=1024 * 1024)
+        self._seq = itertools.count(1)
+        self.created_at = time.time()
+        self.idle_since: Optional[float] = time.monotonic()  # 没有连接的起始时间，有连接时为 None
+        self.delivered = 0
+        # 单条进房/关注事件的抽样比例；采集端按所有会话中最大的比例抽样，各会话在分发时再按自己的比例筛
+        self.interact_sample = 0.0
+
+    def set_colors(self, colors: Dict[int, str]) -> None:
+        self.colors = dict(colors)
+        self._color_json = {rid: json.dumps(color) for rid, color in self.colors.items()}
+
+    def accepts(self, item: DanmakuItem, sampled_at: float) -> bool:
+        """采集端按 sampled_at 抽中的单条互动事件，本会话以 interact_sample / sampled_at 的概率保留"""
+        if sampled_at <= self.interact_sample or not isinstance(item, EventItem) or item.type != "interact":
+            return True
+        return random.random() * sampled_at < self.interact_sample
+
+    def deliver(self, item: DanmakuItem, body: str) -> None:
+        """
+        body 为去掉 color 后序列化的消息、且去掉了结尾的 "}"，每条消息只序列化一次，
+        各会话只拼接自己的颜色与会话内序号
+        """
+        sseq = next(self._seq)
+        color = self._color_json.get(item.room_id) or json.dumps(item.color)
+        msg = f'{body}, "color": {color}, "sseq": {sseq}}}'
+        self.replay.append(sseq, msg)
+        self.delivered += 1
+        # 只入各连接的发送队列，慢客户端不阻塞广播
+        for viewer in list(self.viewers):
+            if not viewer.push(msg) and viewer in self.viewers:
+                self.viewers.remove(viewer)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rooms": sorted(self.rooms),
+            "viewers": len(self.viewers),
+            "delivered": self.delivered,
+            "interact_sample": self.interact_sample,
+            "created_at": self.created_at,
+        }
+
+
+def encode_body(item: DanmakuItem) -> str:
+    """Session.deliver 使用的消息主体，保留全局 seq"""
+    fields = dict(item.__dict__)
+    del fields["color"]
+    return json.dumps(fields, ensure_ascii=False)[:-1]
+
+
+class SessionLimitError(Exception):
+    """会话数已达上限且每个会话都有连接，无法腾出位置"""
+
+
+class SessionManager:
+    """
+    会话表，并维护 房间 -> 会话 的索引供广播查找。房间连接的引用计数由采集端负责，
+    这里只计算每次变更后各会话增减了哪些房间。
+
+    会话没有任何 WebSocket 连接超过 idle_timeout 秒（浏览器窗口关闭后不会调用停止）时过期，
+    调用 on_expire 释放它的房间。
+
+    :param idle_timeout: 无连接多久后过期（秒）
+    :param max_sessions: 会话数上限，达到上限时先让最久没有连接的会话过期；所有会话都有连接时 create 抛出 SessionLimitError
+    """
+
+    def __init__(self, idle_timeout: float = 600.0, max_sessions: int = 64) -> None:
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.on_expire: Optional[Callable[[Session], Awaitable[None]]] = None
+        self._sessions: Dict[str, Session] = {}
+        self._by_room: Dict[int, List[Session]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def get(self, token: Optional[str]) -> Optional[Session]:
+        return self._sessions.get(token) if token else None
+
+    def for_room(self, room_id: int) -> List[Session]:
+        return self._by_room.get(room_id, [])
+
+    def create(self, rooms: Iterable[int], colors: Dict[int, str]) -> Session:
+        if len(self._sessions) >= self.max_sessions:
+            idle = [s for s in self._sessions.values() if s.idle_since is not None]
+            if not idle:
+                raise SessionLimitError(f"too many active sessions (max {self.max_sessions})")
+            self._expire(min(idle, key=lambda s: s.idle_since).token)
+        session = Session(secrets.token_urlsafe(12), (), colors)
+        self._sessions[session.token] = session
+        self.update(session, rooms, colors)
+        self._schedule_expiry(session)
+        return session
+
+    def update(self, session: Session, rooms: Iterable[int], colors: Dict[int, str]) -> Tuple[List[int], List[int]]:
+        """替换会话的房间与颜色，返回 (新增的房间, 移除的房间)"""
+        rooms = set(rooms)
+        added = [rid for rid in rooms if rid not in session.rooms]
+        removed = [rid for rid in session.rooms if rid not in rooms]
+        for rid in added:
+            self._by_room.setdefault(rid, []).append(session)
+        for rid in removed:
+            self._unindex(rid, session)
+        session.rooms = rooms
+        session.set_colors(colors)
+        return added, removed
+
+    def remove(self, token: str) -> Optional[Session]:
+        """移除会话并断开它的所有前端连接；调用方负责释放它的房间"""
+        session = self._sessions.pop(token, None)
+        if session is None:
+            return None
+        timer = self._timers.pop(token, None)
+        if timer is not None:
+            timer.cancel()
+        for rid in session.rooms:
+            self._unindex(rid, session)
+        for viewer in session.viewers + session.stats_viewers:
+            viewer.close()
+        session.viewers.clear()
+        session.stats_viewers.clear()
+        return session
+
+    def _unindex(self, room_id: int, session: Session) -> None:
+        sessions = self._by_room.get(room_id)
+        if sessions and session in sessions:
+            sessions.remove(session)
+            if not sessions:
+                del self._by_room[room_id]
+
+    # ---- 连接与过期 ----
+
+    def attach(self, session: Session, viewer: Viewer) -> None:
+        session.viewers.append(viewer)
+        session.idle_since = None
+        timer = self._timers.pop(session.token, None)
+        if timer is not None:
+            timer.cancel()
+
+    def detach(self, session: Session, viewer: Viewer) -> None:
+        if viewer in session.viewers:
+            session.viewers.remove(viewer)
+        if not session.viewers and session.token in self._sessions and session.idle_since is None:
+            session.idle_since = time.monotonic()
+            self._schedule_expiry(session)
+
+    def _schedule_expiry(self, session: Session) -> None:
+        timer = self._timers.pop(session.token, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[session.token] = asyncio.get_running_loop().call_later(
+            self.idle_timeout, self._expire, session.token)
+
+    def _expire(self, token: str) -> None:
+        self._timers.pop(token, None)
+        session = self._sessions.get(token)
+        if session is None or session.viewers:
+            return
+        logger.info(f"Session {token} idle, released rooms={sorted(session.rooms)}")
+        if self.on_expire is not None:
+            asyncio.ensure_future(self.on_expire(session))
+        else:
+            self.remove(token)
+
+    def close(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for token in list(self._sessions):
+            self.remove(token)
+
+    def stats(self) -> Dict[str, Any]:
+        return {token: session.stats() for token, session in self._sessions.items()}
@@ -0,0 +1,319 @@
+"""
+共享内存环形缓冲：把弹幕写进固定大小的内存映射文件，同机的其他进程（OBS 覆盖层、分析脚本等）
+直接映射同一个文件读取，不经过 WebSocket 与 JSON。只有一个写者，读者数量不限，各自维护游标，
+写者从不等待读者：读得慢的读者被覆盖后跳到最旧的有效记录继续，并记一次溢出。
+
+文件布局（小端，只支持小端平台）：
+
+    偏移  类型   字段
+    0     8s     magic，b"MLDMRING"
+    8     u32    版本，当前为 1
+    12    u32    头部长度，即数据区的起始偏移（64）
+    16    u64    数据区容量（字节，8 的倍数）
+    24    u64    epoch，写者每次初始化文件时随机生成；读者发现变化时从头读起
+    32    u64    tail，最旧的有效记录的绝对位置
+    40    u64    head，下一条记录的绝对位置（记录写完后才推进）
+    48    u64    已写入的记录数
+    56    8      保留
+
+绝对位置只增不减，对容量取模得到数据区内的偏移。数据区里依次是 danmaku_codec 的记录
+（第一个字段 u32 为记录长度），每条按 8 字节对齐；数据区尾部放不下下一条记录时写一个 u32 的 0
+作为回绕标记，下一条从数据区开头写起。
+
+写者覆盖旧数据前先推进 tail 再写数据，写完后推进 head。读者读 [游标, head) 之间的记录，
+用完后再读一次 tail：tail 已超过某条记录的起点，说明读的过程中它被覆盖了，应当丢弃。
+记录格式只容纳普通弹幕，与归档相同。
+
+写者启动时在同目录建一个新文件，初始化好后用 os.replace 换到原路径，从不截断已有文件：
+已映射旧文件的读者仍持有旧 inode，不会因为映射区域被截掉而收到 SIGBUS。读者追上旧文件的 head 后
+定期比较路径当前的 inode，发现换了新文件时先读完旧文件剩余的记录，再映射新文件从头读起。
+"""
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from services.danmaku_codec import RECORD_HEADER, decode_item, encode_item
+from services.items import DanmakuItem
+
+logger = logging.getLogger('multiplelive')
+
+MAGIC = b"MLDMRING"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQQQ8x")
+HEADER_SIZE = HEADER.size  # 64
+_U32 = struct.Struct("<I")
+# 头部按 u64 下标访问。tail/head 要被其他进程原子地看到，用 memoryview 的原生 u64 读写（一次 8 字节对齐访问），
+# struct 的 "<Q" 是逐字节读写的，读者可能看到写了一半的值
+_EPOCH = 3
+_TAIL = 4
+_HEAD = 5
+_RECORDS = 6
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def default_path() -> Path:
+    """优先放在 /dev/shm（纯内存），没有时放数据目录"""
+    shm = Path("/dev/shm")
+    if shm.is_dir():
+        return shm / "multiplelive-danmaku.ring"
+    from services.paths import data_dir
+    return data_dir() / "danmaku.ring"
+
+
+class ShmRingWriter:
+    """
+    环形缓冲的写者，在事件循环里同步调用 append：只有一次编码和一次内存拷贝，不做系统调用，不等待读者。
+
+    :param path: 映射文件路径，已存在时用新文件替换（不改动旧文件，已打开的读者不受影响）
+    :param capacity: 数据区容量（字节），向上取整到 8 的倍数
+    """
+
+    def __init__(self, path: Path, capacity: int = 16 * 1024 * 1024) -> None:
+        if sys.byteorder != "little":
+            raise RuntimeError("shared-memory ring buffer requires a little-endian platform")
+        self.path = Path(path)
+        self.capacity = _align(max(capacity, 4096))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        self._file = open(tmp, "w+b")
+        try:
+            self._file.truncate(HEADER_SIZE + self.capacity)
+            self._mm = mmap.mmap(self._file.fileno(), HEADER_SIZE + self.capacity)
+        except BaseException:
+            self._file.close()
+            tmp.unlink()
+            raise
+        self._header = memoryview(self._mm)[:HEADER_SIZE].cast("Q")
+        self._starts: Deque[int] = deque()  # 数据区内各有效记录的绝对位置，推进 tail 用
+        self._head = 0
+        self._tail = 0
+        self.records = 0
+        self.bytes = 0
+        self.oversized = 0
+        self.epoch = int.from_bytes(os.urandom(8), "little") >> 1
+        # magic 最后写，读者不会看到初始化了一半的头部
+        HEADER.pack_into(self._mm, 0, b"\0" * 8, VERSION, HEADER_SIZE, self.capacity, self.epoch, 0, 0, 0)
+        self._mm[0:8] = MAGIC
+        # 初始化完成后再换到原路径，新打开的读者看到的总是完整的文件
+        os.replace(tmp, self.path)
+
+    def append(self, item: DanmakuItem) -> None:
+        self.append_record(encode_item(item))
+
+    def append_record(self, record: bytes) -> None:
+        n = len(record)
+        size = _align(n)
+        if size > self.capacity // 2:
+            self.oversized += 1
+            return
+        cap = self.capacity
+        head = self._head
+        off = head % cap
+        start = head if cap - off >= size else head + (cap - off)
+        end = start + size
+        # 这次要写的区间会覆盖绝对位置 end - cap 之前的旧记录，先让它们失效
+        limit = end - cap
+        starts = self._starts
+        while starts and starts[0] < limit:
+            starts.popleft()
+        tail = starts[0] if starts else start
+        if tail != self._tail:
+            self._tail = tail
+            self._header[_TAIL] = tail
+        if start != head:
+            _U32.pack_into(self._mm, HEADER_SIZE + off, 0)
+        pos = HEADER_SIZE + start % cap
+        self._mm[pos:pos + n] = record
+        starts.append(start)
+        self._head = end
+        self.records += 1
+        self.bytes += n
+        self._header[_RECORDS] = self.records
+        self._header[_HEAD] = end
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "path": str(self.path),
+            "capacity": self.capacity,
+            "records": self.records,
+            "bytes": self.bytes,
+            "buffered_records": len(self._starts),
+            "oversized": self.oversized,
+        }
+
+    def close(self) -> None:
+        """文件保留，已打开的读者仍可读完剩余记录"""
+        if not self._mm.closed:
+            self._header.release()
+            self._mm.flush()
+            self._mm.close()
+        self._file.close()
+
+
+class ShmRingReader:
+    """
+    环形缓冲的读者，可在任意进程中使用，只读映射同一个文件，互不影响。
+
+    poll 返回的是映射上的 memoryview（不拷贝），在写者再写满一圈之前有效；
+    处理完可调用 overwritten() 确认这批记录在使用期间没有被覆盖。需要独立的对象时用 read_items。
+
+    :param path: 映射文件路径
+    :param from_oldest: True 从缓冲中最旧的记录读起，默认只读打开之后的新记录
+    :param reopen_interval: 追上写者后每隔多少秒检查一次文件是否被新的写者替换
+    """
+
+    def __init__(self, path: Path, from_oldest: bool = False, reopen_interval: float = 0.5) -> None:
+        self.path = Path(path)
+        self.reopen_interval = reopen_interval
+        tail, head = self._open()
+        self.cursor = tail if from_oldest else head
+        self._batch_starts: List[int] = []
+        self.overruns = 0  # 被写者追上的次数
+        self.lost_bytes = 0  # 因此跳过的数据量
+        self.reopens = 0  # 换到新写者文件的次数
+
+    def _open(self) -> Tuple[int, int]:
+        file = open(self.path, "rb")
+        try:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            file.close()
+            raise
+        magic, version, header_size, capacity, epoch, tail, head, _ = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            mm.close()
+            file.close()
+            raise ValueError(f"{self.path} is not a danmaku ring buffer (version {VERSION})")
+        self._file, self._mm = file, mm
+        self._inode = os.fstat(file.fileno()).st_ino
+        self._next_check = time.monotonic() + self.reopen_interval
+        self.capacity = capacity
+        self._header = memoryview(mm)[:HEADER_SIZE].cast("Q")
+        self._data = memoryview(mm)[header_size:header_size + capacity]
+        self._epoch = epoch
+        return tail, head
+
+    def _replaced(self) -> bool:
+        """路径上已经是新写者的文件（按 inode 判断）；系统调用按 reopen_interval 限频"""
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.reopen_interval
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except OSError:
+            return False
+
+    def _reopen(self) -> None:
+        old_file, old_mm, old_header, old_data = self._file, self._mm, self._header, self._data
+        try:
+            self._open()
+        except (OSError, ValueError):
+            # 新写者的文件还没准备好，下次再试
+            return
+        old_header.release()
+        old_data.release()
+        try:
+            old_mm.close()
+        except BufferError:
+            # 调用方还持有旧文件上 poll 出来的 memoryview，映射在它们释放后随对象回收
+            pass
+        old_file.close()
+        self.cursor = 0
+        self._batch_starts = []
+        self.reopens += 1
+
+    def _sync(self) -> None:
+        if self._header[_HEAD] <= self.cursor and self._replaced():
+            # 旧文件已读完且写者换了新文件，换过去从头读
+            self._reopen()
+        epoch = self._header[_EPOCH]
+        if epoch != self._epoch:
+            # 写者重新初始化了文件（采集重启等），从头读起
+            self._epoch = epoch
+            self.cursor = 0
+        tail = self._header[_TAIL]
+        if self.cursor < tail:
+            self.overruns += 1
+            self.lost_bytes += tail - self.cursor
+            self.cursor = tail
+
+    def pending(self) -> int:
+        """还没读的字节数（含对齐与回绕），0 表示已追上写者"""
+        self._sync()
+        return max(self._header[_HEAD] - self.cursor, 0)
+
+    def poll(self, max_records: int = 1024) -> List[memoryview]:
+        self._sync()
+        head = self._header[_HEAD]
+        cap = self.capacity
+        data = self._data
+        views: List[memoryview] = []
+        starts = self._batch_starts = []
+        cursor = self.cursor
+        while cursor < head and len(views) < max_records:
+            off = cursor % cap
+            length = _U32.unpack_from(data, off)[0]
+            if length == 0:
+                cursor += cap - off
+                continue
+            if length < RECORD_HEADER.size or off + length > cap:
+                # 读到了正在被覆盖的区域
+                break
+            views.append(data[off:off + length])
+            starts.append(cursor)
+            cursor += _align(length)
+        self.cursor = cursor
+        tail = self._header[_TAIL]
+        if tail > self.cursor or (starts and tail > starts[0]):
+            # 读的过程中被追上：后面记录的位置是按可能已被覆盖的长度推算的，整批丢弃，从 tail 重新定位
+            self.overruns += 1
+            self.lost_bytes += tail - (starts[0] if starts else self.cursor)
+            self.cursor = tail
+            self._batch_starts = []
+            return []
+        return views
+
+    def overwritten(self) -> int:
+        """上一次 poll 返回的记录中，此刻已被写者覆盖的条数；写者按顺序覆盖，失效的总是前面若干条"""
+        return bisect.bisect_left(self._batch_starts, self._header[_TAIL])
+
+    def read_items(self, max_records: int = 1024) -> List[DanmakuItem]:
+        """解码为独立的对象；解码期间被覆盖的记录会被丢弃"""
+        views = self.poll(max_records)
+        items = [decode_item(view)[0] for view in views]
+        lost = self.overwritten()
+        if lost:
+            del items[:lost]
+        return items
+
+    def wait(self, timeout: Optional[float] = None, interval: float = 0.005) -> bool:
+        """轮询等待新记录，有新记录时返回 True"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending() == 0:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def close(self) -> None:
+        """poll 返回的 memoryview 要先释放，否则映射无法关闭"""
+        for view in ("_header", "_data"):
+            if getattr(self, view, None) is not None:
+                getattr(self, view).release()
+                setattr(self, view, None)
+        try:
+            self._mm.close()
+        except BufferError:
+            logger.warning("Ring reader closed while record views are still in use")
+        self._file.close()
@@ -1,9 +1,9 @@
 import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Tuple
-
-import requests
+from urllib.parse import urljoin
 
 
 def get_room_id(url_or_id: str) -> int:
@@ -18,6 +18,7 @@ def get_room_id(url_or_id: str) -> int:
 
 def _http_get_json(url: str, headers: Optional[Dict[str, str]] = None, timeout: int = 15,
                    retries: int = 3, backoff: float = 0.6) -> Dict[str, Any]:
+    import requests  # 导入较慢，第一次解析直播流时才导入
     last_err: Optional[Exception] = None
     for i in range(retries):
         try:
@@ -72,6 +73,7 @@ def resolve_room_id(source: str, sessdata: Optional[str] = None) -> int:
 
 
 def _extract_candidates(api_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """每个 host/extra 组合（即每个 CDN 节点）各生成一个候选，同一路流的候选 base_url 相同"""
     candidates: List[Dict[str, Any]] = []
     try:
         streams = api_data["data"]["playurl_info"]["playurl"]["stream"]
@@ -88,18 +90,18 @@ def _extract_candidates(api_data: Dict[str, Any]) -> List[Dict[str, Any]]:
                 url_infos = codec.get("url_info", []) or []
                 if not base_url or not url_infos:
                     continue
-                ui0 = url_infos[0]
-                host = ui0.get("host") or ""
-                extra = ui0.get("extra") or ""
-                if not host:
-                    continue
-                full_url = f"{host}{base_url}{extra}"
-                candidates.append({
-                    "protocol": protocol_name,
-                    "format": format_name,
-                    "codec": codec_name,
-                    "url": full_url,
-                })
+                for ui in url_infos:
+                    host = ui.get("host") or ""
+                    extra = ui.get("extra") or ""
+                    if not host:
+                        continue
+                    candidates.append({
+                        "protocol": protocol_name,
+                        "format": format_name,
+                        "codec": codec_name,
+                        "host": host,
+                        "url": f"{host}{base_url}{extra}",
+                    })
     return candidates
 
 
@@ -144,18 +146,207 @@ def get_live_streams(room_id: int, qn: int = 25000, sessdata: Optional[str] = No
     return _extract_candidates(data)
 
 
-def pick_best_hls(room_id: int, sessdata: Optional[str] = None) -> str:
+def _rendition(c: Dict[str, Any]) -> Tuple[str, str, str]:
+    return (c.get("protocol") or "", c.get("format") or "", c.get("codec") or "")
+
+
+def probe_candidate(candidate: Dict[str, Any], headers: Dict[str, str], timeout: float = 4.0,
+                    sample_bytes: int = 256 * 1024) -> Dict[str, Any]:
+    """
+    测一个 CDN 节点：播放列表的首字节时间，以及第一个分片前 sample_bytes 字节的下载速度。
+    返回候选的副本，附加 ttfb_ms、throughput_kbps、score_ms（越小越好）或 error。
+    """
+    import requests  # 导入较慢，第一次解析直播流时才导入
+    result = dict(candidate)
+    try:
+        start = time.perf_counter()
+        with requests.get(candidate["url"], headers=headers, timeout=timeout, stream=True) as resp:
+            ttfb = time.perf_counter() - start  # stream=True 时收到响应头即返回
+            resp.raise_for_status()
+            text = resp.text
+        segment = next((line.strip() for line in text.splitlines()
+                        if line.strip() and not line.startswith("#")), None)
+        result["ttfb_ms"] = round(ttfb * 1000, 1)
+        if segment is None:
+            raise RuntimeError("empty playlist")
+        start = time.perf_counter()
+        received = 0
+        with requests.get(urljoin(candidate["url"], segment), headers=headers, timeout=timeout, stream=True) as resp:
+            resp.raise_for_status()
+            for chunk in resp.iter_content(64 * 1024):
+                received += len(chunk)
+                if received >= sample_bytes or time.perf_counter() - start > timeout:
+                    break
+        elapsed = max(time.perf_counter() - start, 1e-6)
+        result["throughput_kbps"] = round(received * 8 / 1000 / elapsed, 1)
+        # 播放器启动时要先拿播放列表再下满一个分片：按首字节时间加下载 1 MB 的时间估计
+        result["score_ms"] = round(result["ttfb_ms"] + 8000 * 1000 / max(result["throughput_kbps"], 1), 1)
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+    return result
+
+
+def probe_candidates(candidates: List[Dict[str, Any]], headers: Dict[str, str],
+                     timeout: float = 4.0, max_workers: int = 8) -> List[Dict[str, Any]]:
+    """并发探测，按 score_ms 从快到慢排序，探测失败的排在最后（保留原顺序）"""
+    if len(candidates) <= 1:
+        return [dict(c) for c in candidates]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(candidates))) as pool:
+        results = list(pool.map(lambda c: probe_candidate(c, headers, timeout), candidates))
+    return sorted(results, key=lambda r: (0, r["score_ms"]) if "score_ms" in r else (1, 0))
+
+
+_ATTR = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def analyze_playlist(text: str) -> Dict[str, Any]:
+    """从媒体播放列表中取出影响直播延迟的参数"""
+    info: Dict[str, Any] = {"target_duration": None, "part_target": None, "segments": 0, "avg_segment_s": None,
+                            "hold_back": None, "part_hold_back": None, "can_block_reload": False}
+    durations: List[float] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-TARGETDURATION:"):
+            info["target_duration"] = float(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            durations.append(float(line.split(":", 1)[1].split(",", 1)[0]))
+        elif line.startswith("#EXT-X-PART-INF:"):
+            attrs = dict(_ATTR.findall(line.split(":", 1)[1]))
+            if "PART-TARGET" in attrs:
+                info["part_target"] = float(attrs["PART-TARGET"])
+        elif line.startswith("#EXT-X-SERVER-CONTROL:"):
+            attrs = dict(_ATTR.findall(line.split(":", 1)[1]))
+            info["can_block_reload"] = attrs.get("CAN-BLOCK-RELOAD") == "YES"
+            for key, name in (("HOLD-BACK", "hold_back"), ("PART-HOLD-BACK", "part_hold_back")):
+                if key in attrs:
+                    info[name] = float(attrs[key])
+    info["segments"] = len(durations)
+    if durations:
+        info["avg_segment_s"] = round(sum(durations) / len(durations), 3)
+    return info
+
+
+def expected_latency(info: Dict[str, Any], ttfb_ms: float = 0.0) -> Tuple[float, List[str]]:
+    """
+    估计端到端延迟（秒）与依据：
+    播放器从直播边缘后退 HOLD-BACK（没有时按规范取 3 个目标时长）开始播放，分片要完整生成后才出现在列表里，
+    再加上一次播放列表请求的首字节时间。支持 LL-HLS 分段（part）时按 PART-HOLD-BACK 计算。
+    """
+    reasons: List[str] = []
+    seg = info.get("avg_segment_s") or info.get("target_duration") or 0.0
+    part = info.get("part_target")
+    if part:
+        hold = info.get("part_hold_back") or 3 * part
+        latency = hold + part
+        reasons.append(f"支持 LL-HLS 分段（PART-TARGET {part:g}s），后退 {hold:g}s")
+    else:
+        if info.get("hold_back"):
+            hold = info["hold_back"]
+            reasons.append(f"HOLD-BACK {hold:g}s")
+        else:
+            hold = 3 * seg
+            reasons.append(f"分片平均 {seg:g}s，按 3 个分片后退 {hold:g}s")
+        window = info.get("segments") or 0
+        if window and window * seg < hold:
+            # 列表里的分片不够后退 3 个，播放器只能从列表开头起播
+            hold = window * seg
+            reasons.append(f"列表仅 {window} 个分片，实际最多后退 {hold:g}s（容易卡顿）")
+        latency = hold + seg
+    if ttfb_ms:
+        latency += ttfb_ms / 1000
+        reasons.append(f"播放列表首字节 {ttfb_ms:.0f} ms")
+    return round(latency, 2), reasons
+
+
+def _fetch_playlist(url: str, headers: Dict[str, str], timeout: float = 4.0) -> Tuple[str, float]:
+    import requests  # 导入较慢，第一次解析直播流时才导入
+    start = time.perf_counter()
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+        ttfb_ms = (time.perf_counter() - start) * 1000
+        resp.raise_for_status()
+        return resp.text, ttfb_ms
+
+
+def _select_low_latency(candidates: List[Dict[str, Any]], headers: Dict[str, str]
+                        ) -> Tuple[Optional[Dict[str, Any]], Dict[str, Any]]:
+    """
+    在同一编码（按原有偏好取最优，避免选到浏览器解不了的 HEVC）的各个 HLS 封装中，
+    取播放列表估计延迟最低的一路。返回选中的候选与选择依据。
+    """
+    hls = [c for c in candidates if "http_hls" in (c.get("protocol") or "")]
+    preferred = _select_best(hls, prefer_protocol="http_hls")
+    if preferred is None:
+        return None, {"policy": "low_latency", "reasons": ["没有 HLS 候选"]}
+    renditions: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for c in hls:
+        if (c.get("codec") or "") == (preferred.get("codec") or ""):
+            renditions.setdefault(_rendition(c), c)
+
+    def measure(c: Dict[str, Any]) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {"format": c.get("format"), "codec": c.get("codec")}
+        try:
+            text, ttfb_ms = _fetch_playlist(c["url"], headers)
+            entry.update(analyze_playlist(text))
+            entry["latency_s"], entry["reasons"] = expected_latency(entry, ttfb_ms)
+        except Exception as e:
+            entry["error"] = str(e) or type(e).__name__
+        return entry
+
+    reps = list(renditions.values())
+    with ThreadPoolExecutor(max_workers=max(1, len(reps))) as pool:
+        measured = list(pool.map(measure, reps))
+    ranked = sorted(
+        (m for m in zip(reps, measured) if "latency_s" in m[1]),
+        key=lambda m: (m[1]["latency_s"], m[0] is not preferred),
+    )
+    selection: Dict[str, Any] = {"policy": "low_latency", "variants": measured}
+    if not ranked:
+        selection["reasons"] = ["所有播放列表都无法获取，按默认偏好选择"]
+        return preferred, selection
+    chosen, metrics = ranked[0]
+    selection["reasons"] = [f"{chosen.get('format')}/{chosen.get('codec')} 估计延迟 {metrics['latency_s']:g}s"] \
+        + metrics["reasons"]
+    for other, m in ranked[1:]:
+        selection["reasons"].append(f"{other.get('format')}/{other.get('codec')} 估计延迟 {m['latency_s']:g}s")
+    return chosen, selection
+
+
+def resolve_hls_candidates(room_id: int, sessdata: Optional[str] = None, audio_only: bool = False,
+                           probe: bool = True, policy: str = "default"
+                           ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    选出最合适的一路流（协议/封装/编码），返回它在各个 CDN 节点上的候选与选择依据：
+    probe 为 True 时并发探测并按速度排序，第一个为首选，其余为出错时依次切换的备用地址。
+    policy 为 "low_latency" 时读取各封装的播放列表，选估计延迟最低的一路；默认按固定偏好选择。
+    audio_only 用于只取声音的音源：各档清晰度的音轨相同，从最低画质开始尝试，
+    并优先 TS 封装，便于中继过滤掉视频包。
+    """
     prefer_qn = [25000, 20000, 10000, 8000, 400, 250, 150, 80]
+    if audio_only:
+        prefer_qn.reverse()
+    headers = _build_headers(room_id, sessdata)
     last_err: Optional[Exception] = None
     for qn in prefer_qn:
         try:
             candidates = get_live_streams(room_id, qn=qn, sessdata=sessdata)
-            best = _select_best(candidates, prefer_protocol="http_hls")
-            if best and best.get("url"):
-                return best["url"]
+            if policy == "low_latency":
+                best, selection = _select_low_latency(candidates, headers)
+            else:
+                best = _select_best(candidates, prefer_protocol="http_hls")
+                selection = {"policy": "default", "reasons": ["按固定偏好：http_hls > ts/fmp4/flv > avc/hevc/av1"]}
+            if not best or not best.get("url"):
+                continue
+            selection["qn"] = qn
+            hosts = [c for c in candidates if _rendition(c) == _rendition(best)]
+            if probe:
+                hosts = probe_candidates(hosts, headers)
+            return hosts, selection
         except Exception as e:
             last_err = e
             continue
     raise RuntimeError(f"未找到可用的直播流候选（最后错误: {last_err}）")
 
 
+def pick_best_hls(room_id: int, sessdata: Optional[str] = None, audio_only: bool = False) -> str:
+    """只要首选地址、不探测时使用"""
+    return resolve_hls_candidates(room_id, sessdata, audio_only, probe=False)[0][0]["url"]
@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+
+logger = logging.getLogger('multiplelive')
+
+_MEDIA_SEQUENCE = re.compile(r"#EXT-X-MEDIA-SEQUENCE:(\d+)")
+_TARGET_DURATION = re.compile(r"#EXT-X-TARGETDURATION:(\d+(?:\.\d+)?)")
+_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Referer": "https://live.bilibili.com/",
+}
+
+
+def watch_key(source: str, audio_only: bool, policy: str, relay: bool) -> str:
+    """同一来源、同样参数的解析共用一个看护，多个窗口重复解析时不会重复轮询"""
+    raw = f"{source}|{int(audio_only)}|{policy}|{int(relay)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+class StreamWatch:
+    """一个正在播放的地址：当前上游、备用节点与健康状态"""
+
+    def __init__(self, watch_id: str, spec: Dict[str, Any], url: str, fallbacks: List[str]) -> None:
+        self.watch_id = watch_id
+        self.spec = spec  # 重新解析所需的参数（source、sessdata、audio_only、policy、relay）
+        self.url = url
+        self.fallbacks = fallbacks
+        self.media_sequence: Optional[int] = None
+        self.sequence_changed_at = time.monotonic()
+        self.target_duration = 2.0
+        self.failures = 0
+        self.generation = 0  # 每次替换地址加一，前端据此判断是否需要切换
+        self.recovering = False
+        self.resolve_failures = 0
+        self.next_resolve_at = 0.0  # 重新解析连续失败（多半是下播了）时退避，避免频繁请求接口
+        self.last_error: Optional[str] = None
+        self.message: Optional[str] = None  # 最近一次替换推送给前端的消息，新连接的前端补发
+        self.task: Optional[asyncio.Task] = None
+
+
+class StreamWatchdog:
+    """
+    播放地址看护：每个地址一个轮询任务，只拉播放列表（不下载分片），
+    发现 HTTP 错误或媒体序号长时间不前进时先切备用 CDN 节点，备用都不可用再在线程池中重新解析，
+    新地址通过 notify 推送给前端。
+
+    :param resolve: 同步解析函数 spec -> (url, fallbacks)，在线程池中调用
+    :param notify: 地址替换后的回调，参数为 StreamWatch
+    :param has_viewers: 是否还有前端连接；持续 idle_timeout 秒没有连接时停止看护
+    :param on_idle: 最后一个看护因空闲停止、连接已关闭后的回调，参数为看护器本身
+    :param poll_interval: 播放列表轮询间隔（秒）
+    :param max_failures: 连续失败多少次判定为故障
+    """
+
+    def __init__(self, resolve: Callable[[Dict[str, Any]], Any],
+                 notify: Callable[[StreamWatch], None],
+                 has_viewers: Callable[[], bool] = lambda: True,
+                 poll_interval: float = 2.0, max_failures: int = 2, idle_timeout: float = 120.0,
+                 on_idle: Optional[Callable[["StreamWatchdog"], None]] = None) -> None:
+        self._resolve = resolve
+        self._notify = notify
+        self._has_viewers = has_viewers
+        self._on_idle = on_idle
+        self.poll_interval = poll_interval
+        self.max_failures = max_failures
+        self.idle_timeout = idle_timeout
+        self._watches: Dict[str, StreamWatch] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.recoveries = 0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=_HEADERS, timeout=aiohttp.ClientTimeout(total=max(self.poll_interval * 2, 4))
+            )
+        return self._session
+
+    def watch(self, watch_id: str, spec: Dict[str, Any], url: str, fallbacks: List[str]) -> StreamWatch:
+        """开始（或用新解析的结果刷新）看护一个地址"""
+        watch = self._watches.get(watch_id)
+        if watch is None:
+            watch = self._watches[watch_id] = StreamWatch(watch_id, spec, url, list(fallbacks))
+        else:
+            watch.spec, watch.url, watch.fallbacks = spec, url, list(fallbacks)
+            watch.media_sequence = None
+            watch.sequence_changed_at = time.monotonic()
+            watch.failures = 0
+        if watch.task is None:
+            watch.task = asyncio.create_task(self._run(watch))
+        return watch
+
+    def watches(self) -> List[StreamWatch]:
+        return list(self._watches.values())
+
+    async def close(self) -> None:
+        for watch in self._watches.values():
+            if watch.task is not None:
+                watch.task.cancel()
+        self._watches.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _idle(self) -> None:
+        """所有看护都空闲停止了：关闭连接并通知持有者，之后再 watch 会重新建立连接"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._on_idle is not None and not self._watches:
+            self._on_idle(self)
+
+    async def _run(self, watch: StreamWatch) -> None:
+        idle_since: Optional[float] = None
+        try:
+            while True:
+                # 失败后很快复查一次，尽早确认故障
+                await asyncio.sleep(self.poll_interval if not watch.failures else min(self.poll_interval, 0.5))
+                if self._has_viewers():
+                    idle_since = None
+                elif idle_since is None:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since > self.idle_timeout:
+                    logger.info(f"Stream watch {watch.watch_id} idle, stopped")
+                    if self._watches.get(watch.watch_id) is watch:
+                        del self._watches[watch.watch_id]
+                    if not self._watches:
+                        await self._idle()
+                    break
+                problem = await self._check(watch)
+                if problem is not None:
+                    await self._recover(watch, problem)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            watch.task = None
+
+    async def _check(self, watch: StreamWatch) -> Optional[str]:
+        """返回 None 表示健康，否则为故障原因"""
+        try:
+            text = await self._fetch(watch.url)
+        except Exception as e:
+            watch.failures += 1
+            watch.last_error = str(e) or type(e).__name__
+            return watch.last_error if watch.failures >= self.max_failures else None
+        watch.failures = 0
+        m = _TARGET_DURATION.search(text)
+        if m:
+            watch.target_duration = float(m.group(1))
+        m = _MEDIA_SEQUENCE.search(text)
+        now = time.monotonic()
+        if m is None:
+            return None
+        sequence = int(m.group(1))
+        if sequence != watch.media_sequence:
+            watch.media_sequence = sequence
+            watch.sequence_changed_at = now
+            return None
+        # 正常情况下每个目标时长前进一次，停了 3 个目标时长（至少 6 秒）判定为卡住
+        if now - watch.sequence_changed_at > max(3 * watch.target_duration, 6.0):
+            watch.last_error = f"media sequence stuck at {sequence}"
+            return watch.last_error
+        return None
+
+    async def _fetch(self, url: str) -> str:
+        async with self._get_session().get(url) as resp:
+            resp.raise_for_status()
+            return await resp.text()
+
+    async def _recover(self, watch: StreamWatch, problem: str) -> None:
+        watch.recovering = True
+        started = time.monotonic()
+        try:
+            logger.warning(f"Stream watch {watch.watch_id} unhealthy ({problem}), recovering")
+            # 先试同一路流的其他 CDN 节点，只需一次播放列表请求
+            while watch.fallbacks:
+                candidate = watch.fallbacks.pop(0)
+                try:
+                    await self._fetch(candidate)
+                except Exception:
+                    continue
+                self._replace(watch, candidate, watch.fallbacks, started, "fallback")
+                return
+            # 备用节点都不行（签名过期、推流重启换了地址等），重新解析
+            if time.monotonic() < watch.next_resolve_at:
+                return
+            try:
+                url, fallbacks = await asyncio.get_running_loop().run_in_executor(None, self._resolve, watch.spec)
+            except Exception as e:
+                watch.resolve_failures += 1
+                watch.next_resolve_at = time.monotonic() + min(60.0, 5.0 * 2 ** (watch.resolve_failures - 1))
+                watch.last_error = f"re-resolve failed: {e}"
+                logger.warning(f"Stream watch {watch.watch_id} {watch.last_error}")
+                return
+            watch.resolve_failures = 0
+            watch.next_resolve_at = 0.0
+            self._replace(watch, url, fallbacks, started, "re-resolve")
+        finally:
+            watch.recovering = False
+
+    def _replace(self, watch: StreamWatch, url: str, fallbacks: List[str], started: float, how: str) -> None:
+        watch.url = url
+        watch.fallbacks = list(fallbacks)
+        watch.media_sequence = None
+        watch.sequence_changed_at = time.monotonic()
+        watch.failures = 0
+        watch.generation += 1
+        self.recoveries += 1
+        logger.info(f"Stream watch {watch.watch_id} recovered by {how} in {time.monotonic() - started:.1f}s")
+        self._notify(watch)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "recoveries": self.recoveries,
+            "watches": {
+                w.watch_id: {
+                    "generation": w.generation,
+                    "media_sequence": w.media_sequence,
+                    "failures": w.failures,
+                    "fallbacks": len(w.fallbacks),
+                    "recovering": w.recovering,
+                    "last_error": w.last_error,
+                }
+                for w in self._watches.values()
+            },
+        }
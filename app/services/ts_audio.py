@@ -0,0 +1,218 @@
+"""
+MPEG-TS 音频过滤：只保留 PAT、改写后的 PMT 与音频 PID 的包，不做解复用。
+按 188 字节包处理，输入可以是任意切分的数据块，连续保留的包成批切片输出。
+"""
+from typing import Dict, List, Optional, Set
+
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+NULL_PID = 0x1FFF
+
+# PMT 中的音频 stream_type：MPEG-1/2 音频、AAC ADTS、AAC LATM、AC-3、E-AC-3、DTS
+AUDIO_STREAM_TYPES = frozenset((0x03, 0x04, 0x0F, 0x11, 0x81, 0x82, 0x87))
+# stream_type 0x06（PES 私有数据）时按描述符判断：AC-3、E-AC-3、DTS、AAC
+_AUDIO_DESCRIPTOR_TAGS = frozenset((0x6A, 0x7A, 0x7B, 0x7C))
+
+
+def _make_crc_table() -> List[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _make_crc_table()
+
+
+def crc32_mpeg2(data: bytes) -> int:
+    """PSI 表使用的 CRC-32/MPEG-2（不反转、初值全 1、无结尾异或），与 zlib.crc32 不同"""
+    crc = 0xFFFFFFFF
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[(crc >> 24) ^ b]
+    return crc
+
+
+def _is_audio(stream_type: int, descriptors: bytes) -> bool:
+    if stream_type in AUDIO_STREAM_TYPES:
+        return True
+    if stream_type != 0x06:
+        return False
+    pos = 0
+    while pos + 2 <= len(descriptors):
+        if descriptors[pos] in _AUDIO_DESCRIPTOR_TAGS:
+            return True
+        pos += 2 + descriptors[pos + 1]
+    return False
+
+
+class TsAudioFilter:
+    """
+    一个分片（或一条连续的 TS 流）对应一个实例。
+
+    PMT 只保留音频流条目，PCR_PID 不是音频 PID 时改为 0x1FFF（不携带 PCR，播放器按 PTS 同步），
+    重新计算 section_length 与 CRC32 后按原 PID 重新打包；音频包与 PAT 原样输出。
+    输入不是 TS（首字节不是 0x47，例如 fMP4 分片）时原样透传。
+    """
+
+    def __init__(self) -> None:
+        self._pmt_pids: Set[int] = set()
+        self._keep: Set[int] = {PAT_PID}
+        self._sections: Dict[int, bytearray] = {}  # 正在拼接的 PSI 段
+        self._cc: Dict[int, int] = {}  # 改写后 PMT 包的连续计数
+        self._rest = b""
+        self._passthrough: Optional[bool] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def audio_pids(self) -> Set[int]:
+        return self._keep - self._pmt_pids - {PAT_PID}
+
+    def feed(self, chunk: bytes) -> bytes:
+        self.bytes_in += len(chunk)
+        if self._passthrough is None and chunk:
+            self._passthrough = chunk[0] != SYNC_BYTE
+        if self._passthrough:
+            self.bytes_out += len(chunk)
+            return chunk
+        data = self._rest + chunk if self._rest else chunk
+        usable = len(data) - len(data) % PACKET_SIZE
+        self._rest = bytes(data[usable:])
+        out = self._filter(memoryview(data)[:usable])
+        self.bytes_out += len(out)
+        return out
+
+    def flush(self) -> bytes:
+        """结尾不足一个包的残片直接丢弃"""
+        self._rest = b""
+        return b""
+
+    def _filter(self, buf: memoryview) -> bytes:
+        out: List[bytes] = []
+        keep = self._keep
+        run_start = -1  # 当前连续保留区间的起点，整段一次切片
+        for pos in range(0, len(buf), PACKET_SIZE):
+            if buf[pos] != SYNC_BYTE:
+                # 失去同步：丢弃这个包，下个包边界继续
+                if run_start >= 0:
+                    out.append(bytes(buf[run_start:pos]))
+                    run_start = -1
+                continue
+            pid = ((buf[pos + 1] & 0x1F) << 8) | buf[pos + 2]
+            if pid in self._pmt_pids:
+                if run_start >= 0:
+                    out.append(bytes(buf[run_start:pos]))
+                    run_start = -1
+                out.extend(self._on_pmt_packet(pid, buf[pos:pos + PACKET_SIZE]))
+                keep = self._keep
+                continue
+            if pid in keep:
+                if pid == PAT_PID:
+                    self._on_pat_packet(buf[pos:pos + PACKET_SIZE])
+                if run_start < 0:
+                    run_start = pos
+            elif run_start >= 0:
+                out.append(bytes(buf[run_start:pos]))
+                run_start = -1
+        if run_start >= 0:
+            out.append(bytes(buf[run_start:]))
+        return b"".join(out)
+
+    # ---- PSI ----
+
+    @staticmethod
+    def _payload(packet: memoryview) -> memoryview:
+        afc = (packet[3] >> 4) & 0x3
+        if not afc & 0x1:
+            return packet[0:0]
+        start = 4
+        if afc & 0x2:
+            start += 1 + packet[4]
+        return packet[start:]
+
+    def _section(self, pid: int, packet: memoryview) -> Optional[bytes]:
+        """拼接 PSI 段，完整时返回 table_id 起的整段（含 CRC）"""
+        payload = self._payload(packet)
+        if not payload:
+            return None
+        if packet[1] & 0x40:  # payload_unit_start_indicator
+            pointer = payload[0]
+            self._sections[pid] = bytearray(payload[1 + pointer:])
+        elif pid in self._sections:
+            self._sections[pid] += payload
+        else:
+            return None
+        buf = self._sections[pid]
+        if len(buf) < 3:
+            return None
+        total = 3 + (((buf[1] & 0x0F) << 8) | buf[2])
+        if len(buf) < total:
+            return None
+        del self._sections[pid]
+        return bytes(buf[:total])
+
+    def _on_pat_packet(self, packet: memoryview) -> None:
+        section = self._section(PAT_PID, packet)
+        if section is None or section[0] != 0x00:
+            return
+        pmt_pids = set()
+        for pos in range(8, len(section) - 4, 4):
+            program_number = (section[pos] << 8) | section[pos + 1]
+            if program_number != 0:  # 0 为网络信息表
+                pmt_pids.add(((section[pos + 2] & 0x1F) << 8) | section[pos + 3])
+        self._pmt_pids = pmt_pids
+
+    def _on_pmt_packet(self, pid: int, packet: memoryview) -> List[bytes]:
+        section = self._section(pid, packet)
+        if section is None or section[0] != 0x02:
+            return []
+        rewritten, audio_pids = self._rewrite_pmt(section)
+        self._keep = {PAT_PID} | audio_pids
+        return self._packetize(pid, rewritten)
+
+    @staticmethod
+    def _rewrite_pmt(section: bytes):
+        pcr_pid = ((section[8] & 0x1F) << 8) | section[9]
+        program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+        pos = 12 + program_info_length
+        end = len(section) - 4
+        entries = []
+        audio_pids: Set[int] = set()
+        while pos + 5 <= end:
+            stream_type = section[pos]
+            es_pid = ((section[pos + 1] & 0x1F) << 8) | section[pos + 2]
+            es_info_length = ((section[pos + 3] & 0x0F) << 8) | section[pos + 4]
+            entry_end = pos + 5 + es_info_length
+            if _is_audio(stream_type, section[pos + 5:entry_end]):
+                entries.append(section[pos:entry_end])
+                audio_pids.add(es_pid)
+            pos = entry_end
+        if pcr_pid not in audio_pids:
+            pcr_pid = NULL_PID
+        body = bytearray(section[:12 + program_info_length])
+        body[8] = (body[8] & 0xE0) | (pcr_pid >> 8)
+        body[9] = pcr_pid & 0xFF
+        for entry in entries:
+            body += entry
+        section_length = len(body) - 3 + 4
+        body[1] = (body[1] & 0xF0) | (section_length >> 8)
+        body[2] = section_length & 0xFF
+        body += crc32_mpeg2(bytes(body)).to_bytes(4, "big")
+        return bytes(body), audio_pids
+
+    def _packetize(self, pid: int, section: bytes) -> List[bytes]:
+        data = b"\x00" + section  # pointer_field
+        packets = []
+        first = True
+        while data:
+            cc = self._cc.get(pid, 0)
+            self._cc[pid] = (cc + 1) & 0x0F
+            header = bytes((SYNC_BYTE, (0x40 if first else 0x00) | (pid >> 8), pid & 0xFF, 0x10 | cc))
+            payload, data = data[:PACKET_SIZE - 4], data[PACKET_SIZE - 4:]
+            packets.append(header + payload + b"\xff" * (PACKET_SIZE - 4 - len(payload)))
+            first = False
+        return packets
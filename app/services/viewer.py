@@ -0,0 +1,117 @@
+import asyncio
+import json
+import logging
+from typing import List, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger('multiplelive')
+
+
+class ReplayWindow:
+    """
+    最近推送消息的全局窗口（已序列化的 JSON），供断线重连时按 seq 补发。
+    seq 连续递增，按 seq 定位是 O(1)；超出条数或字节预算时丢弃最旧的。
+    """
+
+    def __init__(self, capacity: int = 5000, max_bytes: int = 4 * 1024 * 1024) -> None:
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._buf: List[Optional[str]] = [None] * capacity
+        self._first_seq = 0  # 窗口内最旧消息的 seq
+        self._len = 0
+        self._bytes = 0
+
+    @property
+    def oldest_seq(self) -> Optional[int]:
+        return self._first_seq if self._len else None
+
+    @property
+    def last_seq(self) -> Optional[int]:
+        return self._first_seq + self._len - 1 if self._len else None
+
+    def _pop_oldest(self) -> None:
+        i = self._first_seq % self.capacity
+        self._bytes -= len(self._buf[i] or '')
+        self._buf[i] = None
+        self._first_seq += 1
+        self._len -= 1
+
+    def append(self, seq: int, msg: str) -> None:
+        if self._len and seq != self._first_seq + self._len:
+            # seq 不连续（例如序号重置），清空窗口重新开始
+            self._buf = [None] * self.capacity
+            self._len = 0
+            self._bytes = 0
+        if not self._len:
+            self._first_seq = seq
+        if self._len == self.capacity:
+            self._pop_oldest()
+        while self._len and self._bytes + len(msg) > self.max_bytes:
+            self._pop_oldest()
+        self._buf[seq % self.capacity] = msg
+        self._len += 1
+        self._bytes += len(msg)
+
+    def since(self, seq: int) -> Tuple[bool, List[str]]:
+        """
+        返回 seq 之后的所有消息；第一个值为 False 表示窗口已经不包含 seq 之后紧接着的消息（缺口无法补齐）
+        """
+        if not self._len:
+            return True, []
+        if seq > self.last_seq:
+            # 客户端的 seq 比服务端还新，说明服务端重启过，序号已重新开始
+            return False, []
+        if seq < self._first_seq - 1:
+            return False, [self._buf[s % self.capacity] for s in range(self._first_seq, self._first_seq + self._len)]  # type: ignore[misc]
+        begin = max(seq + 1, self._first_seq)
+        end = self._first_seq + self._len
+        return True, [self._buf[s % self.capacity] for s in range(begin, end)]  # type: ignore[misc]
+
+
+class Viewer:
+    """
+    一个前端 WebSocket 连接：消息先进入自己的发送队列，由单独的任务写出，
+    慢客户端不会拖住广播；队列满时断开，客户端可以带 resume 重连补齐。
+    """
+
+    def __init__(self, ws: web.WebSocketResponse, max_pending: int = 2000) -> None:
+        self.ws = ws
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def push(self, msg: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self._queue.put_nowait(msg)
+            return True
+        except asyncio.QueueFull:
+            logger.warning("Viewer send queue overflow, closing connection for resume")
+            self.close()
+            return False
+
+    def push_json(self, obj: dict) -> bool:
+        return self.push(json.dumps(obj, ensure_ascii=False))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                msg = await self._queue.get()
+                await self.ws.send_str(msg)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+        asyncio.create_task(self.ws.close())
@@ -1,16 +1,62 @@
 import asyncio
-from typing import List, Optional
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
 
-from aiohttp import web
+from services.archive import DanmakuArchive
+from services.bootstrap_cache import BootstrapCache
+from services.history import HistoryStore
+from services.hls_relay import HlsRelay
+from services.live_status import LiveStatusPoller
+from services.paths import data_dir
+from services.search import ArchiveSearch
+from services.sessions import SessionManager
+from services.shm_ring import ShmRingWriter, default_path
+from services.viewer import ReplayWindow, Viewer
 
-from services.danmaku_service import DanmakuCollector
+if TYPE_CHECKING:
+    from services.danmaku_service import DanmakuCollector
+    from services.stream_watchdog import StreamWatchdog
 
 
 class AppState:
-    """全局应用状态：弹幕采集、WebSocket 客户端、广播任务"""
+    """全局应用状态：会话、弹幕采集、WebSocket 客户端、广播任务、初始化缓存、最近弹幕、归档、共享内存环形缓冲"""
 
     def __init__(self) -> None:
-        self.collector: Optional[DanmakuCollector] = None
-        self.ws_clients: List[web.WebSocketResponse] = []
+        # 所有会话共用一个采集器，房间连接按引用计数；第一次启动采集时创建，最后一个会话结束时停止
+        self.collector: Optional["DanmakuCollector"] = None
+        # 各前端会话的房间、颜色、连接与补发窗口
+        self.sessions = SessionManager()
+        # 所有弹幕连接（不论会话），推送播放地址替换等全局消息
+        self.ws_clients: List[Viewer] = []
+        # 不带 session 参数的弹幕连接（旧版前端、覆盖层等）接收所有房间的弹幕，按全局 seq 补发
+        self.all_rooms_viewers: List[Viewer] = []
+        self.replay = ReplayWindow()
         self.broadcast_task: Optional[asyncio.Task] = None
+        # 订阅全部房间实时统计的连接（不带会话）与每秒推送任务
+        self.stats_clients: List[Viewer] = []
+        self.stats_task: Optional[asyncio.Task] = None
+        # 跨多次启动/停止共用，进程启动时从磁盘加载
+        self.bootstrap_cache = BootstrapCache(data_dir() / "bootstrap_cache.json")
+        # 各房间最近弹幕，跨多次启动保留，供前端刷新/重连后补齐
+        self.history = HistoryStore()
+        # 弹幕持久化归档，设置环境变量 MULTIPLELIVE_ARCHIVE=1 开启
+        self.archive: Optional[DanmakuArchive] = None
+        self.search: Optional[ArchiveSearch] = None
+        if os.environ.get("MULTIPLELIVE_ARCHIVE", "").strip() not in ("", "0"):
+            self.archive = DanmakuArchive(data_dir() / "archive")
+            self.search = ArchiveSearch(self.archive)
+        # 共享内存环形缓冲，同机进程直接映射读取；MULTIPLELIVE_SHM_RING=1（默认路径）或文件路径开启
+        self.shm_ring: Optional[ShmRingWriter] = None
+        ring = os.environ.get("MULTIPLELIVE_SHM_RING", "").strip()
+        if ring not in ("", "0"):
+            size_mb = float(os.environ.get("MULTIPLELIVE_SHM_RING_MB", "").strip() or 16)
+            self.shm_ring = ShmRingWriter(default_path() if ring == "1" else Path(ring), int(size_mb * 1024 * 1024))
+        # 本地 HLS 中继，多个播放器共用一份上游播放列表与分片；MULTIPLELIVE_HLS_RELAY=1 时默认启用
+        self.hls_relay = HlsRelay()
+        self.hls_relay_default = os.environ.get("MULTIPLELIVE_HLS_RELAY", "").strip() not in ("", "0")
+        # 各房间开播状态，批量轮询；只有被跟踪的房间才会查询
+        self.live_status = LiveStatusPoller()
+        # 播放地址看护，第一次解析房间时创建
+        self.watchdog: Optional["StreamWatchdog"] = None
 
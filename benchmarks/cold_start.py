@@ -0,0 +1,77 @@
+"""
+冷启动预算检查：在全新的子进程里导入后端并创建应用，取多次运行的中位数与预算比较
+
+用法：
+    python benchmarks/cold_start.py                    # 默认预算 450 ms
+    python benchmarks/cold_start.py --budget-ms 400 --runs 7
+
+同时检查启动阶段没有导入应当延迟加载的模块（blivedm、requests、pure_protobuf 等）。
+超出预算或提前导入了这些模块时返回码为 1。各模块的耗时明细用 `python app/main.py --import-report` 查看。
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+app_dir = Path(__file__).resolve().parents[1] / 'app'
+
+# 只在第一次解析直播流、启动弹幕采集时才需要的模块
+DEFERRED_MODULES = (
+    'requests',
+    'blivedm',
+    'pure_protobuf',
+    'services.danmaku_service',
+)
+
+_PROBE = '''
+import json, sys, time
+t = time.perf_counter()
+import main
+main.create_app()
+print(json.dumps({{
+    "app_ms": (time.perf_counter() - t) * 1000,
+    "loaded": [m for m in {deferred!r} if m in sys.modules],
+}}))
+'''
+
+
+def run_once() -> dict:
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(deferred=DEFERRED_MODULES)],
+        cwd=app_dir, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result['wall_ms'] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='后端冷启动预算检查')
+    parser.add_argument('--budget-ms', type=float, default=450.0, help='进程启动到应用创建完成的中位耗时上限')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    run_once()  # 预热 .pyc 与文件系统缓存
+    results = [run_once() for _ in range(args.runs)]
+    wall = statistics.median(r['wall_ms'] for r in results)
+    app_ms = statistics.median(r['app_ms'] for r in results)
+    loaded = sorted({m for r in results for m in r['loaded']})
+
+    print(f'cold start (median of {args.runs}): {wall:.0f} ms wall, {app_ms:.0f} ms import+create_app, '
+          f'budget {args.budget_ms:.0f} ms')
+    failed = False
+    if wall > args.budget_ms:
+        print(f'FAIL: over budget by {wall - args.budget_ms:.0f} ms')
+        failed = True
+    if loaded:
+        print(f'FAIL: deferred modules imported at startup: {", ".join(loaded)}')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""
+基准测试用的合成数据
+
+数据结构按线上抓包的格式构造（字段顺序、嵌套层级与 B 站下发的一致），内容是假的。
+"""
+import base64
+import json
+import zlib
+from typing import Any, Dict, List
+
+import brotli
+
+from blivedm.clients import ws_base
+
+
+def danmu_info(i: int = 0) -> List[Any]:
+    """构造一条 DANMU_MSG 的 info 数组"""
+    mode_info = {
+        'mode': 0,
+        'show_player_type': 0,
+        'extra': json.dumps({
+            'send_from_me': False, 'mode': 0, 'color': 16777215, 'dm_type': 0, 'font_size': 25,
+            'player_mode': 1, 'show_player_type': 0, 'content': f'测试弹幕内容 {i}', 'user_hash': '2904574201',
+            'emoticon_unique': '', 'bulge_display': 0, 'recommend_score': 3, 'main_state_dm_color': '',
+            'objective_state_dm_color': '', 'direction': 0, 'pk_direction': 0, 'quartet_direction': 0,
+            'anniversary_crowd': 0, 'yeah_space_type': '', 'yeah_space_url': '', 'jump_to_url': '',
+            'space_type': '', 'space_url': '', 'animation': {}, 'emots': None, 'is_audited': False,
+            'id_str': 'a1b2c3d4e5f6a7b8c9d0e1f2a3b4c5d6', 'icon': None, 'show_reply': True, 'reply_mid': 0,
+            'reply_uname': '', 'reply_uname_color': '', 'reply_is_mystery': False, 'hit_combo': 0,
+        }, ensure_ascii=False),
+        'user': {
+            'uid': 10000 + i,
+            'base': {
+                'name': f'用户{i}',
+                'face': 'https://i0.hdslb.com/bfs/face/member/noface.jpg',
+                'name_color': 0,
+                'is_mystery': False,
+            },
+            'medal': {'name': '粉丝团', 'level': 21, 'color_start': 1725515, 'color_end': 5414290},
+            'wealth': {'level': 18},
+            'title': {'old_title_css_id': '', 'title_css_id': ''},
+            'guard': None,
+        },
+    }
+    return [
+        [0, 1, 25, 16777215, 1700000000000 + i, 1700000000, 0, 'a1b2c3d4', 0, 0, 0, '', 0, '{}', '{}',
+         mode_info, {'activity_identity': '', 'activity_source': 0, 'not_show': 0}, 0],
+        f'测试弹幕内容 {i}',
+        [10000 + i, f'用户{i}', 0, 0, 0, 10000, 1, ''],
+        [21, '粉丝团', '主播', 21452505, 1725515, '', 0, 1725515, 1725515, 5414290, 0, 1, 672346917],
+        [18, 0, 6406234, '>50000', 0],
+        ['', ''],
+        0,
+        0,
+        None,
+        {'ts': 1700000000, 'ct': 'ABCDEF01'},
+        0,
+        0,
+        None,
+        None,
+        0,
+        105,
+        [18],
+        None,
+    ]
+
+
+def danmu_command(i: int = 0) -> Dict[str, Any]:
+    return {'cmd': 'DANMU_MSG', 'info': danmu_info(i), 'dm_v2': ''}
+
+
+def interact_word_v2_pb(i: int = 0, msg_type: int = 1) -> bytes:
+    """用 pure_protobuf 编码一条 INTERACT_WORD_V2 的 pb 字段"""
+    from blivedm.models import pb
+
+    return bytes(pb.InteractWordV2(
+        uid=20000 + i,
+        uname=f'路人{i}',
+        msg_type=msg_type,
+        timestamp=1700000000 + i,
+        uinfo=pb.InteractWordV2UserInfo(
+            base=pb.InteractWordV2UserBaseInfo(face='https://i0.hdslb.com/bfs/face/member/noface.jpg'),
+        ),
+    ))
+
+
+def interact_word_v2_command(i: int = 0, msg_type: int = 1) -> Dict[str, Any]:
+    return {
+        'cmd': 'INTERACT_WORD_V2',
+        'data': {'dmscore': 12, 'pb': base64.b64encode(interact_word_v2_pb(i, msg_type)).decode('ascii')},
+    }
+
+
+def _make_packet(body: bytes, operation: int, ver: int) -> bytes:
+    return ws_base.HEADER_STRUCT.pack(
+        ws_base.HEADER_STRUCT.size + len(body), ws_base.HEADER_STRUCT.size, ver, operation, 0
+    ) + body
+
+
+def normal_frame(n: int = 1) -> bytes:
+    """未压缩的业务消息帧，包含n条弹幕"""
+    return b''.join(
+        _make_packet(
+            json.dumps(danmu_command(i), ensure_ascii=False).encode('utf-8'),
+            ws_base.Operation.SEND_MSG_REPLY,
+            ws_base.ProtoVer.NORMAL,
+        )
+        for i in range(n)
+    )
+
+
+def brotli_frame(n: int = 20) -> bytes:
+    """brotli压缩的业务消息帧，解压后包含n条弹幕"""
+    return _make_packet(
+        brotli.compress(normal_frame(n)), ws_base.Operation.SEND_MSG_REPLY, ws_base.ProtoVer.BROTLI
+    )
+
+
+def deflate_frame(n: int = 20) -> bytes:
+    """zlib压缩的业务消息帧，开放平台使用"""
+    return _make_packet(
+        zlib.compress(normal_frame(n)), ws_base.Operation.SEND_MSG_REPLY, ws_base.ProtoVer.DEFLATE
+    )
+
+
+def play_info(n_hosts: int = 3) -> Dict[str, Any]:
+    """getRoomPlayInfo 的返回结构"""
+    def codec(name: str) -> Dict[str, Any]:
+        return {
+            'codec_name': name,
+            'current_qn': 10000,
+            'accept_qn': [10000, 400, 250, 150],
+            'base_url': f'/live-bvc/123456/live_1_{name}/index.m3u8?',
+            'url_info': [
+                {'host': f'https://cn-gdfs-ct-01-{k:02d}.bilivideo.com', 'extra': 'expires=1700000000&len=0&oi=0',
+                 'stream_ttl': 3600}
+                for k in range(n_hosts)
+            ],
+            'hdr_qn': None,
+            'dolby_type': 0,
+            'attr_name': '',
+        }
+
+    def fmt(name: str) -> Dict[str, Any]:
+        return {'format_name': name, 'codec': [codec('avc'), codec('hevc')], 'master_url': ''}
+
+    return {
+        'code': 0,
+        'data': {
+            'room_id': 123456,
+            'playurl_info': {
+                'playurl': {
+                    'stream': [
+                        {'protocol_name': 'http_stream', 'format': [fmt('flv')]},
+                        {'protocol_name': 'http_hls', 'format': [fmt('ts'), fmt('fmp4')]},
+                    ],
+                },
+            },
+        },
+    }
+
+
+def _psi_crc(data: bytes) -> int:
+    """逐位计算的 CRC-32/MPEG-2，与被测实现（查表）相互独立"""
+    crc = 0xFFFFFFFF
+    for b in data:
+        crc ^= b << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) & 0xFFFFFFFF if crc & 0x80000000 else (crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+def _psi_packet(pid: int, section: bytes, cc: int = 0) -> bytes:
+    section += _psi_crc(section).to_bytes(4, 'big')
+    payload = b'\x00' + section
+    return bytes((0x47, 0x40 | pid >> 8, pid & 0xFF, 0x10 | cc)) + payload + b'\xff' * (184 - len(payload))
+
+
+TS_PMT_PID = 0x1000
+TS_VIDEO_PID = 0x100
+TS_AUDIO_PID = 0x101
+
+
+def ts_segment(n_video: int = 900, audio_every: int = 12, seed: int = 0) -> bytes:
+    """
+    构造一个 HLS TS 分片：PAT、PMT（H.264 + AAC，PCR 在视频 PID 上）、SDT、空包，
+    然后视频包与音频包交错（默认约 12:1，接近 B 站原画流的码率比例），包内容为确定性的伪随机数据
+    """
+    pat = bytes((0x00, 0xB0, 13, 0x00, 0x01, 0xC1, 0x00, 0x00, 0x00, 0x01,
+                 0xE0 | TS_PMT_PID >> 8, TS_PMT_PID & 0xFF))
+    program_info = bytes((0x88, 0x04)) + b'FAKE'
+    streams = (
+        bytes((0x1B, 0xE0 | TS_VIDEO_PID >> 8, TS_VIDEO_PID & 0xFF, 0xF0, 0x00))
+        + bytes((0x0F, 0xE0 | TS_AUDIO_PID >> 8, TS_AUDIO_PID & 0xFF, 0xF0, 0x06))
+        + bytes((0x0A, 0x04)) + b'und\x00'
+    )
+    body = (bytes((0x00, 0x01, 0xC1, 0x00, 0x00, 0xE0 | TS_VIDEO_PID >> 8, TS_VIDEO_PID & 0xFF,
+                   0xF0, len(program_info))) + program_info + streams)
+    pmt = bytes((0x02, 0xB0, len(body) + 4)) + body
+    sdt = bytes((0x42, 0xF0, 0x0C)) + bytes(9)
+    out = [_psi_packet(0x0000, pat), _psi_packet(TS_PMT_PID, pmt), _psi_packet(0x11, sdt)]
+    state = seed * 2654435761 & 0xFFFFFFFF
+    cc = {TS_VIDEO_PID: 0, TS_AUDIO_PID: 0}
+
+    def es_packet(pid: int, first: bool) -> bytes:
+        nonlocal state
+        state = (state * 1103515245 + 12345) & 0xFFFFFFFF
+        payload = state.to_bytes(4, 'big') * 46
+        header = bytes((0x47, (0x40 if first else 0) | pid >> 8, pid & 0xFF, 0x10 | cc[pid]))
+        cc[pid] = (cc[pid] + 1) & 0x0F
+        return header + payload
+
+    for i in range(n_video):
+        out.append(es_packet(TS_VIDEO_PID, i % 60 == 0))
+        if i % audio_every == 0:
+            out.append(es_packet(TS_AUDIO_PID, i % 120 == 0))
+        if i % 300 == 299:
+            out.append(bytes((0x47, 0x1F, 0xFF, 0x10)) + b'\xff' * 184)
+    return b''.join(out)
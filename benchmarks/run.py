@@ -0,0 +1,433 @@
+"""
+热点路径微基准
+
+用法：
+    python benchmarks/run.py                          # 运行全部用例并打印结果
+    python benchmarks/run.py -k danmaku               # 只运行名字包含 danmaku 的用例
+    python benchmarks/run.py --save out.json          # 保存结果为 JSON
+    python benchmarks/run.py --compare base.json      # 与历史结果对比，退化超过阈值时返回码为 1
+
+每个用例报告 ops/sec（多轮取最好一轮）与每次操作的内存分配量（tracemalloc 统计的峰值字节数）。
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+root_dir = Path(__file__).resolve().parents[1]
+for p in ((root_dir / 'app').as_posix(), (root_dir / 'blivedm').as_posix(), Path(__file__).resolve().parent.as_posix()):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+import fixtures  # noqa: E402
+
+
+class Case(NamedTuple):
+    name: str
+    setup: Callable[[], Callable[[int], Any]]
+    """返回 run(n) 函数，run(n) 执行 n 次被测操作"""
+
+
+CASES: List[Case] = []
+_cleanups: List[Callable[[], Any]] = []
+"""用例结束后需要执行的清理函数"""
+
+
+def case(name: str):
+    def decorator(setup):
+        CASES.append(Case(name, setup))
+        return setup
+    return decorator
+
+
+def _run_async(loop: asyncio.AbstractEventLoop, make_coro: Callable[[], Any]) -> Callable[[int], Any]:
+    async def many(n):
+        for _ in range(n):
+            await make_coro()
+
+    def run(n):
+        loop.run_until_complete(many(n))
+    return run
+
+
+class _FakeClient:
+    """只提供 handler 需要的属性"""
+
+    def __init__(self, room_id: int):
+        self.room_id = room_id
+
+
+#
+# 用例
+#
+
+@case('header_struct_unpack')
+def _bench_header():
+    from blivedm.clients import ws_base
+
+    data = fixtures.normal_frame(1)
+    unpack_from = ws_base.HEADER_STRUCT.unpack_from
+    header_tuple = ws_base.HeaderTuple
+
+    def run(n):
+        for _ in range(n):
+            header_tuple(*unpack_from(data, 0))
+    return run
+
+
+def _make_parse_client(loop):
+    import blivedm
+    from blivedm.clients import ws_base
+
+    class _Client(ws_base.WebSocketClientBase):
+        def __init__(self):
+            super().__init__()
+            self._room_id = 1
+
+    async def create():
+        client = _Client()
+        client.set_handler(blivedm.BaseHandler())
+        return client
+    client = loop.run_until_complete(create())
+    _cleanups.append(lambda: loop.run_until_complete(client.close()))
+    return client
+
+
+@case('parse_ws_message_normal')
+def _bench_parse_normal():
+    loop = asyncio.new_event_loop()
+    client = _make_parse_client(loop)
+    data = fixtures.normal_frame(1)
+    return _run_async(loop, lambda: client._parse_ws_message(data))
+
+
+@case('parse_ws_message_brotli_20')
+def _bench_parse_brotli():
+    loop = asyncio.new_event_loop()
+    client = _make_parse_client(loop)
+    data = fixtures.brotli_frame(20)
+    return _run_async(loop, lambda: client._parse_ws_message(data))
+
+
+@case('base_handler_dispatch')
+def _bench_dispatch():
+    import blivedm
+
+    handler = blivedm.BaseHandler()
+    client = _FakeClient(1)
+    command = fixtures.danmu_command()
+
+    def run(n):
+        for _ in range(n):
+            handler.handle(client, command)
+    return run
+
+
+@case('danmaku_message_from_command')
+def _bench_danmaku_from_command():
+    import blivedm.models.web as web_models
+
+    info = fixtures.danmu_info()
+    from_command = web_models.DanmakuMessage.from_command
+
+    def run(n):
+        for _ in range(n):
+            from_command(info)
+    return run
+
+
+@case('interact_word_v2_from_command')
+def _bench_interact_word_v2():
+    import blivedm.models.web as web_models
+
+    data = fixtures.interact_word_v2_command()['data']
+    from_command = web_models.InteractWordV2Message.from_command
+
+    def run(n):
+        for _ in range(n):
+            from_command(data)
+    return run
+
+
+@case('interact_word_v2_pure_protobuf')
+def _bench_interact_word_v2_pure_protobuf():
+    """手写解码器之前的实现，作为对照"""
+    import base64
+
+    from blivedm.models import pb
+
+    data = fixtures.interact_word_v2_command()['data']
+
+    def run(n):
+        for _ in range(n):
+            proto = pb.InteractWordV2.loads(base64.b64decode(data['pb']))
+            _ = proto.uinfo.base.face
+    return run
+
+
+@case('handler_on_danmaku')
+def _bench_on_danmaku():
+    import blivedm.models.web as web_models
+    from services.danmaku_service import _Handler
+
+    loop = asyncio.new_event_loop()
+
+    async def create():
+        return asyncio.Queue(maxsize=1024)
+    queue = loop.run_until_complete(create())
+    handler = _Handler(queue, {1: '#66ccff'})
+    client = _FakeClient(1)
+    message = web_models.DanmakuMessage.from_command(fixtures.danmu_info())
+
+    def run(n):
+        for _ in range(n):
+            handler._on_danmaku(client, message)
+        # 清空队列，避免后续轮次一直走丢弃最旧的分支
+        while not queue.empty():
+            queue.get_nowait()
+    return run
+
+
+@case('handler_interact_word_v2')
+def _bench_handler_interact():
+    from services.danmaku_service import _Handler
+
+    loop = asyncio.new_event_loop()
+
+    async def create():
+        return asyncio.Queue(maxsize=1024)
+    queue = loop.run_until_complete(create())
+    handler = _Handler(queue, {1: '#66ccff'})
+    client = _FakeClient(1)
+    command = fixtures.interact_word_v2_command()
+
+    async def dispatch(n):
+        for _ in range(n):
+            handler.handle(client, command)
+
+    def run(n):
+        # 聚合模式下只计数，汇总任务要在事件循环里创建
+        loop.run_until_complete(dispatch(n))
+
+    def cleanup():
+        handler.interact_aggregator.close()
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+    _cleanups.append(cleanup)
+    return run
+
+
+@case('broadcast_serialize')
+def _bench_broadcast_serialize():
+    """序列化一次，拼出不带会话的连接用的全局消息并存入补发窗口，再按会话拼接颜色与会话内序号（两个会话）"""
+    from services.items import DanmakuItem
+    from services.sessions import Session, encode_body
+    from services.viewer import ReplayWindow
+
+    item = DanmakuItem(room_id=21452505, uname='用户0', msg='测试弹幕内容 0', ts_ms=1700000000000, color='#66ccff')
+    sessions = [Session('a', [21452505], {21452505: '#66ccff'}), Session('b', [21452505], {})]
+    replay = ReplayWindow()
+    seq = itertools.count(1)
+
+    def run(n):
+        for _ in range(n):
+            item.seq = next(seq)
+            body = encode_body(item)
+            replay.append(item.seq, f'{body}, "color": {json.dumps(item.color)}}}')
+            for session in sessions:
+                session.deliver(item, body)
+    return run
+
+
+@case('stats_render')
+def _bench_stats_render():
+    """300 个各有 2000 条弹幕的房间，每秒一次的统计快照：每个房间新来一条弹幕后渲染全部房间并拼出全局消息"""
+    import random
+    from services.analytics import ChatAnalytics, render_rooms, stats_message
+
+    rnd = random.Random(0)
+    analytics = ChatAnalytics()
+    now = 1_700_000_000.0
+    for rid in range(300):
+        for i in range(2000):
+            analytics.record(rid, rnd.randrange(1, 10 ** 6), f'用户{i}', f'弹幕 {i % 50}', now=now + i * 0.1)
+    now += 200
+
+    def run(n):
+        for _ in range(n):
+            for rid in range(300):
+                analytics.record(rid, 1, '用户', '弹幕', now=now)
+            stats_message(now, render_rooms(analytics.room_snapshots(now)))
+    return run
+
+
+@case('ts_audio_filter')
+def _bench_ts_audio_filter():
+    """一个约 180 KB 的 TS 分片按 64 KB 分块过滤为纯音频"""
+    from services.ts_audio import TsAudioFilter
+
+    data = fixtures.ts_segment()
+    chunks = [data[i:i + 65536] for i in range(0, len(data), 65536)]
+
+    def run(n):
+        for _ in range(n):
+            f = TsAudioFilter()
+            for chunk in chunks:
+                f.feed(chunk)
+    return run
+
+
+@case('shm_ring_append')
+def _bench_shm_ring_append():
+    """编码并写入 1 MB 的共享内存环形缓冲，包含回绕与覆盖旧记录"""
+    import tempfile
+    from services.items import DanmakuItem
+    from services.shm_ring import ShmRingWriter
+
+    tmp = tempfile.TemporaryDirectory()
+    writer = ShmRingWriter(Path(tmp.name) / 'ring', 1024 * 1024)
+    item = DanmakuItem(room_id=21452505, uname='用户0', msg='测试弹幕内容 0', ts_ms=1700000000000, color='#66ccff')
+
+    def run(n):
+        for _ in range(n):
+            writer.append(item)
+
+    def cleanup():
+        writer.close()
+        tmp.cleanup()
+    _cleanups.append(cleanup)
+    return run
+
+
+@case('select_best')
+def _bench_select_best():
+    from services.stream_resolver import _extract_candidates, _select_best
+
+    candidates = _extract_candidates(fixtures.play_info())
+
+    def run(n):
+        for _ in range(n):
+            _select_best(candidates, prefer_protocol='http_hls')
+    return run
+
+
+#
+# 运行与对比
+#
+
+def _calibrate(run: Callable[[int], Any], min_time: float) -> int:
+    n = 1
+    while True:
+        start = time.perf_counter()
+        run(n)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or n >= 1 << 24:
+            return n
+        n = max(n * 2, int(n * min_time / max(elapsed, 1e-9) * 1.1))
+
+
+def _measure_alloc(run: Callable[[int], Any], samples: int = 21) -> float:
+    """单次操作的峰值分配字节数，取多次采样的中位数"""
+    sizes = []
+    tracemalloc.start()
+    try:
+        run(1)  # 预热，排除首次调用的缓存
+        for _ in range(samples):
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            run(1)
+            _, peak = tracemalloc.get_traced_memory()
+            sizes.append(max(peak - base, 0))
+    finally:
+        tracemalloc.stop()
+    sizes.sort()
+    return float(sizes[len(sizes) // 2])
+
+
+def bench_case(c: Case, min_time: float, repeat: int) -> Dict[str, Any]:
+    run = c.setup()
+    try:
+        run(1)
+        n = _calibrate(run, min_time)
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(n)
+            best = min(best, time.perf_counter() - start)
+        alloc = _measure_alloc(run)
+    finally:
+        while _cleanups:
+            _cleanups.pop()()
+    return {
+        'ops_per_sec': n / best,
+        'alloc_bytes_per_op': alloc,
+        'iterations': n,
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], threshold: float) -> List[str]:
+    """返回退化的用例描述"""
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if cur['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+            regressions.append(
+                f"{name}: ops/sec {base['ops_per_sec']:.0f} -> {cur['ops_per_sec']:.0f}"
+            )
+        # 分配量很小时抖动占比大，给一个绝对容差
+        if cur['alloc_bytes_per_op'] > base['alloc_bytes_per_op'] * (1 + threshold) + 64:
+            regressions.append(
+                f"{name}: alloc B/op {base['alloc_bytes_per_op']:.0f} -> {cur['alloc_bytes_per_op']:.0f}"
+            )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='MultipleLive 热点路径微基准')
+    parser.add_argument('-k', dest='keyword', default='', help='只运行名字包含该关键字的用例')
+    parser.add_argument('--min-time', type=float, default=0.2, help='每轮最少运行时间（秒）')
+    parser.add_argument('--repeat', type=int, default=5, help='轮数，取最好的一轮')
+    parser.add_argument('--save', type=Path, help='结果保存路径（JSON）')
+    parser.add_argument('--compare', type=Path, help='对比的历史结果（JSON）')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的退化比例，默认 0.2')
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for c in CASES:
+        if args.keyword not in c.name:
+            continue
+        res = results[c.name] = bench_case(c, args.min_time, args.repeat)
+        print(f"{c.name:<36} {res['ops_per_sec']:>14,.0f} ops/s {res['alloc_bytes_per_op']:>10,.0f} B/op")
+
+    if args.save is not None:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps({
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text(encoding='utf-8'))['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\n性能退化：')
+            for r in regressions:
+                print(f'  {r}')
+            return 1
+        print('\n未发现超过阈值的退化')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
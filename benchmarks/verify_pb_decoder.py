@@ -0,0 +1,158 @@
+"""
+逐字段校验手写的 InteractWordV2 解码器与 pure_protobuf 解码结果一致
+
+用法：
+    python benchmarks/verify_pb_decoder.py                    # 样本库 + 合成数据（含未知字段、乱序、极端值、截断）
+    python benchmarks/verify_pb_decoder.py captured.txt       # 另外校验抓取的 pb 字段，每行一条 base64
+
+样本库是随仓库提交的 interact_word_v2_corpus.txt，格式与来源说明见文件开头。
+
+有不一致时返回码为 1。
+"""
+import base64
+import random
+import sys
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+root_dir = Path(__file__).resolve().parents[1]
+for p in ((root_dir / 'blivedm').as_posix(), Path(__file__).resolve().parent.as_posix()):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+from blivedm.models import pb, pb_decoder  # noqa: E402
+
+FIELDS = ('uid', 'uname', 'msg_type', 'timestamp', 'face')
+CORPUS = Path(__file__).resolve().parent / 'interact_word_v2_corpus.txt'
+
+
+def _varint(value: int) -> bytes:
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while True:
+        b = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _field(number: int, wire_type: int, payload: bytes) -> bytes:
+    key = _varint(number << 3 | wire_type)
+    if wire_type == 2:
+        return key + _varint(len(payload)) + payload
+    return key + payload
+
+
+def _unknown_fields(rng: random.Random) -> bytes:
+    """随机的未知字段，覆盖所有 wire type"""
+    out = b''
+    for _ in range(rng.randint(0, 4)):
+        number = rng.choice((3, 4, 6, 8, 9, 10, 15, 23, 100, 2000))
+        wire_type = rng.choice((0, 1, 2, 5))
+        if wire_type == 0:
+            out += _field(number, 0, _varint(rng.getrandbits(rng.choice((7, 35, 64)))))
+        elif wire_type == 1:
+            out += _field(number, 1, rng.randbytes(8))
+        elif wire_type == 2:
+            out += _field(number, 2, rng.randbytes(rng.randint(0, 40)))
+        else:
+            out += _field(number, 5, rng.randbytes(4))
+    return out
+
+
+def synthetic_payloads(n: int = 2000, seed: int = 1) -> Iterator[bytes]:
+    rng = random.Random(seed)
+    names = ['路人', 'user_42', '', '🎉テスト', 'a' * 200, '带 空格\n换行']
+    for i in range(n):
+        # 一半用 pure_protobuf 编码，一半手工拼出乱序、带未知字段、重复字段的数据
+        uid = rng.choice((0, 1, 127, 128, 20000 + i, 2 ** 32 + i, 2 ** 62))
+        uname = rng.choice(names) + str(i)
+        msg_type = rng.choice((0, 1, 2, 3, 6, 300))
+        timestamp = rng.choice((0, 1700000000 + i))
+        face = rng.choice(('', 'https://i0.hdslb.com/bfs/face/member/noface.jpg', 'https://例子.jpg'))
+        if i % 2 == 0:
+            yield bytes(pb.InteractWordV2(
+                uid=uid, uname=uname, msg_type=msg_type, timestamp=timestamp,
+                uinfo=pb.InteractWordV2UserInfo(base=pb.InteractWordV2UserBaseInfo(face=face)),
+            ))
+            continue
+        base = _unknown_fields(rng) + _field(2, 2, face.encode('utf-8')) + _unknown_fields(rng)
+        uinfo = _unknown_fields(rng) + _field(2, 2, base)
+        parts = [
+            _field(1, 0, _varint(uid)),
+            _field(2, 2, uname.encode('utf-8')),
+            _field(5, 0, _varint(msg_type)),
+            _field(7, 0, _varint(timestamp)),
+            _field(22, 2, uinfo),
+            _unknown_fields(rng),
+        ]
+        rng.shuffle(parts)
+        if i % 5 == 1:
+            parts.append(_field(5, 0, _varint(msg_type + 1)))  # 重复字段，后出现的生效
+        yield b''.join(parts)
+
+
+def reference(data: bytes) -> Tuple:
+    proto = pb.InteractWordV2.loads(data)
+    return proto.uid, proto.uname, proto.msg_type, proto.timestamp, proto.uinfo.base.face
+
+
+def verify(payloads: List[bytes]) -> int:
+    mismatches = 0
+    for i, data in enumerate(payloads):
+        expected = reference(data)
+        actual = pb_decoder.decode_interact_word_v2(data)
+        for name, e, a in zip(FIELDS, expected, actual):
+            if e != a:
+                mismatches += 1
+                print(f'#{i} {name}: expected {e!r}, got {a!r}  payload={base64.b64encode(data).decode()}')
+        if pb_decoder.find_varint(data, 5) != expected[2] and data.count(b'\x28') <= 1:
+            # 0x28 是字段 5 varint 的 key，也可能作为其他字段的内容出现，出现多次时不比较
+            mismatches += 1
+            print(f'#{i} find_varint(5): expected {expected[2]!r}')
+    return mismatches
+
+
+def verify_truncated(payloads: List[bytes]) -> int:
+    """截断的数据要么在字段边界上正常解析，要么抛 DecodeError，不能出现其他异常"""
+    bad = 0
+    for data in payloads[:200]:
+        for cut in range(1, len(data)):
+            try:
+                pb_decoder.decode_interact_word_v2(data[:cut])
+            except pb_decoder.DecodeError:
+                pass
+            except Exception as e:  # noqa: BLE001
+                bad += 1
+                print(f'truncated at {cut}: {type(e).__name__}: {e}')
+                break
+    return bad
+
+
+def load_payloads(path: Path) -> List[bytes]:
+    """每行一条 base64，忽略空行与 # 开头的注释行"""
+    payloads = []
+    for line in path.read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            payloads.append(base64.b64decode(line))
+    return payloads
+
+
+def main() -> int:
+    # 样本库放在最前面，截断校验（只取前 200 条）一定覆盖到
+    corpus = load_payloads(CORPUS)
+    extra = [data for path in sys.argv[1:] for data in load_payloads(Path(path))]
+    payloads = corpus + extra + list(synthetic_payloads())
+    mismatches = verify(payloads)
+    bad_truncation = verify_truncated(payloads)
+    print(f'{len(payloads)} payloads ({len(corpus)} from {CORPUS.name}, {len(extra)} from arguments), '
+          f'{len(FIELDS)} fields each: {mismatches} mismatches, {bad_truncation} bad truncation errors')
+    return 1 if mismatches or bad_truncation else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
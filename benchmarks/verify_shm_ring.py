@@ -0,0 +1,128 @@
+"""
+校验共享内存环形缓冲：写者连续写入合成弹幕，几个读者进程同时读取。
+跟得上的读者必须按顺序拿到每一条；故意读得慢的读者允许被覆盖跳过，但拿到的每条记录都必须完整、有序。
+同时报告写者有无读者时的吞吐量，确认慢读者不拖慢写者。
+
+用法：
+    python benchmarks/verify_shm_ring.py [--records 100000] [--capacity-kb 256]
+
+有不一致时返回码为 1。
+"""
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+root_dir = Path(__file__).resolve().parents[1]
+for p in ((root_dir / 'app').as_posix(),):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+from services.danmaku_codec import decode_item, encode_item  # noqa: E402
+from services.items import DanmakuItem  # noqa: E402
+from services.shm_ring import ShmRingReader, ShmRingWriter  # noqa: E402
+
+
+def _item(seq: int) -> DanmakuItem:
+    return DanmakuItem(room_id=1000 + seq % 7, uname=f"user{seq % 97}", msg="弹幕" * (seq % 23) + str(seq),
+                       ts_ms=1_700_000_000_000 + seq, color="#66ccff", seq=seq)
+
+
+def _reader(path: str, total: int, delay: float, ready, result) -> None:
+    reader = ShmRingReader(Path(path), from_oldest=True)
+    ready.set()
+    errors: List[str] = []
+    seen = 0
+    last = 0
+    deadline = time.monotonic() + 60
+    while last < total and time.monotonic() < deadline:
+        if not reader.wait(timeout=0.5):
+            continue
+        views = reader.poll(1024)
+        # 先对 memoryview 逐条检查，检查完再确认期间没有被覆盖（零拷贝读的用法）
+        checked = []
+        view = None
+        for view in views:
+            item, _ = decode_item(view)
+            checked.append((item.seq, item == _item(item.seq)))
+        del views, view
+        lost = reader.overwritten()
+        for seq, ok in checked[lost:]:
+            if not ok:
+                errors.append(f"record {seq} corrupted")
+            if seq <= last:
+                errors.append(f"record {seq} out of order after {last}")
+            last = seq
+            seen += 1
+        if delay:
+            time.sleep(delay)
+    if last < total:
+        errors.append(f"stopped at {last}/{total}")
+    result.put({"delay": delay, "seen": seen, "overruns": reader.overruns, "errors": errors[:5]})
+    reader.close()
+
+
+def _write(writer: ShmRingWriter, records: List[bytes], rate: float) -> float:
+    started = time.perf_counter()
+    for i, record in enumerate(records):
+        writer.append_record(record)
+        if rate and i % 1000 == 999:
+            # 限速，让跟得上的读者确实跟得上
+            ahead = (i + 1) / rate - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+    return time.perf_counter() - started
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=100_000)
+    parser.add_argument("--capacity-kb", type=int, default=256)
+    parser.add_argument("--rate", type=float, default=20_000, help="写入速率上限（条/秒）")
+    args = parser.parse_args(argv)
+
+    records = [encode_item(_item(seq)) for seq in range(1, args.records + 1)]
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "ring"
+
+        writer = ShmRingWriter(path, args.capacity_kb * 1024)
+        alone = _write(writer, records, 0)
+        writer.close()
+        print(f"writer alone: {args.records / alone:,.0f} records/s (unthrottled)")
+
+        writer = ShmRingWriter(path, args.capacity_kb * 1024)
+        ctx = multiprocessing.get_context("spawn")
+        result = ctx.Queue()
+        procs = []
+        for delay in (0.0, 0.0, 0.05):
+            ready = ctx.Event()
+            proc = ctx.Process(target=_reader, args=(str(path), args.records, delay, ready, result))
+            proc.start()
+            ready.wait(30)
+            procs.append(proc)
+        elapsed = _write(writer, records, args.rate)
+        print(f"writer with 3 readers: {args.records / elapsed:,.0f} records/s (throttled to {args.rate:,.0f})")
+        reports: List[Dict] = [result.get(timeout=90) for _ in procs]
+        for proc in procs:
+            proc.join(10)
+        writer.close()
+
+    for report in sorted(reports, key=lambda r: r["delay"]):
+        slow = report["delay"] > 0
+        print(f"reader delay={report['delay']}: seen {report['seen']}/{args.records}, "
+              f"overruns {report['overruns']}, errors {report['errors']}")
+        if report["errors"]:
+            failures += 1
+        elif not slow and (report["seen"] != args.records or report["overruns"]):
+            print("  fast reader lost records")
+            failures += 1
+    print("OK" if not failures else f"{failures} reader(s) failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
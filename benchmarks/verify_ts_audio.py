@@ -0,0 +1,97 @@
+"""
+校验 TS 音频过滤：输出只含 PAT、PMT 与音频 PID，PMT 只剩音频条目且 CRC 正确，音频包与输入逐字节一致，
+且结果与输入如何切块无关
+
+用法：
+    python benchmarks/verify_ts_audio.py                  # 合成分片
+    python benchmarks/verify_ts_audio.py a.ts b.ts        # 另外校验抓取的真实分片
+
+有不一致时返回码为 1。
+"""
+import random
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+root_dir = Path(__file__).resolve().parents[1]
+for p in ((root_dir / 'blivedm').as_posix(), (root_dir / 'app').as_posix(), Path(__file__).resolve().parent.as_posix()):
+    if p not in sys.path:
+        sys.path.insert(0, p)
+
+import fixtures  # noqa: E402
+from services.ts_audio import PACKET_SIZE, TsAudioFilter  # noqa: E402
+
+
+def _packets(data: bytes) -> Dict[int, List[bytes]]:
+    by_pid: Dict[int, List[bytes]] = {}
+    for pos in range(0, len(data) - len(data) % PACKET_SIZE, PACKET_SIZE):
+        packet = data[pos:pos + PACKET_SIZE]
+        if packet[0] == 0x47:
+            by_pid.setdefault(((packet[1] & 0x1F) << 8) | packet[2], []).append(packet)
+    return by_pid
+
+
+def _pmt_section(packet: bytes) -> bytes:
+    start = 4 + 1 + packet[4]
+    length = ((packet[start + 1] & 0x0F) << 8) | packet[start + 2]
+    return packet[start:start + 3 + length]
+
+
+def check(name: str, data: bytes, rng: random.Random) -> List[str]:
+    errors: List[str] = []
+    f = TsAudioFilter()
+    whole = f.feed(data) + f.flush()
+    audio_pids = f.audio_pids
+
+    # 任意切块得到同样的结果
+    f2 = TsAudioFilter()
+    parts, pos = [], 0
+    while pos < len(data):
+        step = rng.randint(1, 4096)
+        parts.append(f2.feed(data[pos:pos + step]))
+        pos += step
+    if b''.join(parts) + f2.flush() != whole:
+        errors.append(f'{name}: output depends on chunking')
+
+    src, out = _packets(data), _packets(whole)
+    if len(whole) % PACKET_SIZE:
+        errors.append(f'{name}: output not packet aligned')
+    pmt_pids = set(out) - audio_pids - {0}
+    if not audio_pids:
+        errors.append(f'{name}: no audio PID found')
+    for pid in audio_pids:
+        if out.get(pid) != src.get(pid):
+            errors.append(f'{name}: audio PID {pid:#x} packets differ')
+    if out.get(0) != src.get(0):
+        errors.append(f'{name}: PAT packets differ')
+    for pid in pmt_pids:
+        for packet in out[pid]:
+            section = _pmt_section(packet)
+            if fixtures._psi_crc(section[:-4]).to_bytes(4, 'big') != section[-4:]:
+                errors.append(f'{name}: PMT CRC mismatch on PID {pid:#x}')
+            pil = ((section[10] & 0x0F) << 8) | section[11]
+            p, listed = 12 + pil, set()
+            while p + 5 <= len(section) - 4:
+                listed.add(((section[p + 1] & 0x1F) << 8) | section[p + 2])
+                p += 5 + (((section[p + 3] & 0x0F) << 8) | section[p + 4])
+            if listed != audio_pids:
+                errors.append(f'{name}: PMT lists {sorted(listed)}, expected {sorted(audio_pids)}')
+    print(f'{name}: {len(data)} -> {len(whole)} bytes ({len(whole) / max(len(data), 1):.1%}), '
+          f'audio PIDs {sorted(hex(p) for p in audio_pids)}')
+    return errors
+
+
+def main() -> int:
+    rng = random.Random(1)
+    errors: List[str] = []
+    for seed in range(5):
+        errors += check(f'synthetic#{seed}', fixtures.ts_segment(seed=seed), rng)
+    for path in sys.argv[1:]:
+        errors += check(path, Path(path).read_bytes(), rng)
+    for e in errors:
+        print('FAIL:', e)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
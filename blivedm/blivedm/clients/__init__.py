@@ -1,3 +1,4 @@
 # -*- coding: utf-8 -*-
+from .heartbeat import *
 from .web import *
 from .open_live import *
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import random
+from typing import *
+
+__all__ = (
+    'HeartbeatScheduler',
+)
+
+logger = logging.getLogger('blivedm')
+
+
+class _Entry:
+    __slots__ = ('key', 'interval', 'callback', 'slot', 'rounds')
+
+    def __init__(self, key: Hashable, interval: float, callback: Callable[[], Awaitable]):
+        self.key = key
+        self.interval = interval
+        self.callback = callback
+        self.slot = 0
+        """所在的格子"""
+        self.rounds = 0
+        """还要转几圈才到期"""
+
+
+class HeartbeatScheduler:
+    """
+    多个客户端共用的心跳调度器，用一个时间轮代替每个客户端各自的定时器
+
+    每格到期的心跳在同一个任务里批量发送，首次发送时间带随机抖动，避免大量连接同时发心跳
+
+    :param tick: 时间轮每格的时长（秒）
+    :param jitter: 首次发送时间的抖动比例，0表示不抖动，0.5表示在[0.5 * interval, interval]之间随机
+    :param slot_num: 时间轮的格数
+    """
+
+    def __init__(self, tick: float = 1, jitter: float = 0.5, slot_num: int = 64):
+        self._tick = tick
+        self._jitter = jitter
+        self._slots: List[Set[_Entry]] = [set() for _ in range(slot_num)]
+        self._cursor = 0
+        """下一次要处理的格子"""
+        self._entries: Dict[Hashable, _Entry] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def add(self, key: Hashable, interval: float, callback: Callable[[], Awaitable]):
+        """
+        注册一个定时任务，如果key已存在则替换
+
+        :param key: 任务的键，用来取消
+        :param interval: 间隔时间（秒）
+        :param callback: 到期时调用的async函数
+        """
+        self.remove(key)
+        entry = self._entries[key] = _Entry(key, interval, callback)
+        self._schedule(entry, interval * (1 - self._jitter * random.random()))
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def remove(self, key: Hashable):
+        """
+        取消一个定时任务
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._slots[entry.slot].discard(entry)
+
+    def _schedule(self, entry: _Entry, delay: float):
+        ticks = max(1, round(delay / self._tick))
+        entry.slot = (self._cursor + ticks - 1) % len(self._slots)
+        entry.rounds = (ticks - 1) // len(self._slots)
+        self._slots[entry.slot].add(entry)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        try:
+            while self._entries:
+                next_time += self._tick
+                await asyncio.sleep(max(0., next_time - loop.time()))
+
+                slot = self._slots[self._cursor]
+                self._cursor = (self._cursor + 1) % len(self._slots)
+                due = []
+                for entry in list(slot):
+                    if entry.rounds > 0:
+                        entry.rounds -= 1
+                        continue
+                    slot.discard(entry)
+                    due.append(entry)
+                for entry in due:
+                    self._schedule(entry, entry.interval)
+
+                if due:
+                    # 一格只开一个任务，不阻塞时间轮
+                    asyncio.create_task(self._run_batch([entry.callback for entry in due]))
+        finally:
+            self._task = None
+
+    @staticmethod
+    async def _run_batch(callbacks: List[Callable[[], Awaitable]]):
+        results = await asyncio.gather(*(callback() for callback in callbacks), return_exceptions=True)
+        for res in results:
+            if isinstance(res, Exception):
+                logger.error('HeartbeatScheduler callback failed:', exc_info=res)
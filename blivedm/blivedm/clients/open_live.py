@@ -10,7 +10,7 @@ from typing import *
 
 import aiohttp
 
-from . import ws_base
+from . import heartbeat, ws_base
 
 __all__ = (
     'OpenLiveClient',
@@ -36,6 +36,7 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
     :param session: cookie、连接池
     :param heartbeat_interval: 发送连接心跳包的间隔时间（秒）
     :param game_heartbeat_interval: 发送项目心跳包的间隔时间（秒）
+    :param heartbeat_scheduler: 共用的心跳调度器，连接心跳包和项目心跳包都由它发送，为None时使用自己的定时器
     """
 
     def __init__(
@@ -48,8 +49,9 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         session: Optional[aiohttp.ClientSession] = None,
         heartbeat_interval=30,
         game_heartbeat_interval=20,
+        heartbeat_scheduler: Optional[heartbeat.HeartbeatScheduler] = None,
     ):
-        super().__init__(session, heartbeat_interval)
+        super().__init__(session, heartbeat_interval, heartbeat_scheduler)
 
         self._access_key_id = access_key_id
         self._access_key_secret = access_key_secret
@@ -115,6 +117,8 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         if self.is_running:
             logger.warning('room=%s is calling close(), but client is running', self.room_id)
 
+        if self._heartbeat_scheduler is not None:
+            self._heartbeat_scheduler.remove(self._game_heartbeat_key)
         if self._game_heartbeat_timer_handle is not None:
             self._game_heartbeat_timer_handle.cancel()
             self._game_heartbeat_timer_handle = None
@@ -155,7 +159,14 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
         if not await self._start_game():
             return False
 
-        if self._game_id != '' and self._game_heartbeat_timer_handle is None:
+        if self._game_id == '':
+            return True
+        if self._heartbeat_scheduler is not None:
+            if self._game_heartbeat_key not in self._heartbeat_scheduler:
+                self._heartbeat_scheduler.add(
+                    self._game_heartbeat_key, self._game_heartbeat_interval, self._send_game_heartbeat
+                )
+        elif self._game_heartbeat_timer_handle is None:
             self._game_heartbeat_timer_handle = asyncio.get_running_loop().call_later(
                 self._game_heartbeat_interval, self._on_send_game_heartbeat
             )
@@ -224,6 +235,11 @@ class OpenLiveClient(ws_base.WebSocketClientBase):
             return False
         return True
 
+    @property
+    def _game_heartbeat_key(self):
+        """在心跳调度器中项目心跳的键，连接心跳的键是self"""
+        return self, 'game'
+
     def _on_send_game_heartbeat(self):
         """
         定时发送项目心跳包的回调
@@ -3,6 +3,8 @@ import asyncio
 import datetime
 import hashlib
 import logging
+import random
+import time
 import urllib
 import weakref
 from typing import *
@@ -10,10 +12,12 @@ from typing import *
 import aiohttp
 import yarl
 
-from . import ws_base
+from . import heartbeat, ws_base
 from .. import utils
 
 __all__ = (
+    'BootstrapCacheInterface',
+    'HostScoreboard',
     'BLiveClient',
 )
 
@@ -31,6 +35,141 @@ DEFAULT_DANMAKU_SERVER_LIST = [
 _session_to_wbi_signer = weakref.WeakKeyDictionary()
 
 
+class _HostStat:
+    __slots__ = ('connect_time', 'auth_time', 'failures', 'failure_time', 'active')
+
+    def __init__(self):
+        self.connect_time: Optional[float] = None
+        """建立WebSocket连接耗时的EWMA（秒）"""
+        self.auth_time: Optional[float] = None
+        """发送认证包到收到AUTH_REPLY耗时的EWMA（秒）"""
+        self.failures = 0.
+        """按时间衰减的失败次数"""
+        self.failure_time = 0.
+        """上次更新failures的时间"""
+        self.active = 0
+        """当前使用这个服务器的连接数"""
+
+
+class HostScoreboard:
+    """
+    弹幕服务器评分，所有房间共用。分数是建连耗时、认证耗时的EWMA加上衰减的失败惩罚，越小越好
+
+    :param alpha: EWMA的平滑系数
+    :param failure_penalty: 每次失败相当于多少秒耗时
+    :param failure_half_life: 失败次数的半衰期（秒）
+    :param unknown_score: 没有测量数据的服务器的分数，偏乐观以便尝试
+    :param tolerance: 和最好的分数相差在这个比例以内的服务器视为一样好，在它们之间按连接数均衡
+    """
+
+    def __init__(self, alpha=0.3, failure_penalty=5., failure_half_life=120., unknown_score=0.5, tolerance=0.2):
+        self._alpha = alpha
+        self._failure_penalty = failure_penalty
+        self._failure_half_life = failure_half_life
+        self._unknown_score = unknown_score
+        self._tolerance = tolerance
+        self._stats: Dict[str, _HostStat] = {}
+
+    def _get_stat(self, host: str) -> _HostStat:
+        stat = self._stats.get(host, None)
+        if stat is None:
+            stat = self._stats[host] = _HostStat()
+        return stat
+
+    def _decayed_failures(self, stat: _HostStat, now: float):
+        if stat.failures == 0:
+            return 0.
+        return stat.failures * 0.5 ** ((now - stat.failure_time) / self._failure_half_life)
+
+    def _ewma(self, old: Optional[float], value: float):
+        if old is None:
+            return value
+        return old + self._alpha * (value - old)
+
+    def score(self, host: str, now: Optional[float] = None) -> float:
+        if now is None:
+            now = time.monotonic()
+        stat = self._stats.get(host, None)
+        if stat is None:
+            return self._unknown_score
+        res = self._decayed_failures(stat, now) * self._failure_penalty
+        if stat.connect_time is None and stat.auth_time is None:
+            return res + self._unknown_score
+        return res + (stat.connect_time or 0.) + (stat.auth_time or 0.)
+
+    def choose(self, host_list: List[dict]) -> dict:
+        """
+        选择分数最好的服务器，分数差不多时选连接数最少的
+        """
+        if len(host_list) == 1:
+            return host_list[0]
+        now = time.monotonic()
+        scores = [self.score(host_server['host'], now) for host_server in host_list]
+        threshold = min(scores) * (1 + self._tolerance) + 0.01
+        good_hosts = [host_server for host_server, score in zip(host_list, scores) if score <= threshold]
+        min_active = min(self._get_stat(host_server['host']).active for host_server in good_hosts)
+        return random.choice([
+            host_server for host_server in good_hosts
+            if self._get_stat(host_server['host']).active == min_active
+        ])
+
+    def report_connect(self, host: str, elapsed: float):
+        stat = self._get_stat(host)
+        stat.connect_time = self._ewma(stat.connect_time, elapsed)
+
+    def report_auth(self, host: str, elapsed: float):
+        stat = self._get_stat(host)
+        stat.auth_time = self._ewma(stat.auth_time, elapsed)
+        stat.active += 1
+
+    def report_failure(self, host: str):
+        stat = self._get_stat(host)
+        now = time.monotonic()
+        stat.failures = self._decayed_failures(stat, now) + 1
+        stat.failure_time = now
+
+    def report_disconnect(self, host: str):
+        stat = self._get_stat(host)
+        stat.active = max(0, stat.active - 1)
+
+    def snapshot(self) -> Dict[str, dict]:
+        now = time.monotonic()
+        return {
+            host: {
+                'score': self.score(host, now),
+                'connect_time': stat.connect_time,
+                'auth_time': stat.auth_time,
+                'failures': self._decayed_failures(stat, now),
+                'active': stat.active,
+            }
+            for host, stat in self._stats.items()
+        }
+
+
+_default_host_scoreboard = HostScoreboard()
+
+
+class BootstrapCacheInterface:
+    """
+    init_room结果的缓存接口，持久化后可以在重启时跳过大部分初始化请求
+
+    kind有这些：
+
+    - `wbi_key`：key为''，值为`{'wbi_key': str, 'refresh_time': float}`
+    - `buvid3`：key为''，值为buvid3 cookie
+    - `room_init`：key为构造时的房间ID，值为`{'room_id': int, 'uid': int}`
+    - `danmu_info`：key为真实房间ID，值为`{'host_list': list, 'token': str}`
+
+    过期策略由实现决定，过期的值应该返回None
+    """
+
+    def get(self, kind: str, key) -> Optional[Any]:
+        return None
+
+    def set(self, kind: str, key, value):
+        pass
+
+
 def _get_wbi_signer(session: aiohttp.ClientSession) -> '_WbiSigner':
     wbi_signer = _session_to_wbi_signer.get(session, None)
     if wbi_signer is None:
@@ -62,10 +201,21 @@ class _WbiSigner:
         """
         return self._wbi_key
 
+    @property
+    def last_refresh_time(self) -> Optional[datetime.datetime]:
+        return self._last_refresh_time
+
     def reset(self):
         self._wbi_key = ''
         self._last_refresh_time = None
 
+    def load_wbi_key(self, wbi_key: str, refresh_time: datetime.datetime):
+        """
+        使用之前获取的wbi鉴权口令，例如从缓存中恢复
+        """
+        self._wbi_key = wbi_key
+        self._last_refresh_time = refresh_time
+
     @property
     def need_refresh_wbi_key(self):
         return self._wbi_key == '' or (
@@ -158,6 +308,9 @@ class BLiveClient(ws_base.WebSocketClientBase):
     :param uid: B站用户ID，0表示未登录，None表示自动获取
     :param session: cookie、连接池
     :param heartbeat_interval: 发送心跳包的间隔时间（秒）
+    :param heartbeat_scheduler: 共用的心跳调度器，为None时使用自己的定时器
+    :param bootstrap_cache: init_room结果的缓存，只在第一次init_room时读取
+    :param host_scoreboard: 弹幕服务器评分，默认使用进程内共用的评分
     """
 
     def __init__(
@@ -167,9 +320,16 @@ class BLiveClient(ws_base.WebSocketClientBase):
         uid: Optional[int] = None,
         session: Optional[aiohttp.ClientSession] = None,
         heartbeat_interval=30,
+        heartbeat_scheduler: Optional[heartbeat.HeartbeatScheduler] = None,
+        bootstrap_cache: Optional[BootstrapCacheInterface] = None,
+        host_scoreboard: Optional[HostScoreboard] = None,
     ):
-        super().__init__(session, heartbeat_interval)
+        super().__init__(session, heartbeat_interval, heartbeat_scheduler)
         self._wbi_signer = _get_wbi_signer(self._session)
+        self._bootstrap_cache = bootstrap_cache if bootstrap_cache is not None else BootstrapCacheInterface()
+        self._read_bootstrap_cache = bootstrap_cache is not None
+        """是否从缓存读取，重新init_room时说明缓存的值可能已失效，不再读取"""
+        self._host_scoreboard = host_scoreboard if host_scoreboard is not None else _default_host_scoreboard
 
         self._tmp_room_id = room_id
         """用来init_room的临时房间ID，可以用短ID"""
@@ -187,6 +347,18 @@ class BLiveClient(ws_base.WebSocketClientBase):
         self._host_server_token: Optional[str] = None
         """连接弹幕服务器用的token"""
 
+        # 在运行时初始化的字段
+        self._current_host: Optional[str] = None
+        """当前连接的弹幕服务器"""
+        self._connect_start_time: Optional[float] = None
+        """开始建立连接或发送认证包的时间"""
+        self._auth_succeeded = False
+        """当前连接是否已认证成功"""
+        self._attempt_start_time: Optional[float] = None
+        """本次连接流程（init_room + 建连 + 认证）开始的时间"""
+        self._init_room_duration: Optional[float] = None
+        self._time_to_connect: Optional[float] = None
+
     @property
     def tmp_room_id(self) -> int:
         """
@@ -201,6 +373,20 @@ class BLiveClient(ws_base.WebSocketClientBase):
         """
         return self._room_owner_uid
 
+    @property
+    def init_room_duration(self) -> Optional[float]:
+        """
+        上次init_room的耗时（秒）
+        """
+        return self._init_room_duration
+
+    @property
+    def time_to_connect(self) -> Optional[float]:
+        """
+        上次连接从开始（包括init_room）到认证成功的耗时（秒）
+        """
+        return self._time_to_connect
+
     @property
     def uid(self) -> Optional[int]:
         """
@@ -214,29 +400,56 @@ class BLiveClient(ws_base.WebSocketClientBase):
 
         :return: True代表没有降级，如果需要降级后还可用，重载这个函数返回True
         """
-        if self._uid is None:
-            if not await self._init_uid():
-                logger.warning('room=%d _init_uid() failed', self._tmp_room_id)
-                self._uid = 0
+        start_time = time.monotonic()
+
+        async def init_uid():
+            if self._uid is None:
+                if not await self._init_uid():
+                    logger.warning('room=%d _init_uid() failed', self._tmp_room_id)
+                    self._uid = 0
 
-        if self._get_buvid() == '':
-            if not await self._init_buvid():
-                logger.warning('room=%d _init_buvid() failed', self._tmp_room_id)
+        async def init_buvid():
+            if self._get_buvid() == '' and not self._load_buvid_from_cache():
+                if not await self._init_buvid():
+                    logger.warning('room=%d _init_buvid() failed', self._tmp_room_id)
+
+        # uid、buvid、真实房间ID互不依赖，并发请求
+        _, _, room_init_ok = await asyncio.gather(init_uid(), init_buvid(), self._init_room_id_and_owner())
 
         res = True
-        if not await self._init_room_id_and_owner():
+        if not room_init_ok:
             res = False
             # 失败了则降级
             self._room_id = self._tmp_room_id
             self._room_owner_uid = 0
 
+        # 弹幕服务器配置要用真实房间ID
         if not await self._init_host_server():
             res = False
             # 失败了则降级
             self._host_server_list = DEFAULT_DANMAKU_SERVER_LIST
             self._host_server_token = None
+
+        self._read_bootstrap_cache = False
+        self._init_room_duration = time.monotonic() - start_time
+        logger.debug('room=%d init_room() took %.3fs', self._tmp_room_id, self._init_room_duration)
         return res
 
+    def _get_cache(self, kind: str, key) -> Optional[Any]:
+        if not self._read_bootstrap_cache:
+            return None
+        try:
+            return self._bootstrap_cache.get(kind, key)
+        except Exception:  # noqa
+            logger.exception('room=%d bootstrap cache get() failed, kind=%s', self._tmp_room_id, kind)
+            return None
+
+    def _set_cache(self, kind: str, key, value):
+        try:
+            self._bootstrap_cache.set(kind, key, value)
+        except Exception:  # noqa
+            logger.exception('room=%d bootstrap cache set() failed, kind=%s', self._tmp_room_id, kind)
+
     async def _init_uid(self):
         cookies = self._session.cookie_jar.filter_cookies(yarl.URL(UID_INIT_URL))
         sessdata_cookie = cookies.get('SESSDATA', None)
@@ -282,6 +495,13 @@ class BLiveClient(ws_base.WebSocketClientBase):
             return ''
         return buvid_cookie.value
 
+    def _load_buvid_from_cache(self):
+        buvid = self._get_cache('buvid3', '')
+        if not buvid:
+            return False
+        self._session.cookie_jar.update_cookies({'buvid3': buvid}, yarl.URL(BUVID_INIT_URL))
+        return self._get_buvid() != ''
+
     async def _init_buvid(self):
         try:
             async with self._session.get(
@@ -293,9 +513,17 @@ class BLiveClient(ws_base.WebSocketClientBase):
                                    self._tmp_room_id, res.status, res.reason)
         except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
             logger.exception('room=%d _init_buvid() exception:', self._tmp_room_id)
-        return self._get_buvid() != ''
+        buvid = self._get_buvid()
+        if buvid == '':
+            return False
+        self._set_cache('buvid3', '', buvid)
+        return True
 
     async def _init_room_id_and_owner(self):
+        cached = self._get_cache('room_init', self._tmp_room_id)
+        if cached is not None and self._parse_room_init(cached):
+            return True
+
         try:
             async with self._session.get(
                 ROOM_INIT_URL,
@@ -318,6 +546,7 @@ class BLiveClient(ws_base.WebSocketClientBase):
         except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
             logger.exception('room=%d _init_room_id_and_owner() failed:', self._tmp_room_id)
             return False
+        self._set_cache('room_init', self._tmp_room_id, {'room_id': self._room_id, 'uid': self._room_owner_uid})
         return True
 
     def _parse_room_init(self, data):
@@ -326,12 +555,23 @@ class BLiveClient(ws_base.WebSocketClientBase):
         return True
 
     async def _init_host_server(self):
+        cached = self._get_cache('danmu_info', self._room_id)
+        if cached is not None and self._parse_danmaku_server_conf(cached):
+            return True
+
+        if self._wbi_signer.need_refresh_wbi_key:
+            self._load_wbi_key_from_cache()
         if self._wbi_signer.need_refresh_wbi_key:
             await self._wbi_signer.refresh_wbi_key()
             # 如果没刷新成功先用旧的key
             if self._wbi_signer.wbi_key == '':
                 logger.exception('room=%d _init_host_server() failed: no wbi key', self._room_id)
                 return False
+            if self._wbi_signer.last_refresh_time is not None:
+                self._set_cache('wbi_key', '', {
+                    'wbi_key': self._wbi_signer.wbi_key,
+                    'refresh_time': self._wbi_signer.last_refresh_time.timestamp(),
+                })
 
         try:
             async with self._session.get(
@@ -351,6 +591,7 @@ class BLiveClient(ws_base.WebSocketClientBase):
                     if data['code'] == -352:
                         # wbi签名错误
                         self._wbi_signer.reset()
+                        self._set_cache('wbi_key', '', None)
                     logger.warning('room=%d _init_host_server() failed, message=%s', self._room_id, data['message'])
                     return False
                 if not self._parse_danmaku_server_conf(data['data']):
@@ -358,8 +599,25 @@ class BLiveClient(ws_base.WebSocketClientBase):
         except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
             logger.exception('room=%d _init_host_server() failed:', self._room_id)
             return False
+        self._set_cache('danmu_info', self._room_id, {
+            'host_list': self._host_server_list,
+            'token': self._host_server_token,
+        })
         return True
 
+    def _load_wbi_key_from_cache(self):
+        # 缓存不受_read_bootstrap_cache限制，wbi口令是所有房间共用的，失效时会被reset
+        try:
+            cached = self._bootstrap_cache.get('wbi_key', '')
+        except Exception:  # noqa
+            logger.exception('room=%d bootstrap cache get() failed, kind=wbi_key', self._tmp_room_id)
+            return
+        if not cached or not cached.get('wbi_key'):
+            return
+        self._wbi_signer.load_wbi_key(
+            cached['wbi_key'], datetime.datetime.fromtimestamp(cached['refresh_time'])
+        )
+
     def _parse_danmaku_server_conf(self, data):
         self._host_server_list = data['host_list']
         self._host_server_token = data['token']
@@ -372,6 +630,7 @@ class BLiveClient(ws_base.WebSocketClientBase):
         """
         在每次建立连接之前调用，可以用来初始化房间
         """
+        self._attempt_start_time = time.monotonic()
         # 重连次数太多则重新init_room，保险
         reinit_period = max(3, len(self._host_server_list or ()))
         if retry_count > 0 and retry_count % reinit_period == 0:
@@ -382,9 +641,47 @@ class BLiveClient(ws_base.WebSocketClientBase):
         """
         返回WebSocket连接的URL，可以在这里做故障转移和负载均衡
         """
-        host_server = self._host_server_list[retry_count % len(self._host_server_list)]
+        # 失败过的服务器会被扣分，重连时自然换到其他服务器
+        host_server = self._host_scoreboard.choose(self._host_server_list)
+        self._current_host = host_server['host']
+        self._connect_start_time = time.monotonic()
+        self._auth_succeeded = False
         return f"wss://{host_server['host']}:{host_server['wss_port']}/sub"
 
+    async def _on_ws_connect(self):
+        """
+        WebSocket连接成功
+        """
+        now = time.monotonic()
+        if self._current_host is not None:
+            self._host_scoreboard.report_connect(self._current_host, now - self._connect_start_time)
+        self._connect_start_time = now
+        await super()._on_ws_connect()
+
+    def _on_auth_success(self):
+        """
+        收到认证成功的响应
+        """
+        self._auth_succeeded = True
+        now = time.monotonic()
+        if self._current_host is not None:
+            self._host_scoreboard.report_auth(self._current_host, now - self._connect_start_time)
+        if self._attempt_start_time is not None:
+            self._time_to_connect = now - self._attempt_start_time
+            logger.debug('room=%d connected in %.3fs', self._room_id, self._time_to_connect)
+
+    async def _on_ws_close(self):
+        """
+        WebSocket连接断开
+        """
+        if self._current_host is not None:
+            if self._auth_succeeded:
+                self._host_scoreboard.report_disconnect(self._current_host)
+            else:
+                self._host_scoreboard.report_failure(self._current_host)
+            self._current_host = None
+        await super()._on_ws_close()
+
     async def _send_auth(self):
         """
         发送认证包
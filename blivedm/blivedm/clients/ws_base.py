@@ -10,6 +10,7 @@ from typing import *
 import aiohttp
 import brotli
 
+from . import heartbeat
 from .. import handlers, utils
 
 logger = logging.getLogger('blivedm')
@@ -79,18 +80,44 @@ class AuthError(Exception):
 DEFAULT_RECONNECT_POLICY = utils.make_constant_retry_policy(1)
 
 
+class ConnectGateInterface:
+    """
+    连接准入控制接口，用来限制同时初始化房间、建立连接的客户端数量
+
+    客户端每次连接前（包括重连）调用acquire，连接成功并发送认证包后或者连接失败时调用release
+    """
+
+    async def acquire(self, client: 'WebSocketClientBase', retry_count: int):
+        """
+        等待允许连接
+
+        :param client: 要连接的客户端
+        :param retry_count: 本次是第几次重连，0表示首次连接
+        """
+
+    def release(self, client: 'WebSocketClientBase', success: bool):
+        """
+        连接流程结束
+
+        :param client: 客户端
+        :param success: 是否连接成功
+        """
+
+
 class WebSocketClientBase:
     """
     基于WebSocket的客户端
 
     :param session: cookie、连接池
     :param heartbeat_interval: 发送心跳包的间隔时间（秒）
+    :param heartbeat_scheduler: 共用的心跳调度器，为None时每个客户端使用自己的定时器
     """
 
     def __init__(
         self,
         session: Optional[aiohttp.ClientSession] = None,
         heartbeat_interval: float = 30,
+        heartbeat_scheduler: Optional[heartbeat.HeartbeatScheduler] = None,
     ):
         if session is None:
             self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
@@ -101,12 +128,15 @@ class WebSocketClientBase:
             assert self._session.loop is asyncio.get_event_loop()  # noqa
 
         self._heartbeat_interval = heartbeat_interval
+        self._heartbeat_scheduler = heartbeat_scheduler
 
         self._need_init_room = True
         self._handler: Optional[handlers.HandlerInterface] = None
         """消息处理器"""
         self._get_reconnect_interval: Callable[[int, int], float] = DEFAULT_RECONNECT_POLICY
         """重连间隔时间增长策略"""
+        self._connect_gate: Optional[ConnectGateInterface] = None
+        """连接准入控制"""
 
         # 在调用init_room后初始化的字段
         self._room_id: Optional[int] = None
@@ -118,6 +148,8 @@ class WebSocketClientBase:
         """网络协程的future"""
         self._heartbeat_timer_handle: Optional[asyncio.TimerHandle] = None
         """发心跳包定时器的handle"""
+        self._held_connect_gate: Optional[ConnectGateInterface] = None
+        """占用着名额的准入控制"""
 
     @property
     def is_running(self) -> bool:
@@ -152,6 +184,14 @@ class WebSocketClientBase:
         """
         self._get_reconnect_interval = get_reconnect_interval
 
+    def set_connect_gate(self, connect_gate: Optional[ConnectGateInterface]):
+        """
+        设置连接准入控制，下次连接时生效
+
+        :param connect_gate: 准入控制，None表示不限制
+        """
+        self._connect_gate = connect_gate
+
     def start(self):
         """
         启动本客户端
@@ -263,6 +303,7 @@ class WebSocketClientBase:
         total_retry_count = 0
         while True:
             try:
+                await self._acquire_connect_gate(retry_count)
                 await self._on_before_ws_connect(retry_count)
 
                 # 连接
@@ -273,6 +314,7 @@ class WebSocketClientBase:
                 ) as websocket:
                     self._websocket = websocket
                     await self._on_ws_connect()
+                    self._release_connect_gate(True)
 
                     # 处理消息
                     message: aiohttp.WSMessage
@@ -280,6 +322,11 @@ class WebSocketClientBase:
                         await self._on_ws_message(message)
                         # 至少成功处理1条消息
                         retry_count = 0
+                        # 处理器的下游处理不过来时，等它就绪再读下一条，背压传回服务器
+                        if self._handler is not None:
+                            waiter = self._handler.wait_ready(self)
+                            if waiter is not None:
+                                await waiter
 
             except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
                 # 掉线重连
@@ -289,6 +336,7 @@ class WebSocketClientBase:
                 logger.exception('room=%d auth failed, trying init_room() again', self.room_id)
                 self._need_init_room = True
             finally:
+                self._release_connect_gate(False)
                 self._websocket = None
                 await self._on_ws_close()
 
@@ -301,6 +349,23 @@ class WebSocketClientBase:
             )
             await asyncio.sleep(self._get_reconnect_interval(retry_count, total_retry_count))
 
+    async def _acquire_connect_gate(self, retry_count):
+        connect_gate = self._connect_gate
+        if connect_gate is None:
+            return
+        await connect_gate.acquire(self, retry_count)
+        self._held_connect_gate = connect_gate
+
+    def _release_connect_gate(self, success: bool):
+        connect_gate = self._held_connect_gate
+        if connect_gate is None:
+            return
+        self._held_connect_gate = None
+        try:
+            connect_gate.release(self, success)
+        except Exception:  # noqa
+            logger.exception('room=%s _release_connect_gate() failed:', self.room_id)
+
     async def _on_before_ws_connect(self, retry_count):
         """
         在每次建立连接之前调用，可以用来初始化房间
@@ -323,6 +388,9 @@ class WebSocketClientBase:
         WebSocket连接成功
         """
         await self._send_auth()
+        if self._heartbeat_scheduler is not None:
+            self._heartbeat_scheduler.add(self, self._heartbeat_interval, self._send_heartbeat)
+            return
         self._heartbeat_timer_handle = asyncio.get_running_loop().call_later(
             self._heartbeat_interval, self._on_send_heartbeat
         )
@@ -331,6 +399,8 @@ class WebSocketClientBase:
         """
         WebSocket连接断开
         """
+        if self._heartbeat_scheduler is not None:
+            self._heartbeat_scheduler.remove(self)
         if self._heartbeat_timer_handle is not None:
             self._heartbeat_timer_handle.cancel()
             self._heartbeat_timer_handle = None
@@ -341,6 +411,11 @@ class WebSocketClientBase:
         """
         raise NotImplementedError
 
+    def _on_auth_success(self):
+        """
+        收到认证成功的响应
+        """
+
     def _on_send_heartbeat(self):
         """
         定时发送心跳包的回调
@@ -362,7 +437,7 @@ class WebSocketClientBase:
             return
 
         try:
-            await self._websocket.send_bytes(self._make_packet({}, Operation.HEARTBEAT))
+            await self._websocket.send_bytes(HEARTBEAT_PACKET)
         except (ConnectionResetError, aiohttp.ClientConnectionError) as e:
             logger.warning('room=%d _send_heartbeat() failed: %r', self.room_id, e)
         except Exception:  # noqa
@@ -469,7 +544,8 @@ class WebSocketClientBase:
             body = json.loads(body.decode('utf-8'))
             if body['code'] != AuthReplyCode.OK:
                 raise AuthError(f"auth reply error, code={body['code']}, body={body}")
-            await self._websocket.send_bytes(self._make_packet({}, Operation.HEARTBEAT))
+            self._on_auth_success()
+            await self._websocket.send_bytes(HEARTBEAT_PACKET)
 
         else:
             # 未知消息
@@ -492,3 +568,7 @@ class WebSocketClientBase:
             self._handler.handle(self, command)
         except Exception as e:
             logger.exception('room=%d _handle_command() failed, command=%s', self.room_id, command, exc_info=e)
+
+
+HEARTBEAT_PACKET = WebSocketClientBase._make_packet({}, Operation.HEARTBEAT)
+"""心跳包，内容固定，预先生成"""
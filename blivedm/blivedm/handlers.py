@@ -53,6 +53,13 @@ class HandlerInterface:
         当客户端停止时调用。可以在这里close或者重新start
         """
 
+    def wait_ready(self, client: ws_base.WebSocketClientBase) -> Optional[Awaitable]:
+        """
+        每处理完一条WebSocket消息后调用。返回awaitable时，客户端等它完成后才读取下一条消息，
+        用于下游积压时施加背压；返回None表示不用等待
+        """
+        return None
+
 
 def _make_msg_callback(method_name, message_cls):
     def callback(self: 'BaseHandler', client: ws_base.WebSocketClientBase, command: dict):
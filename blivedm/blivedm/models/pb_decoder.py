@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# 手写的protobuf解码，只解析用到的字段，其他字段按wire type跳过。
+# 比pure_protobuf的通用dataclass解码快很多，而且启动时不需要导入pure_protobuf。
+# 字段编号与pb.py中的定义保持一致，pb.py仍作为格式的参考和校验基准。
+#
+from typing import *
+
+__all__ = (
+    'DecodeError',
+    'find_varint',
+    'decode_interact_word_v2',
+)
+
+_Buffer = Union[bytes, bytearray, memoryview]
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+
+class DecodeError(ValueError):
+    """protobuf数据格式错误或被截断"""
+
+
+def _read_varint(buf: memoryview, pos: int) -> Tuple[int, int]:
+    """返回 (值, 下一个位置)"""
+    result = 0
+    shift = 0
+    try:
+        while True:
+            b = buf[pos]
+            pos += 1
+            result |= (b & 0x7F) << shift
+            if b < 0x80:
+                return result, pos
+            shift += 7
+            if shift >= 70:
+                raise DecodeError('varint too long')
+    except IndexError:
+        raise DecodeError('truncated varint') from None
+
+
+def _to_int64(value: int) -> int:
+    """varint按int64解释（负数是64位补码）"""
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+
+def _skip(buf: memoryview, pos: int, wire_type: int) -> int:
+    """跳过一个字段的值，返回下一个位置"""
+    if wire_type == WIRE_VARINT:
+        return _read_varint(buf, pos)[1]
+    if wire_type == WIRE_LENGTH_DELIMITED:
+        length, pos = _read_varint(buf, pos)
+        pos += length
+    elif wire_type == WIRE_FIXED64:
+        pos += 8
+    elif wire_type == WIRE_FIXED32:
+        pos += 4
+    else:
+        raise DecodeError(f'unsupported wire type {wire_type}')
+    if pos > len(buf):
+        raise DecodeError('truncated field')
+    return pos
+
+
+def _read_bytes(buf: memoryview, pos: int) -> Tuple[memoryview, int]:
+    length, pos = _read_varint(buf, pos)
+    end = pos + length
+    if end > len(buf):
+        raise DecodeError('truncated length-delimited field')
+    return buf[pos:end], end
+
+
+def find_varint(data: _Buffer, field_number: int, default: int = 0) -> int:
+    """
+    在消息的顶层字段中找到编号为field_number的varint字段。同一字段出现多次时按protobuf规则取最后一次，
+    与完整解码的结果一致
+
+    :param data: 消息的序列化数据
+    :param field_number: 字段编号
+    :param default: 找不到时的返回值
+    """
+    buf = memoryview(data)
+    pos = 0
+    end = len(buf)
+    value = default
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        wire_type = key & 0x07
+        if wire_type == WIRE_VARINT and key >> 3 == field_number:
+            raw, pos = _read_varint(buf, pos)
+            value = _to_int64(raw)
+            continue
+        pos = _skip(buf, pos, wire_type)
+    return value
+
+
+def _decode_face(buf: memoryview) -> str:
+    """InteractWordV2UserInfo.base(2).face(2)"""
+    face = ''
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        wire_type = key & 0x07
+        if key == (2 << 3 | WIRE_LENGTH_DELIMITED):
+            base, pos = _read_bytes(buf, pos)
+            base_pos = 0
+            base_end = len(base)
+            while base_pos < base_end:
+                base_key, base_pos = _read_varint(base, base_pos)
+                if base_key == (2 << 3 | WIRE_LENGTH_DELIMITED):
+                    value, base_pos = _read_bytes(base, base_pos)
+                    face = str(value, 'utf-8')
+                else:
+                    base_pos = _skip(base, base_pos, base_key & 0x07)
+        else:
+            pos = _skip(buf, pos, wire_type)
+    return face
+
+
+def decode_interact_word_v2(data: _Buffer) -> Tuple[int, str, int, int, str]:
+    """
+    解析InteractWordV2，返回 (uid, uname, msg_type, timestamp, face)
+
+    重复出现的字段以最后一次为准，与protobuf的语义一致
+    """
+    buf = memoryview(data)
+    uid = 0
+    uname = ''
+    msg_type = 0
+    timestamp = 0
+    face = ''
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field_number = key >> 3
+        wire_type = key & 0x07
+        if wire_type == WIRE_VARINT:
+            value, pos = _read_varint(buf, pos)
+            if field_number == 1:
+                uid = _to_int64(value)
+            elif field_number == 5:
+                msg_type = _to_int64(value)
+            elif field_number == 7:
+                timestamp = _to_int64(value)
+        elif wire_type == WIRE_LENGTH_DELIMITED and field_number in (2, 22):
+            value, pos = _read_bytes(buf, pos)
+            if field_number == 2:
+                uname = str(value, 'utf-8')
+            else:
+                face = _decode_face(value)
+        else:
+            pos = _skip(buf, pos, wire_type)
+    return uid, uname, msg_type, timestamp, face
@@ -0,0 +1,105 @@
+"""
+下载前端依赖的第三方库到 web/vendor/，由后端以本地文件提供（可离线使用、可长期缓存）
+
+用法：
+    python scripts/fetch_frontend_assets.py            # 下载缺失的文件，并校验已有文件
+    python scripts/fetch_frontend_assets.py --force    # 重新下载全部
+    python scripts/fetch_frontend_assets.py --pin      # 升级版本后下载并记录新的 SHA-256
+
+版本固定在下面的 ASSETS 中，升级时同时修改 web/index.html 里的 CDN 回退地址。
+每个文件的 SHA-256 固定在 web/vendor/SHA256SUMS（sha256sum 格式，随仓库提交），下载内容或已有文件
+与之不符时报错且不写入；还没有记录的文件需要确认来源后用 --pin 记录，再把 SHA256SUMS 一并提交。
+"""
+import argparse
+import hashlib
+import sys
+import urllib.request
+from pathlib import Path
+from typing import Dict
+
+VENDOR_DIR = Path(__file__).resolve().parents[1] / "web" / "vendor"
+SUMS_FILE = VENDOR_DIR / "SHA256SUMS"
+
+ASSETS = {
+    "hls.min.js": "https://cdn.jsdelivr.net/npm/hls.js@1.5.20/dist/hls.min.js",
+    "DPlayer.min.js": "https://cdn.jsdelivr.net/npm/dplayer@1.27.1/dist/DPlayer.min.js",
+    "DPlayer.min.css": "https://cdn.jsdelivr.net/npm/dplayer@1.27.1/dist/DPlayer.min.css",
+}
+
+
+def load_sums() -> Dict[str, str]:
+    sums: Dict[str, str] = {}
+    if not SUMS_FILE.exists():
+        return sums
+    for line in SUMS_FILE.read_text(encoding="utf-8").splitlines():
+        parts = line.split()
+        if len(parts) == 2:
+            sums[parts[1].lstrip("*")] = parts[0].lower()
+    return sums
+
+
+def save_sums(sums: Dict[str, str]) -> None:
+    SUMS_FILE.write_text("".join(f"{digest}  {name}\n" for name, digest in sorted(sums.items())), encoding="utf-8")
+
+
+def fetch(name: str, url: str, timeout: float = 30) -> bytes:
+    req = urllib.request.Request(url, headers={"User-Agent": "MultipleLive asset fetcher"})
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        body = resp.read()
+    if not body:
+        raise RuntimeError(f"{name}: empty response")
+    return body
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="下载前端第三方库到 web/vendor/")
+    parser.add_argument("--force", action="store_true", help="已存在的文件也重新下载")
+    parser.add_argument("--pin", action="store_true", help="下载全部文件并把它们的 SHA-256 写入 SHA256SUMS")
+    args = parser.parse_args()
+
+    VENDOR_DIR.mkdir(parents=True, exist_ok=True)
+    sums = load_sums()
+    failed = 0
+    for name, url in ASSETS.items():
+        path = VENDOR_DIR / name
+        expected = sums.get(name)
+        if path.exists() and not (args.force or args.pin):
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            if expected is None:
+                print(f"FAIL  {name}: no pinned sha256, run with --pin after checking the source", file=sys.stderr)
+                failed += 1
+            elif digest != expected:
+                print(f"FAIL  {name}: sha256 {digest} does not match pinned {expected}", file=sys.stderr)
+                failed += 1
+            else:
+                print(f"skip  {name} (exists, sha256 ok)")
+            continue
+        if expected is None and not args.pin:
+            print(f"FAIL  {name}: no pinned sha256, run with --pin after checking the source", file=sys.stderr)
+            failed += 1
+            continue
+        try:
+            body = fetch(name, url)
+        except Exception as e:  # noqa: BLE001
+            print(f"FAIL  {name}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        digest = hashlib.sha256(body).hexdigest()
+        if args.pin:
+            sums[name] = digest
+        elif digest != expected:
+            print(f"FAIL  {name}: downloaded sha256 {digest} does not match pinned {expected}", file=sys.stderr)
+            failed += 1
+            continue
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_bytes(body)
+        tmp.replace(path)
+        print(f"ok    {name} {len(body):,} bytes sha256={digest}")
+    if args.pin:
+        save_sums(sums)
+        print(f"pinned hashes written to {SUMS_FILE}; review and commit it")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())